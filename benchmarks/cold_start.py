@@ -0,0 +1,105 @@
+"""
+Cold start benchmark
+    Time to first response of a fresh worker process: create_app, then the
+    first request of each page, without the template bytecode cache (the
+    app before warmup.py), with a precompiled cache, and with the cache
+    and the warm-up in create_app.
+
+Usage (from the project root):
+    $ python -m benchmarks.cold_start --runs 10
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+"""
+Imports:
+    argparse: command line options
+    json: results of a worker, printed on its last line
+    os, shutil, tempfile: copy of the database, the bytecode cache directory
+    statistics: medians over the runs
+    subprocess, sys: each run is a new python process, like a new worker
+    time: timings
+"""
+
+# the pages a new worker is likely to serve first
+PATHS = ('/', '/post/1', '/login', '/about')
+# name -> environment of the worker
+MODES = {
+    'no cache': {'FLASK_TEMPLATE_BYTECODE_CACHE': '0', 'FLASK_WARM_UP': '0'},
+    'bytecode cache': {'FLASK_TEMPLATE_BYTECODE_CACHE': '1', 'FLASK_WARM_UP': '0'},
+    'cache + warm-up': {'FLASK_TEMPLATE_BYTECODE_CACHE': '1', 'FLASK_WARM_UP': '1'},
+}
+
+
+def worker():
+    """One cold worker: print the ms of create_app and of each first request as json"""
+    started = time.perf_counter()
+    from flaskblog import create_app
+    app = create_app()
+    result = {'create_app': time.perf_counter() - started}
+    client = app.test_client()
+    for path in PATHS:
+        request_started = time.perf_counter()
+        status = client.get(path).status_code
+        assert status == 200, (path, status)
+        result[path] = time.perf_counter() - request_started
+    # time to first response: process ready and its first page sent
+    result['first response'] = result['create_app'] + result[PATHS[0]]
+    request_started = time.perf_counter()
+    client.get(PATHS[0])
+    result['warm /'] = time.perf_counter() - request_started
+    print(json.dumps({key: seconds * 1000 for key, seconds in result.items()}))
+
+
+def main():
+    """Run cold workers in each mode and print the median ms"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--runs', type=int, default=10, help='Workers per mode.')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        worker()
+        return
+
+    workdir = tempfile.mkdtemp(prefix='flaskblog-bench-')
+    shutil.copy(os.path.join(os.path.dirname(__file__), '..', 'flaskblog', 'flaskblog.db'),
+                os.path.join(workdir, 'bench.db'))
+    env = dict(os.environ,
+               FLASK_CONFIG='prod',
+               FLASK_SECRET_KEY='benchmark',
+               FLASK_SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(workdir, 'bench.db'),
+               FLASK_MAIL_OUTBOX_WORKER='0',
+               FLASK_PAGE_CACHE_TYPE='null',
+               FLASK_RATE_LIMIT_STORE='memory',
+               FLASK_TEMPLATE_CACHE_DIR=os.path.join(workdir, 'jinja'))
+    command = [sys.executable, '-m', 'benchmarks.cold_start', '--worker']
+    # build step: fill the bytecode cache
+    subprocess.run([sys.executable, '-m', 'flask', 'precompile-templates'], check=True,
+                   env=dict(env, FLASK_APP='run.py'), stdout=subprocess.DEVNULL)
+
+    results = {}
+    for name, mode_env in MODES.items():
+        runs = []
+        for _ in range(args.runs):
+            output = subprocess.run(command, check=True, capture_output=True, text=True,
+                                    env=dict(env, **mode_env)).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        results[name] = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    keys = list(next(iter(results.values())))
+    print(f'median ms of {args.runs} workers')
+    print(f'{"":<16}' + ''.join(f'{key:>16}' for key in keys))
+    for name, medians in results.items():
+        print(f'{name:<16}' + ''.join(f'{medians[key]:>16.1f}' for key in keys))
+
+
+if __name__ == '__main__':
+    main()
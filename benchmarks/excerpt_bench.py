@@ -0,0 +1,104 @@
+"""
+Excerpt benchmark
+    Response bytes and render time of a listing page of long posts, with
+    the full bodies in the page (the listings before the stored excerpts)
+    and with the stored excerpts.
+
+Usage (from the project root):
+    $ python -m benchmarks.excerpt_bench --words 5000 --requests 200
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+"""
+Imports:
+    argparse: command line options
+    os, tempfile: the throwaway database
+    random: post bodies, seeded so runs are comparable
+    statistics, time: timings
+"""
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod '
+         'tempor incididunt ut labore et dolore magna aliqua').split()
+
+# the article of the listings before the excerpts: whole body, date formatted per row
+FULL_BODY_PAGE = '''
+{% extends "layout.html" %}
+{% from "avatar.html" import avatar %}
+{% block content %}
+    {% for post in posts.items %}
+        <article class="media content-section">
+            {{ avatar(post.author.image_file, 'rounded-circle article-img', 65) }}
+            <div class="media-body">
+                <div class="article-metadata">
+                    <a class="mr-2" href="{{ url_for('users.user_posts', username=post.author.username) }}">{{ post.author.username }}</a>
+                    <small class="text-muted">{{ "{date:%A}, {date.day}. {date:%B} {date.year}".format(date=post.date_posted) }}</small>
+                </div>
+                <h2><a class="article-title" href="{{ url_for('posts.post', post_id=post.id) }}">{{ post.title }}</a></h2>
+                <p class="article-content">{{ post.content }}</p>
+            </div>
+        </article>
+    {% endfor %}
+{% endblock content %}
+'''
+
+
+def main():
+    """Seed long posts, time both pages and print bytes and ms per page"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--words', type=int, default=5000, help='Words per post.')
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='flaskblog-bench-')
+    os.environ.setdefault('FLASK_SECRET_KEY', 'benchmark')
+    from flask import render_template_string
+    from flaskblog import create_app, db
+    from flaskblog.config import TestingConfig
+    from flaskblog.models import Post, User
+    from flaskblog.posts.utils import keyset_paginate, listing_query, post_fields
+
+    class BenchConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+
+    app = create_app(BenchConfig)
+    rnd = random.Random(1)
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(id=1, username='bench', email='bench@example.com', password='x'))
+        for number in range(10):
+            # paragraphs of 100 words
+            content = '\n\n'.join(' '.join(rnd.choices(WORDS, k=100))
+                                  for _ in range(args.words // 100))
+            db.session.add(Post(title=f'long post {number}', content=content, user_id=1,
+                                **post_fields(content)))
+        db.session.commit()
+
+    def full_body_page():
+        posts = keyset_paginate(listing_query(bodies=True), None, per_page=5)
+        return render_template_string(FULL_BODY_PAGE, posts=posts)
+    # served like the home page, so both go through the same request handling
+    app.add_url_rule('/full-bodies', 'full_body_page', full_body_page)
+
+    client = app.test_client()
+    results = {}
+    for name, path in (('full bodies', '/full-bodies'), ('excerpts', '/')):
+        timings = []
+        for _ in range(args.requests):
+            started = time.perf_counter()
+            body = client.get(path).data
+            timings.append(time.perf_counter() - started)
+        results[name] = (len(body), statistics.median(timings) * 1000)
+
+    print(f'5 posts of {args.words} words per page')
+    print(f'{"page":<12} {"bytes":>9} {"ms":>7}')
+    for name, (size, ms) in results.items():
+        print(f'{name:<12} {size:>9} {ms:>7.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Password hashing benchmark
+    Logins per second per core at each bcrypt cost (one check_password per
+    login), and the throughput of the hashing pool with several processes.
+
+Usage (from the project root):
+    $ python -m benchmarks.hashing_bench --costs 10 11 12 13 --workers 4
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+"""
+Imports:
+    argparse: command line options
+    os: cpu count
+    time: timings
+    concurrent.futures: the same pool type users.hashing uses
+"""
+
+
+def logins_per_second(hashed, seconds, workers=1):
+    """Checks of hashed completed per second, single core or a pool"""
+    from flaskblog.users.hashing import _check
+    done = 0
+    started = time.perf_counter()
+    if workers == 1:
+        while time.perf_counter() - started < seconds:
+            _check(hashed, 'benchmark-password')
+            done += 1
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            while time.perf_counter() - started < seconds:
+                futures = [pool.submit(_check, hashed, 'benchmark-password')
+                           for _ in range(workers)]
+                done += sum(1 for future in futures if future.result())
+    return done / (time.perf_counter() - started)
+
+
+def main():
+    """Print logins/s for each cost"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--costs', type=int, nargs='+', default=[10, 11, 12, 13])
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--seconds', type=float, default=3.0)
+    args = parser.parse_args()
+
+    from flaskblog.users.hashing import _hash
+    print(f'{"cost":>4} {"ms/login":>9} {"logins/s/core":>14} {"logins/s pool":>14}')
+    for cost in args.costs:
+        hashed = _hash('bcrypt', cost, 'benchmark-password')
+        per_core = logins_per_second(hashed, args.seconds)
+        pooled = logins_per_second(hashed, args.seconds, args.workers)
+        print(f'{cost:>4} {1000 / per_core:>9.1f} {per_core:>14.1f} {pooled:>14.1f}')
+    print(f'pool: {args.workers} processes')
+
+
+if __name__ == '__main__':
+    main()
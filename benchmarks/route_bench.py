@@ -0,0 +1,520 @@
+"""
+Route benchmark
+    Seeds a synthetic site (users, avatars, posts) into a temporary sqlite
+    database and drives the blueprint routes, through the flask test client
+    and through a threaded HTTP load generator against a local server.
+    Reports p50/p95/p99 latency, requests/s and queries per request, over
+    http also the time to first byte and the bytes on the wire, and stores
+    them as json so runs of two commits can be diffed.
+
+Usage (from the project root):
+    $ python -m benchmarks.route_bench --scale 10k
+    $ python -m benchmarks.route_bench --scale 100k --mode http --concurrency 16
+    $ python -m benchmarks.route_bench --scale 10k --compare benchmarks/results/old.json
+    $ python -m benchmarks.route_bench --diff old.json new.json
+    $ python -m benchmarks.route_bench --mode http --no-streaming --accept-encoding identity
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+"""
+Imports:
+    argparse: command line options
+    http.client: the load generator's requests
+    json: the results file
+    logging: quiet the local server's request log
+    os, shutil, tempfile: the seeded database and the copy of each run
+    platform, subprocess: python version and git commit of the results
+    random: synthetic dataset and request mix, seeded so runs are comparable
+    threading: load generator threads, the local server, the query counter
+    time: timings
+    datetime, timedelta: date_posted of the seeded posts
+    urllib.parse.urlencode: form bodies
+
+Dataset per --scale: posts, and one user per POSTS_PER_USER posts. Every
+other user gets an avatar of their own (image_file), the pages only link
+to the pictures, so no picture files are written. All users share the
+password PASSWORD, hashed with the configured method and cost, so the
+login scenario measures the real hashing cost.
+
+Over http, time to first byte is when the status line and headers
+arrived, a streamed page sends them with its head, a whole page with
+all of it. Bytes on the wire are the body as sent, compressed when the
+load generator's Accept-Encoding (--accept-encoding) allows it.
+
+The seeded database is kept in the temp directory per scale and seed and
+reused by later runs (--reseed to rebuild it). Each run works on a copy,
+the write scenarios add posts.
+"""
+
+SCALES = {'10k': 10000, '100k': 100000, '1m': 1000000}
+POSTS_PER_USER = 20
+PASSWORD = 'benchmark'
+INSERT_BATCH = 10000
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod '
+         'tempor incididunt ut labore et dolore magna aliqua enim ad minim veniam '
+         'quis nostrud exercitation ullamco laboris nisi aliquip ex ea commodo').split()
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def _bench_config(config_class, path, args):
+    """config_class pointed at path, without background threads and CSRF"""
+    class BenchConfig(config_class):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + path
+        SQLALCHEMY_REPLICA_URIS = []
+        MAIL_OUTBOX_WORKER = False
+        # the load generator posts forms without a csrf token
+        WTF_CSRF_ENABLED = False
+        # measure the routes, not the page cache, unless asked
+        PAGE_CACHE_TYPE = config_class.PAGE_CACHE_TYPE if args.page_cache else 'null'
+        INSTRUMENTATION = False
+        # the login scenario would hit the login limits
+        RATE_LIMIT_STORE = 'null'
+        STREAM_TEMPLATES = not args.no_streaming
+        COMPRESSION = not args.no_compression
+    if args.bcrypt_rounds:
+        BenchConfig.BCRYPT_LOG_ROUNDS = args.bcrypt_rounds
+    return BenchConfig
+
+
+def seed(app, posts, rnd):
+    """Insert the users and posts of the dataset, {'users', 'avatars', 'posts'}"""
+    from flaskblog import db
+    from flaskblog.archive.utils import add_month_counts
+    from flaskblog.models import Post, User
+    from flaskblog.posts.utils import post_fields
+    from flaskblog.search.utils import search_index
+    from flaskblog.users.hashing import hash_password
+
+    with app.app_context():
+        db.create_all()
+        users = max(1, posts // POSTS_PER_USER)
+        hashed = hash_password(PASSWORD)
+        rows = [{'id': n, 'username': f'user{n}', 'email': f'user{n}@example.com',
+                 'image_file': f'u{n:07}.jpg' if n % 2 else 'default.jpg',
+                 'password': hashed, 'version': 1}
+                for n in range(1, users + 1)]
+        db.session.execute(User.__table__.insert(), rows)
+        db.session.commit()
+
+        # one post every 5 minutes, ending now
+        started = datetime.utcnow() - timedelta(minutes=5 * posts)
+        for first in range(1, posts + 1, INSERT_BATCH):
+            batch = []
+            for post_id in range(first, min(first + INSERT_BATCH, posts + 1)):
+                date_posted = started + timedelta(minutes=5 * post_id)
+                content = ' '.join(rnd.choices(WORDS, k=rnd.randint(30, 300)))
+                batch.append(dict(post_fields(content), id=post_id,
+                                  title=' '.join(rnd.choices(WORDS, k=rnd.randint(3, 8))),
+                                  content=content, user_id=rnd.randint(1, users),
+                                  date_posted=date_posted, date_modified=date_posted))
+            db.session.execute(Post.__table__.insert(), batch)
+            add_month_counts(db.session.connection(), batch)
+            search_index().add_many(batch)
+            db.session.commit()
+        return {'users': users, 'avatars': (users + 1) // 2, 'posts': posts}
+
+
+def seeded_database(config_class, args):
+    """Path of the seeded database of args.scale, and its dataset sizes"""
+    from flaskblog import create_app
+
+    path = os.path.join(tempfile.gettempdir(),
+                        f'flaskblog-bench-{args.scale}-{args.seed}-{config_class.__name__}.db')
+    info_path = path + '.json'
+    if args.reseed or not os.path.exists(info_path):
+        for stale in (path, info_path):
+            if os.path.exists(stale):
+                os.remove(stale)
+        started = time.perf_counter()
+        app = create_app(_bench_config(config_class, path, args))
+        dataset = seed(app, SCALES[args.scale], random.Random(args.seed))
+        dataset['seed_seconds'] = round(time.perf_counter() - started, 1)
+        with open(info_path, 'w', encoding='utf-8') as info_file:
+            json.dump(dataset, info_file)
+    with open(info_path, encoding='utf-8') as info_file:
+        return path, json.load(info_file)
+
+
+def scenarios(app, dataset):
+    """
+    {name: (needs login, expected status, request(rnd, user) -> (method, path, form))}
+    user is the number of the logged in user
+    """
+    from flaskblog.models import Post
+    from flaskblog.posts.utils import CURSOR_NEXT, encode_cursor, listing_query
+
+    # the middle of the listing, by keyset cursor and by ?page=
+    middle = dataset['posts'] // 2
+    with app.app_context():
+        post = listing_query().offset(middle).first() or Post.query.first()
+        deep_cursor = encode_cursor(CURSOR_NEXT, post)
+    deep_page = middle // 5 + 1
+
+    def random_post(rnd, user):
+        return 'GET', f'/post/{rnd.randint(1, dataset["posts"])}', None
+
+    def random_user(rnd, user):
+        return 'GET', f'/user/user{rnd.randint(1, dataset["users"])}', None
+
+    def login(rnd, user):
+        number = rnd.randint(1, dataset['users'])
+        return 'POST', '/login', {'email': f'user{number}@example.com', 'password': PASSWORD}
+
+    def new_post(rnd, user):
+        return 'POST', '/post/new', {'title': 'benchmark post',
+                                     'content': ' '.join(rnd.choices(WORDS, k=100))}
+
+    def account_update(rnd, user):
+        # unchanged username and email: validation, the version bump and the commit
+        return 'POST', '/account', {'username': f'user{user}', 'email': f'user{user}@example.com'}
+
+    return {
+        'home': (False, 200, lambda rnd, user: ('GET', '/', None)),
+        'home_deep_cursor': (False, 200, lambda rnd, user: ('GET', f'/?cursor={deep_cursor}', None)),
+        'home_deep_offset': (False, 200, lambda rnd, user: ('GET', f'/?page={deep_page}', None)),
+        'post': (False, 200, random_post),
+        'user_posts': (False, 200, random_user),
+        'login': (False, 302, login),
+        'new_post': (True, 302, new_post),
+        'account': (True, 200, lambda rnd, user: ('GET', '/account', None)),
+        'account_update': (True, 302, account_update),
+    }
+
+
+class QueryCounter:
+    """Counts the statements of every engine of the process"""
+
+    def __init__(self):
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(Engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        with self._lock:
+            self.count += 1
+
+    def reset(self):
+        with self._lock:
+            self.count = 0
+
+
+def percentile(ordered, fraction):
+    """Nearest rank percentile of an ordered list"""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summary(latencies, errors, seconds, queries, first_bytes=None, sizes=None):
+    """
+    Result of one scenario, latencies in seconds
+    first_bytes, sizes: time to first byte (seconds) and body bytes of
+    each request, over http
+    """
+    ordered = sorted(latencies)
+    requests = len(ordered)
+    result = {'requests': requests, 'errors': errors,
+              'p50_ms': round(percentile(ordered, 0.50) * 1000, 3),
+              'p95_ms': round(percentile(ordered, 0.95) * 1000, 3),
+              'p99_ms': round(percentile(ordered, 0.99) * 1000, 3),
+              'rps': round(requests / seconds, 1) if seconds else 0.0,
+              'queries_per_request': round(queries / requests, 2) if requests else 0.0}
+    if first_bytes:
+        ordered = sorted(first_bytes)
+        result['ttfb_p50_ms'] = round(percentile(ordered, 0.50) * 1000, 3)
+        result['ttfb_p95_ms'] = round(percentile(ordered, 0.95) * 1000, 3)
+    if sizes:
+        result['bytes_per_request'] = round(sum(sizes) / len(sizes))
+    return result
+
+
+def run_client(app, plan, counter, args):
+    """Each scenario through the test client, one request at a time"""
+    rnd = random.Random(args.seed)
+    member = app.test_client()
+    response = member.post('/login', data={'email': 'user1@example.com', 'password': PASSWORD})
+    assert response.status_code == 302, 'benchmark login failed'
+    results = {}
+    for name, (needs_login, expected, make_request) in plan.items():
+        latencies = []
+        errors = 0
+        for number in range(args.warmup + args.requests):
+            # anonymous scenarios get a fresh client, no session cookie
+            client = member if needs_login else app.test_client()
+            method, path, form = make_request(rnd, 1)
+            if number == args.warmup:
+                counter.reset()
+                run_started = time.perf_counter()
+            started = time.perf_counter()
+            response = client.open(path, method=method, data=form)
+            if number >= args.warmup:
+                latencies.append(time.perf_counter() - started)
+                errors += response.status_code != expected
+        results[name] = summary(latencies, errors, time.perf_counter() - run_started, counter.count)
+    return results
+
+
+class HttpSession:
+    """
+    Cookies of one load generator thread. After each request first_byte
+    is the seconds until its headers arrived, wire_bytes the body size.
+    """
+
+    def __init__(self, port, accept_encoding=None):
+        self.port = port
+        self.accept_encoding = accept_encoding
+        self.cookies = {}
+        self.first_byte = 0.0
+        self.wire_bytes = 0
+
+    def request(self, method, path, form=None):
+        """Status of the response, the body is read and dropped"""
+        body = urlencode(form) if form else None
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'} if body else {}
+        if self.accept_encoding:
+            headers['Accept-Encoding'] = self.accept_encoding
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{key}={value}' for key, value in self.cookies.items())
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        try:
+            started = time.perf_counter()
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            self.first_byte = time.perf_counter() - started
+            # http.client does not decode, this is the body as sent
+            self.wire_bytes = len(response.read())
+            for header in response.msg.get_all('Set-Cookie') or []:
+                key, _, value = header.split(';', 1)[0].partition('=')
+                self.cookies[key.strip()] = value
+            return response.status
+        finally:
+            connection.close()
+
+
+def run_http(app, plan, counter, args):
+    """Each scenario from args.concurrency threads against a threaded local server"""
+    from werkzeug.serving import make_server
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    try:
+        # one logged in user per thread, for the whole run
+        members = []
+        for number in range(1, args.concurrency + 1):
+            member = HttpSession(server.server_port, args.accept_encoding)
+            status = member.request('POST', '/login', {'email': f'user{number}@example.com',
+                                                       'password': PASSWORD})
+            assert status == 302, 'benchmark login failed'
+            members.append(member)
+
+        results = {}
+        per_thread = max(1, args.requests // args.concurrency)
+        for name, (needs_login, expected, make_request) in plan.items():
+            latencies = []
+            first_bytes = []
+            sizes = []
+            errors = [0]
+            lock = threading.Lock()
+
+            def worker(number, warmup):
+                rnd = random.Random(args.seed + number)
+                own = []
+                own_first_bytes = []
+                own_sizes = []
+                failed = 0
+                for _ in range(args.warmup if warmup else per_thread):
+                    session = members[number] if needs_login else \
+                        HttpSession(server.server_port, args.accept_encoding)
+                    method, path, form = make_request(rnd, number + 1)
+                    started = time.perf_counter()
+                    status = session.request(method, path, form)
+                    own.append(time.perf_counter() - started)
+                    own_first_bytes.append(session.first_byte)
+                    own_sizes.append(session.wire_bytes)
+                    failed += status != expected
+                if not warmup:
+                    with lock:
+                        latencies.extend(own)
+                        first_bytes.extend(own_first_bytes)
+                        sizes.extend(own_sizes)
+                        errors[0] += failed
+
+            for warmup in (True, False):
+                counter.reset()
+                run_started = time.perf_counter()
+                threads = [threading.Thread(target=worker, args=(number, warmup))
+                           for number in range(args.concurrency)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            results[name] = summary(latencies, errors[0], time.perf_counter() - run_started,
+                                    counter.count, first_bytes, sizes)
+        return results
+    finally:
+        server.shutdown()
+
+
+def git_commit():
+    """Short hash of HEAD, with a + when the tree has changes, or None"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                               capture_output=True, text=True, check=True).stdout.strip()
+        return commit + ('+' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    """Table of the scenarios of each mode"""
+    for mode, scenario_results in results.items():
+        print(f'\n{mode}')
+        # time to first byte and bytes on the wire are measured over http
+        wire = mode == 'http'
+        print(f'{"scenario":<18} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} '
+              f'{"req/s":>8} {"queries":>8} {"errors":>7}'
+              + (f' {"ttfb p50":>9} {"ttfb p95":>9} {"bytes":>8}' if wire else ''))
+        for name, result in scenario_results.items():
+            print(f'{name:<18} {result["p50_ms"]:>8.2f} {result["p95_ms"]:>8.2f} '
+                  f'{result["p99_ms"]:>8.2f} {result["rps"]:>8.1f} '
+                  f'{result["queries_per_request"]:>8.2f} {result["errors"]:>7}'
+                  + (f' {result["ttfb_p50_ms"]:>9.2f} {result["ttfb_p95_ms"]:>9.2f} '
+                     f'{result["bytes_per_request"]:>8}' if wire else ''))
+
+
+def diff(old, new, threshold):
+    """Print the changes from the old to the new results, ! marks regressions"""
+    print(f'{old["meta"].get("commit")} -> {new["meta"].get("commit")}')
+    # higher is worse for all but rps
+    metrics = (('p50_ms', 1), ('p95_ms', 1), ('p99_ms', 1), ('rps', -1),
+               ('queries_per_request', 1), ('ttfb_p50_ms', 1), ('bytes_per_request', 1))
+    for mode, scenario_results in new['results'].items():
+        print(f'\n{mode}')
+        print(f'{"scenario":<18} ' + ' '.join(f'{metric:>21}' for metric, _ in metrics))
+        for name, result in scenario_results.items():
+            before = old['results'].get(mode, {}).get(name)
+            if before is None:
+                continue
+            cells = []
+            for metric, worse in metrics:
+                # the test client, and results of older commits, have no ttfb and bytes
+                if metric not in result or metric not in before:
+                    cells.append(f'{"-":>23}')
+                    continue
+                change = (result[metric] - before[metric]) / before[metric] * 100 \
+                    if before[metric] else 0.0
+                flag = '!' if change * worse > threshold else ' '
+                cells.append(f'{before[metric]:>8.2f} {result[metric]:>8.2f}{change:>+4.0f}%{flag}')
+            print(f'{name:<18} ' + ' '.join(cells))
+
+
+def main():
+    """Seed, run the scenarios, store and print the results"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--scale', choices=SCALES, default='10k')
+    parser.add_argument('--config', choices=('dev', 'prod'), default='dev',
+                        help='Config profile of the app.')
+    parser.add_argument('--mode', choices=('client', 'http', 'both'), default='both')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='Measured requests per scenario.')
+    parser.add_argument('--warmup', type=int, default=10,
+                        help='Unmeasured requests per scenario (per thread over http).')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='Load generator threads of the http mode.')
+    parser.add_argument('--scenario', action='append',
+                        help='Only this scenario, repeatable.')
+    parser.add_argument('--page-cache', action='store_true',
+                        help="Keep the profile's page cache, off by default.")
+    parser.add_argument('--accept-encoding', default='gzip, deflate, br',
+                        help="Accept-Encoding of the http mode, 'identity' for none.")
+    parser.add_argument('--no-streaming', action='store_true',
+                        help='Render the listing pages whole (STREAM_TEMPLATES off).')
+    parser.add_argument('--no-compression', action='store_true',
+                        help='Send responses uncompressed (COMPRESSION off).')
+    parser.add_argument('--bcrypt-rounds', type=int,
+                        help='Override BCRYPT_LOG_ROUNDS, ie. 4 for quick runs.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--reseed', action='store_true',
+                        help='Rebuild the seeded database.')
+    parser.add_argument('--output', help='Results file, default benchmarks/results/<commit>-<scale>.json')
+    parser.add_argument('--compare', metavar='BASELINE', help='Diff the results against this file.')
+    parser.add_argument('--diff', nargs=2, metavar=('OLD', 'NEW'),
+                        help='Only diff two results files.')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='Percent change marked as a regression.')
+    args = parser.parse_args()
+
+    if args.diff:
+        with open(args.diff[0], encoding='utf-8') as old, open(args.diff[1], encoding='utf-8') as new:
+            diff(json.load(old), json.load(new), args.threshold)
+        return
+
+    os.environ.setdefault('FLASK_SECRET_KEY', 'benchmark')
+    from flaskblog import create_app
+    from flaskblog.config import CONFIGS
+
+    config_class = CONFIGS[args.config]
+    seeded, dataset = seeded_database(config_class, args)
+    workdir = tempfile.mkdtemp(prefix='flaskblog-bench-')
+    path = os.path.join(workdir, 'bench.db')
+    shutil.copy(seeded, path)
+    try:
+        app = create_app(_bench_config(config_class, path, args))
+        plan = scenarios(app, dataset)
+        if args.scenario:
+            plan = {name: plan[name] for name in args.scenario}
+        counter = QueryCounter()
+        results = {}
+        if args.mode in ('client', 'both'):
+            results['client'] = run_client(app, plan, counter, args)
+        if args.mode in ('http', 'both'):
+            results['http'] = run_http(app, plan, counter, args)
+    finally:
+        shutil.rmtree(workdir)
+
+    commit = git_commit()
+    report = {
+        'meta': {'commit': commit, 'date': datetime.utcnow().isoformat(timespec='seconds'),
+                 'python': platform.python_version(), 'platform': platform.platform(),
+                 'cpus': os.cpu_count(),
+                 'options': {key: value for key, value in vars(args).items()
+                             if key not in ('output', 'compare', 'diff', 'reseed')}},
+        'dataset': dataset,
+        'results': results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f'{commit or "unknown"}-{args.scale}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as output_file:
+        json.dump(report, output_file, indent=2)
+
+    print(f'{dataset["posts"]} posts, {dataset["users"]} users ({dataset["avatars"]} avatars), '
+          f'{args.config} profile')
+    print_results(results)
+    print(f'\nresults stored in {output}')
+    if args.compare:
+        print()
+        with open(args.compare, encoding='utf-8') as baseline:
+            diff(json.load(baseline), report, args.threshold)
+
+
+if __name__ == '__main__':
+    main()
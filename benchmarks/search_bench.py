@@ -0,0 +1,104 @@
+"""
+Search benchmark
+    Seeds a synthetic corpus into a temporary sqlite database, indexes it
+    and times search queries against the fts5 and the python index.
+
+Usage (from the project root):
+    $ python -m benchmarks.search_bench --posts 1000000 --index fts5
+    $ python -m benchmarks.search_bench --posts 100000 --index memory
+"""
+import argparse
+import itertools
+import os
+import random
+import statistics
+import tempfile
+import time
+
+"""
+Imports:
+    argparse: command line options
+    itertools: cumulative word weights
+    os, tempfile: the throwaway database
+    random: synthetic corpus, seeded so runs are comparable
+    statistics, time: timings
+"""
+
+# zipf-like vocabulary: a few very common words, many rare ones
+VOCABULARY = [f'word{i}' for i in range(50000)]
+CUM_WEIGHTS = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(len(VOCABULARY))))
+
+
+def make_posts(count, rnd):
+    """Yield post rows of 20-300 words"""
+    for post_id in range(1, count + 1):
+        words = rnd.choices(VOCABULARY, cum_weights=CUM_WEIGHTS, k=rnd.randint(20, 300))
+        yield {'id': post_id, 'title': ' '.join(words[:6]), 'content': ' '.join(words),
+               'user_id': 1}
+
+
+def main():
+    """Seed, index, search and print the timings"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--posts', type=int, default=1000000)
+    parser.add_argument('--index', choices=('fts5', 'memory'), default='fts5')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='flaskblog-bench-')
+    os.environ['FLASK_SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    os.environ.setdefault('FLASK_SECRET_KEY', 'benchmark')
+
+    from datetime import datetime
+    from flaskblog import create_app, db
+    from flaskblog.models import Post, User
+    from flaskblog.search.utils import FTS5Index, MemoryIndex
+
+    app = create_app()
+    rnd = random.Random(42)
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(id=1, username='bench', email='bench@demo.com', password='x'))
+        db.session.commit()
+        index = FTS5Index() if args.index == 'fts5' else MemoryIndex()
+        app.extensions['search_index'] = index
+
+        started = time.perf_counter()
+        batch = []
+        now = datetime.utcnow()
+        for row in make_posts(args.posts, rnd):
+            batch.append(row)
+            if len(batch) == args.batch_size:
+                db.session.execute(Post.__table__.insert(),
+                                   [dict(r, date_posted=now, date_modified=now) for r in batch])
+                index.add_many(batch)
+                db.session.commit()
+                batch = []
+        if batch:
+            db.session.execute(Post.__table__.insert(),
+                               [dict(r, date_posted=now, date_modified=now) for r in batch])
+            index.add_many(batch)
+            db.session.commit()
+        seconds = time.perf_counter() - started
+        print(f'seeded and indexed {args.posts} posts in {seconds:.1f}s '
+              f'({args.posts / seconds:.0f} posts/s)')
+        if args.index == 'memory':
+            # the posts were indexed while seeding
+            index._built = True  # pylint: disable=protected-access
+
+        # one common, one mid frequency and one rare word per query
+        timings = []
+        for _ in range(args.queries):
+            q = ' '.join((rnd.choice(VOCABULARY[:20]), rnd.choice(VOCABULARY[20:2000]),
+                          rnd.choice(VOCABULARY[2000:20000])))
+            started = time.perf_counter()
+            index.search(q, page=1, per_page=5)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        print(f'{args.queries} queries: p50 {statistics.median(timings):.2f}ms '
+              f'p95 {timings[int(len(timings) * 0.95) - 1]:.2f}ms max {timings[-1]:.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+Server benchmark
+    Load test of the development server (python run.py, debug on) and the
+    production server (python run.py --production) over the same copy of
+    the bundled database, then of the production server while its workers
+    are recycled by max-requests and it is reloaded with SIGHUP, counting
+    the requests that fail.
+
+Usage (from the project root):
+    $ python -m benchmarks.server_bench --seconds 10 --concurrency 16 --workers 4
+"""
+import argparse
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from benchmarks.route_bench import HttpSession, summary
+
+"""
+Imports:
+    argparse: command line options
+    os, shutil, tempfile: copy of the database, the server's files
+    signal: SIGHUP to the production master, stopping the servers
+    socket: a free port per server
+    subprocess, sys: each server is a python run.py process
+    threading: load generator threads, the SIGHUP timer
+    time: timings
+    benchmarks.route_bench:
+        HttpSession, one connection per request like a browser without keep-alive
+        summary, p50/p95/p99 and requests/s
+
+Page cache off: the servers render every page, the numbers compare how
+they schedule the app's work, not how often they skip it.
+"""
+
+# the mix of anonymous page views
+PATHS = ('/', '/post/1', '/about', '/user/ben')
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(arguments, env, port):
+    """Start python run.py arguments on port, return the process once /healthz answers"""
+    process = subprocess.Popen([sys.executable, 'run.py', '--bind', f'127.0.0.1:{port}']
+                               + arguments, env=env, start_new_session=True,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if HttpSession(port).request('GET', '/healthz') == 200:
+                return process
+        except OSError:
+            time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError(f'server {arguments} did not start')
+
+
+def stop_server(process):
+    """Stop the server and its children (the reloader's, the workers)"""
+    os.killpg(process.pid, signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+
+
+def load(port, seconds, concurrency):
+    """GET PATHS round robin from concurrency threads for seconds"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def worker(number):
+        session = HttpSession(port)
+        own = []
+        failed = 0
+        index = number
+        while time.perf_counter() < deadline:
+            path = PATHS[index % len(PATHS)]
+            index += 1
+            started = time.perf_counter()
+            try:
+                failed += session.request('GET', path) != 200
+            except OSError:
+                # refused or reset: a dropped request
+                failed += 1
+            own.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(own)
+            errors[0] += failed
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summary(latencies, errors[0], time.perf_counter() - started, 0)
+
+
+def main():
+    """Run the load against each server and print the results"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--max-requests', type=int, default=200,
+                        help='Worker recycling during the reload run.')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='flaskblog-bench-')
+    shutil.copy(os.path.join('flaskblog', 'flaskblog.db'), os.path.join(workdir, 'bench.db'))
+    env = dict(os.environ,
+               FLASK_CONFIG='prod',
+               FLASK_SECRET_KEY='benchmark',
+               FLASK_SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(workdir, 'bench.db'),
+               FLASK_MAIL_OUTBOX_WORKER='0',
+               FLASK_PAGE_CACHE_TYPE='null',
+               FLASK_RATE_LIMIT_PATH=os.path.join(workdir, 'rate-limits.db'),
+               FLASK_TEMPLATE_CACHE_DIR=os.path.join(workdir, 'jinja'))
+    runs = (
+        ('debug server', [], env),
+        (f'production x{args.workers}', ['--production', '--workers', str(args.workers)], env),
+        (f'production x{args.workers}, max-requests {args.max_requests} + SIGHUP',
+         ['--production', '--workers', str(args.workers)],
+         dict(env, FLASK_MAX_REQUESTS=str(args.max_requests))),
+    )
+    results = {}
+    try:
+        for name, arguments, run_env in runs:
+            port = _free_port()
+            process = start_server(arguments, run_env, port)
+            try:
+                reload = None
+                if 'SIGHUP' in name:
+                    # mid-run: new workers start, the old ones finish their requests
+                    reload = threading.Timer(args.seconds / 2, os.kill,
+                                             (process.pid, signal.SIGHUP))
+                    reload.start()
+                results[name] = load(port, args.seconds, args.concurrency)
+                if reload is not None:
+                    reload.join()
+            finally:
+                stop_server(process)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f'{args.concurrency} clients, {args.seconds:.0f}s per server, pages {", ".join(PATHS)}')
+    print(f'{"server":<48} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"errors":>7}')
+    for name, result in results.items():
+        print(f'{name:<48} {result["rps"]:>8.1f} {result["p50_ms"]:>8.1f} '
+              f'{result["p95_ms"]:>8.1f} {result["p99_ms"]:>8.1f} {result["errors"]:>7}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Sqlite load benchmark
+    Concurrent readers (the home page) and writers (new posts) against a copy
+    of the bundled database, once with the default profile (rollback journal,
+    a new connection per request) and once with the production profile
+    (WAL, synchronous=NORMAL, mmap, pooled connections).
+
+Usage (from the project root):
+    $ python -m benchmarks.sqlite_load_bench --readers 8 --writers 2 --seconds 10
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+"""
+Imports:
+    argparse: command line options
+    os, shutil, tempfile: the database copy of each run
+    threading: concurrent readers and writers
+    time: timings
+"""
+
+
+def run(config_class, args):
+    """(reads/s, writes/s, failed requests) of one profile"""
+    from sqlalchemy.exc import OperationalError
+    from flaskblog import create_app, db
+    from flaskblog.models import Post
+
+    workdir = tempfile.mkdtemp(prefix='flaskblog-bench-')
+    path = os.path.join(workdir, 'bench.db')
+    shutil.copy(os.path.join(os.path.dirname(__file__), '..', 'flaskblog', 'flaskblog.db'), path)
+
+    class BenchConfig(config_class):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + path
+        # measure the database, not the page cache
+        PAGE_CACHE_TYPE = 'null'
+        MAIL_OUTBOX_WORKER = False
+
+    app = create_app(BenchConfig)
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+    stop = time.perf_counter() + args.seconds
+
+    def count(key):
+        with lock:
+            counts[key] += 1
+
+    def reader():
+        client = app.test_client()
+        while time.perf_counter() < stop:
+            response = client.get('/')
+            count('reads' if response.status_code == 200 else 'errors')
+
+    def writer():
+        with app.app_context():
+            while time.perf_counter() < stop:
+                try:
+                    db.session.add(Post(title='load test', content='lorem ipsum ' * 50, user_id=1))
+                    db.session.commit()
+                    count('writes')
+                except OperationalError:
+                    db.session.rollback()
+                    count('errors')
+            db.session.remove()
+
+    threads = [threading.Thread(target=reader) for _ in range(args.readers)] + \
+              [threading.Thread(target=writer) for _ in range(args.writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+    shutil.rmtree(workdir)
+    return counts['reads'] / seconds, counts['writes'] / seconds, counts['errors']
+
+
+def main():
+    """Run both profiles and print reads/s and writes/s"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    args = parser.parse_args()
+    os.environ.setdefault('FLASK_SECRET_KEY', 'benchmark')
+
+    from flaskblog.config import DevelopmentConfig, ProductionConfig
+    print(f'{args.readers} readers, {args.writers} writers, {args.seconds:.0f}s per profile')
+    print(f'{"profile":<8} {"reads/s":>9} {"writes/s":>9} {"errors":>7}')
+    for name, config_class in (('dev', DevelopmentConfig), ('prod', ProductionConfig)):
+        reads, writes, errors = run(config_class, args)
+        print(f'{name:<8} {reads:>9.1f} {writes:>9.1f} {errors:>7}')
+
+
+if __name__ == '__main__':
+    main()
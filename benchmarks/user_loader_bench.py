@@ -0,0 +1,82 @@
+"""
+User loader benchmark
+    Database queries and time per authenticated request, with the user
+    cache disabled (USER_CACHE_TTL=0) and enabled.
+
+Usage (from the project root):
+    $ python -m benchmarks.user_loader_bench --requests 2000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+"""
+Imports:
+    argparse: command line options
+    os, tempfile: the throwaway database
+    time: timings
+"""
+
+# views a logged in user hits, /register only checks current_user.is_authenticated
+PATHS = ('/register', '/account', '/about')
+
+
+def run(ttl, requests):
+    """{path: (queries per request, ms per request)} with USER_CACHE_TTL=ttl"""
+    from sqlalchemy import event
+    from flaskblog import create_app, db
+    from flaskblog.models import User
+
+    app = create_app()
+    app.config['USER_CACHE_TTL'] = ttl
+    # init_app picked the backend from the config at create_app
+    from flaskblog.users import loader
+    loader.init_app(app)
+    with app.app_context():
+        db.create_all()
+        if not User.query.get(1):
+            db.session.add(User(id=1, username='bench', email='bench@demo.com', password='x'))
+            db.session.commit()
+        queries = [0]
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda *args: queries.__setitem__(0, queries[0] + 1))
+
+    results = {}
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = '1'
+        sess['_fresh'] = True
+    for path in PATHS:
+        client.get(path)
+        queries[0] = 0
+        started = time.perf_counter()
+        for _ in range(requests):
+            client.get(path)
+        seconds = time.perf_counter() - started
+        results[path] = (queries[0] / requests, seconds * 1000 / requests)
+    return results
+
+
+def main():
+    """Run without and with the cache and print both"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--ttl', type=int, default=30)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='flaskblog-bench-')
+    os.environ['FLASK_SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    os.environ.setdefault('FLASK_SECRET_KEY', 'benchmark')
+    os.environ['FLASK_MAIL_OUTBOX_WORKER'] = '0'
+
+    before = run(0, args.requests)
+    after = run(args.ttl, args.requests)
+    print(f'{"path":<10} {"queries before":>15} {"after":>6} {"ms before":>10} {"after":>6}')
+    for path in PATHS:
+        print(f'{path:<10} {before[path][0]:>15.2f} {after[path][0]:>6.2f} '
+              f'{before[path][1]:>10.2f} {after[path][1]:>6.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,21 +2,21 @@
 Initialize app
 """
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
 from flask_mail import Mail
-from flaskblog.config import Config
+from flaskblog.config import get_config
+from flaskblog.cache import ResponseCache
+from flaskblog.replicas import RoutingSQLAlchemy
 
 """
 Imports:
     Flask:
         Flask
-    flask_sqlalchemy, ORM to handle db
-    flask_bcrypt, pw encryption
+    flaskblog.replicas: RoutingSQLAlchemy, flask_sqlalchemy (ORM to handle db)
+        routing reads to replicas
     flask_login, handle logins, user auth etc
     flask_mail, send emails
-    flaskblog: config
+    flaskblog: config, page cache
 """
 
 # Initialize extentions without assigning to the app-var,
@@ -25,9 +25,7 @@ Imports:
 # that can be used in multiple apps
 
 # create db instance:
-db = SQLAlchemy()
-# create bcrypt instance
-bcrypt_flask = Bcrypt()
+db = RoutingSQLAlchemy()
 # create login-manager instance
 login_mgmr = LoginManager()
 # tell the login extension where the login route is located
@@ -37,25 +35,49 @@ login_mgmr.login_view = 'users.login'
 login_mgmr.login_message_category = 'info'
 # initialize mail extension
 mail = Mail()
+# rendered page cache for anonymous readers
+page_cache = ResponseCache()
 
 # after db create etc since routes uses db etc
 
 # App factory function
-def create_app(config_class=Config):
+def create_app(config_class=None):
     """
     App factory function
     Args: Configuration object for our app, ie dev, prod etc.
+          None picks the profile named by FLASK_CONFIG (dev, test, prod)
     Imports:
         flaskblog:
             users.routes: user blueprint
             posts.routes: post blueprint
             main.routes: main blueprint
             error.handlers: error blueprint
+            search.routes: search blueprint
+            archive.routes: archive blueprint
+            api.routes: json api blueprint
+            feeds.routes: atom feeds blueprint
+            replicas: read replica binds
+            database: engine options and sqlite pragmas
+            users.loader: user loader and its cache
+            ratelimit: rate limit store
+            outbox: send-mail command
+            users.utils: resize-avatars command, avatar_url template helper
+            assets: static file serving, compress-static command
+            streaming: streamed pages, stream_flush template helper
+            compression: gzip and brotli responses
+            metrics: request instrumentation and /metrics, when enabled
+            health: /healthz and /readyz
+            warmup: template bytecode cache, precompile-templates command, warm-up
+            search.utils: search index, rebuild-search-index command
+            posts.importer: import-posts command
+            posts.utils: render-posts command, post_date and month template filters
+            posts.hotfeed: newest posts in memory, recent_posts template helper
+            archive.utils: posts per month, reconcile-archive command
     """
     # configuration via Config
     # init the webapp
     app = Flask(__name__)
-    app.config.from_object(Config)
+    app.config.from_object(config_class or get_config())
 
     # import user routes from user module
     # users = users variable in users/routes.py instantiatiated by Blueprint()
@@ -63,19 +85,97 @@ def create_app(config_class=Config):
     from flaskblog.posts.routes import posts
     from flaskblog.main.routes import main
     from flaskblog.errors.handlers import errors
+    from flaskblog.search.routes import search
+    from flaskblog.archive.routes import archive
+    from flaskblog.api.routes import api
+    from flaskblog.feeds.routes import feeds
 
     # register the routes to the app
     app.register_blueprint(users)
     app.register_blueprint(posts)
     app.register_blueprint(main)
     app.register_blueprint(errors)
+    app.register_blueprint(search)
+    app.register_blueprint(archive)
+    app.register_blueprint(api)
+    app.register_blueprint(feeds)
 
 
     # Initialize extension to app
     db.init_app(app)
-    bcrypt_flask.init_app(app)
+    # replica binds, pool settings and sqlite pragmas, before the first connection is made
+    from flaskblog import replicas, database
+    replicas.init_app(app)
+    database.init_app(app)
     login_mgmr.init_app(app)
     mail.init_app(app)
+    page_cache.init_app(app)
 
+    # flask_login's user loader, logged in users are served from a short lived cache
+    from flaskblog.users import loader as user_loader
+    user_loader.init_app(app)
+
+    # token buckets of the login, register and reset routes
+    from flaskblog import ratelimit
+    ratelimit.init_app(app)
+
+    # register cli commands
+    from flaskblog.outbox import send_mail_command
+    from flaskblog.users.utils import resize_avatars_command, avatar_url
+    app.cli.add_command(send_mail_command)
+    app.cli.add_command(resize_avatars_command)
+
+    # full text search index, kept current from the posts routes' signals
+    from flaskblog.search import utils as search_utils
+    search_utils.init_app(app)
+    app.cli.add_command(search_utils.rebuild_search_index_command)
+
+    # posts per month of the sidebar and the archive pages
+    from flaskblog.archive import utils as archive_utils
+    archive_utils.init_app(app)
+    app.cli.add_command(archive_utils.reconcile_archive_command)
+
+    # bulk import of posts
+    from flaskblog.posts.importer import import_posts_command
+    app.cli.add_command(import_posts_command)
+
+    # derived post columns, computed on save, backfilled by render-posts
+    from flaskblog.posts.utils import (render_posts_command, format_date,
+                                       format_month)
+    app.cli.add_command(render_posts_command)
+
+    # newest posts of the home feed and the sidebar, kept in memory per process
+    from flaskblog.posts import hotfeed
+    hotfeed.init_app(app)
+
+    # template helpers
+    app.add_template_global(avatar_url)
+    app.add_template_filter(format_date, 'post_date')
+    app.add_template_filter(format_month, 'month')
+
+    # static files: hashed urls, immutable caching, precompressed siblings
+    from flaskblog import assets
+    assets.init_app(app)
+    app.cli.add_command(assets.compress_static_command)
+
+    # listing pages sent while they render, responses compressed on the way out
+    from flaskblog import streaming, compression
+    streaming.init_app(app)
+    compression.init_app(app)
+
+    # opt-in timings: Server-Timing, /metrics, slow request log
+    from flaskblog import metrics
+    metrics.init_app(app)
+
+    # liveness and readiness checks of the load balancer
+    from flaskblog import health
+    health.init_app(app)
+
+    # compiled templates on disk, the first request's one-time work done here
+    from flaskblog import warmup
+    warmup.init_app(app)
+    app.cli.add_command(warmup.precompile_templates_command)
+    if app.config['WARM_UP']:
+        warmup.warm_up(app)
 
     return app
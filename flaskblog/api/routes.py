@@ -0,0 +1,157 @@
+"""
+Api.routes
+    api_posts(): /api/posts, ?all=1 streams every post as NDJSON
+    api_post(post_id): /api/posts/<int:post_id>
+    api_posts_batch(): /api/posts/batch?ids=1,2,3
+    api_user(username): /api/users/<string:username>
+    api_user_posts(username): /api/users/<string:username>/posts
+    api_error(error): json errors for the api views
+"""
+
+from flask import request, jsonify, abort, Blueprint, Response, stream_with_context
+from werkzeug.exceptions import HTTPException
+from flaskblog.models import Post, User
+from flaskblog.posts.utils import MAX_POST_ID, keyset_paginate, pagination_state
+from flaskblog.replicas import replica_reads, use_replica
+from flaskblog.api.utils import (POST_FIELDS, USER_FIELDS, parse_fields, post_query,
+                                 post_dict, user_dict, iter_ndjson, post_etag,
+                                 json_conditional)
+
+"""
+Imports:
+    Flask
+        Blueprints to modularize the webapp
+        request to GET http arguments
+        jsonify, json responses
+        abort, json errors through api_error
+        Response, stream_with_context: the NDJSON export
+    werkzeug.exceptions:
+        HTTPException, every http error of the api is answered as json
+    flaskblog.models:
+        Post and User entity classes
+    flaskblog.posts.utils:
+        keyset_paginate, cursor pagination, the same as the html listings
+        pagination_state, part of the ETag
+        MAX_POST_ID, larger ids can't be bound to a query
+    flaskblog.replicas:
+        replica_reads, use_replica: the api only reads
+    flaskblog.api.utils:
+        fields, queries and serialization of posts and users
+
+Lists are {"posts": [...], "next_cursor": ..., "prev_cursor": ...}, pass
+?cursor=<next_cursor> to get the next page. Every post view takes
+?fields=id,title,... to get only those fields. Dates are UTC iso strings.
+"""
+
+# Instantiate api blueprint
+api = Blueprint('api', __name__, url_prefix='/api')
+
+# posts per page, default and largest
+PER_PAGE = 20
+MAX_PER_PAGE = 100
+# ids per batch request
+MAX_BATCH = 100
+
+# Create routes specifically to the api module and register in #
+
+
+def api_error(error):
+    """Errors of the api views as {"error": ..., "message": ...}"""
+    response = jsonify(error=error.name, message=error.description)
+    response.status_code = error.code
+    return response
+
+
+# by code as well, handlers by code (the html pages of errors) win over
+# handlers by class
+api.register_error_handler(HTTPException, api_error)
+for _code in (400, 403, 404, 405, 413, 500, 503):
+    api.register_error_handler(_code, api_error)
+
+
+def _post_list(author=None):
+    """A keyset page of posts as json, author limits it to that user's posts"""
+    fields = parse_fields(request.args.get('fields'), POST_FIELDS)
+    per_page = min(max(request.args.get('per_page', PER_PAGE, type=int), 1), MAX_PER_PAGE)
+    posts = keyset_paginate(post_query(fields, author=author),
+                            request.args.get('cursor'), per_page=per_page)
+    etag = post_etag(posts.items, fields, per_page, *pagination_state(posts))
+    return json_conditional(etag, lambda: {
+        'posts': [post_dict(post, fields) for post in posts.items],
+        'next_cursor': posts.next_cursor,
+        'prev_cursor': posts.prev_cursor,
+    })
+
+
+@api.route("/posts")
+@replica_reads
+def api_posts():
+    """Newest posts first, cursor paginated, or every post as NDJSON with ?all=1"""
+    if request.args.get('all'):
+        fields = parse_fields(request.args.get('fields'), POST_FIELDS)
+        # primary key order, posts created during the export come last
+        query = post_query(fields).order_by(None).order_by(Post.id)
+
+        def export():
+            # runs after the view returned, outside of replica_reads
+            with use_replica():
+                yield from iter_ndjson(query, fields)
+        # keep the request context for the generator
+        return Response(stream_with_context(export()), mimetype='application/x-ndjson')
+    return _post_list()
+
+
+@api.route("/posts/<int:post_id>")
+@replica_reads
+def api_post(post_id):
+    """One post"""
+    # a larger id would overflow the query's parameter, a 404 of this view is json
+    if not 0 < post_id < MAX_POST_ID:
+        abort(404)
+    fields = parse_fields(request.args.get('fields'), POST_FIELDS)
+    post = post_query(fields).filter(Post.id == post_id).first() or abort(404)
+    return json_conditional(post_etag([post], fields), lambda: post_dict(post, fields))
+
+
+@api.route("/posts/batch", methods=['GET', 'POST'])
+@replica_reads
+def api_posts_batch():
+    """
+    Many posts by id in one query: ?ids=1,2,3 or a POST of {"ids": [1, 2, 3]}
+    Returns {"posts": [...], "missing": [ids not found]} in the order asked for
+    """
+    if request.method == 'POST':
+        ids = (request.get_json(silent=True) or {}).get('ids')
+    else:
+        ids = request.args.get('ids', '').split(',')
+    try:
+        ids = list(dict.fromkeys(int(post_id) for post_id in ids or [] if str(post_id).strip()))
+    except (TypeError, ValueError):
+        abort(400, 'ids must be post ids.')
+    if not all(0 < post_id < MAX_POST_ID for post_id in ids):
+        abort(400, 'ids must be post ids.')
+    if not ids or len(ids) > MAX_BATCH:
+        abort(400, f'Ask for 1 to {MAX_BATCH} ids.')
+    fields = parse_fields(request.args.get('fields'), POST_FIELDS)
+    by_id = {post.id: post for post in
+             post_query(fields).order_by(None).filter(Post.id.in_(ids))}
+    posts = [by_id[post_id] for post_id in ids if post_id in by_id]
+    return jsonify(posts=[post_dict(post, fields) for post in posts],
+                   missing=[post_id for post_id in ids if post_id not in by_id])
+
+
+@api.route("/users/<string:username>")
+@replica_reads
+def api_user(username):
+    """Public profile of a user"""
+    fields = parse_fields(request.args.get('fields'), USER_FIELDS)
+    user = User.query.filter_by(username=username).first() or abort(404)
+    return jsonify(user_dict(user, fields))
+
+
+@api.route("/users/<string:username>/posts")
+@replica_reads
+def api_user_posts(username):
+    """Posts of a user, newest first, cursor paginated"""
+    user = User.query.filter_by(username=username).first() or abort(404)
+    return _post_list(author=user)
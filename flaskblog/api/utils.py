@@ -0,0 +1,159 @@
+"""
+Api utils
+    POST_FIELDS, USER_FIELDS: fields a client may ask for
+    parse_fields(fields_arg, allowed): sparse fieldset of ?fields=
+    post_query(fields, author=None): listing query loading just those fields
+    post_dict(post, fields), user_dict(user, fields): json ready dicts
+    iter_ndjson(query, fields): NDJSON chunks of every post of query
+    post_etag(posts, fields, *parts): ETag of a json response with posts
+    json_conditional(etag, payload): 304 or the json payload
+"""
+import json
+from hashlib import sha1
+from urllib.parse import urljoin
+from flask import current_app, jsonify, request
+from sqlalchemy.orm import load_only, noload
+from werkzeug.exceptions import BadRequest
+from flaskblog.cache import not_modified
+from flaskblog.models import Post
+from flaskblog.posts.utils import listing_query
+from flaskblog.users.utils import avatar_url
+
+"""
+Imports:
+    json: NDJSON lines
+    hashlib.sha1: ETags
+    urllib.parse.urljoin: absolute urls
+    Flask:
+        current_app, response_class
+        jsonify, json responses
+        request, host of the absolute urls
+    sqlalchemy.orm:
+        load_only, only the requested columns are selected
+        noload, the author is not joined when it isn't requested
+    werkzeug.exceptions: BadRequest, unknown fields
+    flaskblog.cache: not_modified, conditional GET of json responses
+    flaskblog.models: Post entity class
+    flaskblog.posts.utils: listing_query, the listing of the html pages
+    flaskblog.users.utils: avatar_url, urls of the profile pictures
+"""
+
+# post fields, 'author' is the nested author object
+POST_FIELDS = ('id', 'title', 'content', 'excerpt', 'word_count', 'date_posted',
+               'date_modified', 'author')
+USER_FIELDS = ('id', 'username', 'image_url')
+# posts per NDJSON chunk of an export, and rows fetched per round trip
+EXPORT_CHUNK = 500
+
+
+def parse_fields(fields_arg, allowed):
+    """
+    Fields of ?fields=id,title in the order of allowed, every field when empty
+    Raises: BadRequest on unknown fields
+    """
+    if not fields_arg:
+        return allowed
+    wanted = {field.strip() for field in fields_arg.split(',') if field.strip()}
+    unknown = wanted.difference(allowed)
+    if unknown:
+        raise BadRequest(f'Unknown fields: {", ".join(sorted(unknown))}. '
+                         f'Use any of {", ".join(allowed)}.')
+    return tuple(field for field in allowed if field in wanted)
+
+
+def post_query(fields, author=None):
+    """
+    listing_query() selecting only the columns of fields. id and date_posted
+    are always loaded, the keyset cursors point at them, and date_modified
+    for the ETag.
+    """
+    query = listing_query(author=author, bodies=True)
+    columns = {'id', 'date_posted', 'date_modified'} | \
+        {field for field in fields if field in Post.__table__.columns}
+    if 'author' in fields:
+        # user_id to match the joined author
+        columns.add('user_id')
+    else:
+        query = query.options(noload(Post.author))
+    return query.options(load_only(*columns))
+
+
+def _isoformat(value):
+    """UTC datetime as an iso string with Z"""
+    return value.isoformat() + 'Z'
+
+
+def user_dict(user, fields=USER_FIELDS):
+    """Public fields of user"""
+    result = {}
+    if 'id' in fields:
+        result['id'] = user.id
+    if 'username' in fields:
+        result['username'] = user.username
+    if 'image_url' in fields:
+        result['image_url'] = urljoin(request.host_url, avatar_url(user.image_file))
+    return result
+
+
+def post_dict(post, fields=POST_FIELDS):
+    """fields of post, the author as a nested user"""
+    result = {}
+    for field in fields:
+        if field == 'author':
+            result['author'] = user_dict(post.author)
+        elif field in ('date_posted', 'date_modified'):
+            result[field] = _isoformat(getattr(post, field))
+        else:
+            result[field] = getattr(post, field)
+    return result
+
+
+def iter_ndjson(query, fields):
+    """
+    Every post of query as one json object per line, EXPORT_CHUNK lines per
+    chunk. The rows come from a server side cursor (stream_results) in
+    batches, so memory stays flat however many posts there are.
+    """
+    rows = query.execution_options(stream_results=True).yield_per(EXPORT_CHUNK)
+    lines = []
+    for post in rows:
+        lines.append(json.dumps(post_dict(post, fields), separators=(',', ':')))
+        if len(lines) >= EXPORT_CHUNK:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def post_etag(posts, fields, *parts):
+    """
+    ETag of a response listing posts with fields
+    Args:
+        posts: the posts, loaded by post_query(fields)
+        parts: anything else the response depends on, ie. pagination state
+    """
+    digest = sha1(f'{fields!r}|{parts!r}'.encode('utf-8'))
+    for post in posts:
+        digest.update(f'|{post.id}:{post.date_modified.isoformat()}'.encode('utf-8'))
+        if 'author' in fields:
+            digest.update(f':{post.author.id}:{post.author.version}'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def json_conditional(etag, payload):
+    """
+    304 Not Modified when the client has the current version, else the json
+    of payload(), which is only built when needed.
+    Args:
+        etag: made by post_etag
+        payload: callable returning the json data
+    """
+    if not_modified(etag, None):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(payload())
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = 0
+    response.cache_control.must_revalidate = True
+    return response
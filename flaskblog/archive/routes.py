@@ -0,0 +1,88 @@
+"""
+Archive.routes
+    month(year, month): /archive/<int:year>/<int:month>
+    user_month(username, year, month): /user/<string:username>/archive/<int:year>/<int:month>
+"""
+
+from flask import request, abort, Blueprint
+from flaskblog import page_cache
+from flaskblog.cache import post_tags, post_validators, render_conditional
+from flaskblog.models import Post, User
+from flaskblog.posts.utils import listing_query, keyset_paginate, pagination_state
+from flaskblog.posts.hotfeed import feed_version
+from flaskblog.archive.utils import month_range
+from flaskblog.replicas import replica_reads
+
+"""
+Imports:
+    Flask
+        Blueprints to modularize the webapp
+        request to GET http arguments
+        abort, 404 for months that don't exist
+    flaskblog:
+        page_cache to cache the rendered page for anonymous readers
+        post_tags, cache invalidation tags of the listed posts
+        post_validators, render_conditional for conditional GET (304)
+    flaskblog.models:
+        Post and User entity classes
+    flaskblog.posts.utils:
+        listing_query, posts with their authors eager loaded
+        keyset_paginate, cursor pagination of a listing
+        pagination_state, part of the page validators
+    flaskblog.posts.hotfeed:
+        feed_version, the sidebar's part of the validators
+    flaskblog.archive.utils:
+        month_range, date range of the month
+    flaskblog.replicas:
+        replica_reads, the archive may be read from a replica
+"""
+
+# Instantiate archive blueprint
+archive = Blueprint('archive', __name__)
+
+# Create routes specifically to the archive module and register in #
+
+
+def _month_page(year, month, author=None):
+    """
+    Keyset page of the posts of a month, a range seek on the date_posted index
+    Returns: (first day of the month, page)
+    """
+    if not 1 <= month <= 12 or not 1 <= year <= 9998:
+        abort(404)
+    start, end = month_range(year, month)
+    query = listing_query(author=author)\
+        .filter(Post.date_posted >= start, Post.date_posted < end)
+    return start, keyset_paginate(query, request.args.get('cursor'), per_page=5)
+
+
+@archive.route("/archive/<int:year>/<int:month>")
+@replica_reads
+@page_cache.cached()
+def month(year, month):
+    """Posts of a month, newest first"""
+    # new and deleted posts invalidate 'feed', the sidebar 'sidebar'
+    page_cache.tag('feed', 'sidebar')
+    start, posts = _month_page(year, month)
+    page_cache.tag(*post_tags(posts.items))
+    validators = post_validators(posts.items, feed_version(), year, month,
+                                 *pagination_state(posts))
+    return render_conditional(validators, 'archive.html', title=f'Archive {year}-{month:02}',
+                              posts=posts, start=start)
+
+
+@archive.route("/user/<string:username>/archive/<int:year>/<int:month>")
+@replica_reads
+@page_cache.cached()
+def user_month(username, year, month):
+    """Posts of a user in a month, newest first"""
+    user = User.query.filter_by(username=username).first_or_404()
+    page_cache.tag('sidebar', f'posts_by:{user.id}', f'user:{user.id}')
+    start, posts = _month_page(year, month, author=user)
+    page_cache.tag(*post_tags(posts.items))
+    validators = post_validators(posts.items, feed_version(), user.id, user.version,
+                                 year, month, *pagination_state(posts))
+    return render_conditional(validators, 'archive.html',
+                              title=f'Archive {user.username} {year}-{month:02}',
+                              posts=posts, start=start,
+                              user=user, archive_user=user)
@@ -0,0 +1,167 @@
+"""
+Archive utils
+    init_app(app): month snapshot of the app, archive_months template helper
+    archive_months(user_id=0): [(first day, count), ...] newest month first
+    month_range(year, month): (first moment, first moment of the next month)
+    add_month_counts(connection, rows, delta=1): count rows of posts in or out
+    reconcile_archive_command: flask reconcile-archive
+"""
+from collections import Counter
+from datetime import datetime
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event, extract, func
+from flaskblog import db
+from flaskblog.cache import LRUBackend, NullBackend
+from flaskblog.database import add_to_counter
+from flaskblog.models import Post, PostMonthCount
+from flaskblog.posts.hotfeed import feed_version
+from flaskblog.signals import post_created, post_deleted
+
+"""
+Imports:
+    collections.Counter: count deltas per (year, month, user_id)
+    datetime: month boundaries
+    click, flask.cli.with_appcontext: reconcile-archive command
+    Flask:
+        current_app, config and extensions
+    sqlalchemy:
+        event, mapper events keep the counts in the transaction of the post
+        extract, func: recount in the reconcile command
+    flaskblog: db
+    flaskblog.cache: LRUBackend, NullBackend, storage of the month snapshot
+    flaskblog.database: add_to_counter, the count rows are upserted
+    flaskblog.models: Post and PostMonthCount entity classes
+    flaskblog.posts.hotfeed: feed_version, version of the snapshot
+    flaskblog.signals: post_created, post_deleted, drop the snapshot
+
+Counting the posts per month with a GROUP BY over the whole post table on
+every page would be the slowest query of the site. post_month_count is
+kept current instead: the mapper events below add and subtract in the
+flush that inserts or deletes the post, so the counts commit or roll back
+with it. The importer, which inserts without the ORM, calls
+add_month_counts itself.
+
+The sidebar reads a snapshot of the counts, dropped in this process when a
+post is created or deleted. Every post change bumps the hot feed's
+version counter, the snapshot keeps the version it was read at and is
+read again when feed_version() moved on, so the other processes follow
+within HOT_FEED_CHECK_SECONDS. Cached pages with the sidebar are tagged
+'sidebar' and carry feed_version() in their ETag.
+"""
+
+# user_id of the counts of all authors
+ALL_AUTHORS = 0
+
+
+def month_range(year, month):
+    """[start, end) of a month, for a range seek on the date_posted indexes"""
+    start = datetime(year, month, 1)
+    end = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    return start, end
+
+
+def add_month_counts(connection, rows, delta=1):
+    """
+    Add delta to the month counts of rows, in the caller's transaction
+    Args:
+        connection: connection of the transaction inserting/deleting the posts
+        rows: posts or post dicts with date_posted and user_id
+        delta: 1 for inserted posts, -1 for deleted posts
+    """
+    deltas = Counter()
+    for row in rows:
+        date_posted = row['date_posted'] if isinstance(row, dict) else row.date_posted
+        user_id = row['user_id'] if isinstance(row, dict) else row.user_id
+        deltas[(date_posted.year, date_posted.month, ALL_AUTHORS)] += delta
+        deltas[(date_posted.year, date_posted.month, user_id)] += delta
+    table = PostMonthCount.__table__
+    for (year, month, user_id), change in deltas.items():
+        if change:
+            # the first post of a month may be saved by two requests at once
+            add_to_counter(connection, table, 'count', change,
+                           year=year, month=month, user_id=user_id)
+
+
+@event.listens_for(Post, 'after_insert')
+def _on_post_insert(mapper, connection, target):
+    add_month_counts(connection, [target])
+
+
+# before the DELETE, the post can still be loaded if it was expired
+@event.listens_for(Post, 'before_delete')
+def _on_post_delete(mapper, connection, target):
+    add_month_counts(connection, [target], -1)
+
+
+@event.listens_for(Post, 'after_update')
+def _on_post_update(mapper, connection, target):
+    # routes never move a post to another month or author, scripts might
+    state = db.inspect(target)
+    date_history = state.attrs.date_posted.history
+    user_history = state.attrs.user_id.history
+    if not (date_history.deleted or user_history.deleted):
+        return
+    old = {'date_posted': (date_history.deleted or [target.date_posted])[0],
+           'user_id': (user_history.deleted or [target.user_id])[0]}
+    add_month_counts(connection, [old], -1)
+    add_month_counts(connection, [target])
+
+
+def init_app(app):
+    """Create the month snapshot and the archive_months template helper"""
+    ttl = app.config['ARCHIVE_SNAPSHOT_TTL']
+    app.extensions['archive_snapshot'] = LRUBackend(1000, ttl) if ttl else NullBackend()
+    app.add_template_global(archive_months)
+    post_created.connect(_on_post_changed, app)
+    post_deleted.connect(_on_post_changed, app)
+
+
+def archive_months(user_id=ALL_AUTHORS):
+    """Months with posts, [(first day of the month, count), ...] newest first, from the snapshot"""
+    snapshot = current_app.extensions['archive_snapshot']
+    version = feed_version()
+    entry = snapshot.get(user_id)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    months = [(datetime(year, month, 1), count) for year, month, count in db.session.query(
+        PostMonthCount.year, PostMonthCount.month, PostMonthCount.count)
+              .filter(PostMonthCount.user_id == user_id, PostMonthCount.count > 0)
+              .order_by(PostMonthCount.year.desc(), PostMonthCount.month.desc())]
+    snapshot.set(user_id, (version, months))
+    return months
+
+
+def _on_post_changed(app, post):
+    snapshot = app.extensions['archive_snapshot']
+    snapshot.delete(ALL_AUTHORS)
+    snapshot.delete(post.user_id)
+
+
+@click.command('reconcile-archive')
+@with_appcontext
+def reconcile_archive_command():
+    """Recount the posts per month from the post table and fix post_month_count."""
+    year = extract('year', Post.date_posted)
+    month = extract('month', Post.date_posted)
+    expected = Counter()
+    for post_year, post_month, user_id, count in db.session.query(
+            year, month, Post.user_id, func.count(Post.id)).group_by(year, month, Post.user_id):
+        expected[(post_year, post_month, ALL_AUTHORS)] += count
+        expected[(post_year, post_month, user_id)] = count
+    stored = {(row.year, row.month, row.user_id): row.count
+              for row in PostMonthCount.query if row.count}
+    for key in sorted(set(expected) | set(stored)):
+        if expected.get(key, 0) != stored.get(key, 0):
+            click.echo(f'{key[0]}-{key[1]:02} user {key[2]}: '
+                       f'{stored.get(key, 0)} -> {expected.get(key, 0)}')
+    # replace every count in one transaction
+    PostMonthCount.query.delete()
+    if expected:
+        db.session.execute(PostMonthCount.__table__.insert(),
+                           [{'year': key[0], 'month': key[1], 'user_id': key[2], 'count': count}
+                            for key, count in expected.items()])
+    db.session.commit()
+    current_app.extensions['archive_snapshot'].clear()
+    click.echo(f'{len(expected)} month counts stored')
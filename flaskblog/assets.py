@@ -0,0 +1,125 @@
+"""
+Static assets
+    init_app(app): serve static files with far-future caching
+    static_url(filename): content hashed url of a static file
+    send_static(filename): the static view
+    compress_static_command: flask compress-static, precompress text assets
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import click
+from flask import current_app, request, send_from_directory, url_for
+from flask.cli import with_appcontext
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+"""
+Imports:
+    gzip, brotli (optional): precompressed siblings of text assets
+    hashlib: content hash of static files
+    mimetypes: content type of a file served from its compressed sibling
+    os: file stats
+    re: names of the content hashed avatars
+    click, flask.cli.with_appcontext: compress-static command
+    Flask:
+        current_app, request, send_from_directory, url_for
+
+A url made by static_url() carries ?v=<content hash>, so it changes
+whenever the file does and browsers may keep it for a year without
+revalidating. Avatars are named by their content hash, so they are
+immutable as well, except the default picture (default.png and its
+variants), which keeps its name when it is replaced. send_from_directory honours
+USE_X_SENDFILE, so a front server can do the file transfer.
+"""
+
+# a year, the longest max-age browsers respect
+IMMUTABLE_MAX_AGE = 31536000
+# text assets worth precompressing
+COMPRESSIBLE = ('.css', '.js', '.svg', '.txt', '.json', '.xml', '.html')
+# avatars named by content hash (users.utils.save_picture), and their variants
+AVATAR_RE = re.compile(r'profile_pics/[0-9a-f]{16}(_[0-9]+)?\.[a-z]+')
+# Accept-Encoding token -> sibling extension, best first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# (path, mtime) -> content hash
+_hashes = {}
+
+
+def init_app(app):
+    """Replace the default static view and add the static_url template helper"""
+    app.view_functions['static'] = send_static
+    app.add_template_global(static_url)
+
+
+def _content_hash(path):
+    """Short content hash of path, recomputed only when the file changes"""
+    mtime = os.path.getmtime(path)
+    digest = _hashes.get((path, mtime))
+    if digest is None:
+        with open(path, 'rb') as static_file:
+            digest = hashlib.sha256(static_file.read()).hexdigest()[:12]
+        _hashes[(path, mtime)] = digest
+    return digest
+
+
+def static_url(filename):
+    """url_for('static') with a content hash, cacheable forever"""
+    path = os.path.join(current_app.static_folder, filename)
+    return url_for('static', filename=filename, v=_content_hash(path))
+
+
+def _immutable(filename, path):
+    """True if the requested url can never point at other content"""
+    if AVATAR_RE.fullmatch(filename):
+        return True
+    version = request.args.get('v')
+    return version is not None and version == _content_hash(path)
+
+
+def send_static(filename):
+    """Static view: precompressed siblings and immutable caching"""
+    static_folder = current_app.static_folder
+    path = os.path.join(static_folder, filename)
+    response = None
+    if filename.endswith(COMPRESSIBLE) and os.path.isfile(path):
+        accepted = request.accept_encodings
+        for encoding, extension in ENCODINGS:
+            if accepted[encoding] and os.path.isfile(path + extension):
+                mimetype, _ = mimetypes.guess_type(filename)
+                response = send_from_directory(static_folder, filename + extension,
+                                               mimetype=mimetype)
+                response.headers['Content-Encoding'] = encoding
+                break
+        response = response or send_from_directory(static_folder, filename)
+        response.vary.add('Accept-Encoding')
+    else:
+        # 404s for missing files as well
+        response = send_from_directory(static_folder, filename)
+    if response.status_code in (200, 206, 304) and _immutable(filename, path):
+        response.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    return response
+
+
+@click.command('compress-static')
+@with_appcontext
+def compress_static_command():
+    """Write .gz (and .br if brotli is installed) siblings of text assets."""
+    for root, _, names in os.walk(current_app.static_folder):
+        for name in names:
+            if not name.endswith(COMPRESSIBLE):
+                continue
+            path = os.path.join(root, name)
+            with open(path, 'rb') as static_file:
+                data = static_file.read()
+            with open(path + '.gz', 'wb') as gz_file:
+                gz_file.write(gzip.compress(data, 9))
+            if brotli is not None:
+                with open(path + '.br', 'wb') as br_file:
+                    br_file.write(brotli.compress(data))
+            click.echo(f'compressed {os.path.relpath(path, current_app.static_folder)}')
@@ -0,0 +1,473 @@
+"""
+Rendered page cache
+    LRUBackend, FileSystemBackend, NullBackend: cache storage
+    ResponseCache: extension, cached() view decorator, tag(), invalidate(), clear()
+    post_tags(posts): invalidation tags for a list of posts
+    post_validators(posts, *parts): ETag of a page of posts
+    version_validators(version, *parts): ETag of a page known before its posts are read
+    render_conditional(validators, template, stream=False, **context): 304 or rendered page
+"""
+import os
+import pickle
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+from hashlib import sha1
+from flask import current_app, g, request, session, render_template
+from flask_login import current_user
+from flaskblog import signals
+from flaskblog.streaming import stream_template, streaming_allowed
+
+"""
+Imports:
+    os, pickle, tempfile, hashlib.sha1: FileSystemBackend storage
+    threading: lock for the in-process LRUBackend
+    time, uuid: entry expiry and tag tokens
+    collections.OrderedDict: LRU order
+    functools.wraps: cached() decorator
+    Flask:
+        current_app, g, request, session to decide if a response is cacheable
+        render_template, only called when the client copy is stale
+    flask_login:
+        current_user, authenticated pages are never cached
+    flaskblog:
+        signals, post and user changes invalidate cached pages
+    flaskblog.streaming:
+        stream_template, streaming_allowed: streamed pages, stored once sent
+
+Invalidation uses tags. A view tags its response while it renders it
+(page_cache.tag('feed', 'post:3', 'user:1')). Every tag has a random token
+in the backend, and the entry keeps the tokens its tags had when the view
+tagged it. invalidate() gives the tags new tokens, so the entries holding
+the old ones miss. That works with any backend that can get and set, and
+across worker processes when the backend is shared.
+
+A view tags the page before it reads what the tags stand for, a change
+committed during the read then has already replaced the token the entry
+keeps. Tags known only from the rows read (the posts and authors of a
+listing) are covered by the generation: every invalidate() changes it,
+and a page is not stored when it changed since the view started.
+
+A streamed page is stored after its last piece was sent, a client that
+goes away before leaves nothing in the cache.
+"""
+
+
+class NullBackend:
+    """Backend that stores nothing, disables the cache"""
+
+    def get(self, key):
+        """Always a miss"""
+        return None
+
+    def set(self, key, value, timeout=None):
+        """Forget value"""
+
+    def delete(self, key):
+        """Nothing to delete"""
+
+    def clear(self):
+        """Nothing to clear"""
+
+
+class LRUBackend:
+    """
+    In-process least recently used cache.
+    Each worker process has its own copy.
+    """
+
+    def __init__(self, threshold=500, default_timeout=300):
+        self.threshold = threshold
+        self.default_timeout = default_timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Get value or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires and expires < time.time():
+                del self._entries[key]
+                return None
+            # mark as most recently used
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        """Store value, timeout 0 keeps it until evicted"""
+        timeout = self.default_timeout if timeout is None else timeout
+        expires = time.time() + timeout if timeout else 0
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            # evict least recently used entries
+            while len(self._entries) > self.threshold:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """Remove key"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Remove everything"""
+        with self._lock:
+            self._entries.clear()
+
+
+class FileSystemBackend:
+    """
+    Cache in a local directory, one pickle file per key.
+    Can be shared by all worker processes on a host.
+    """
+
+    def __init__(self, cache_dir, threshold=500, default_timeout=300):
+        self.cache_dir = cache_dir
+        self.threshold = threshold
+        self.default_timeout = default_timeout
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        """Get value or None if missing or expired"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as cache_file:
+                expires, value = pickle.load(cache_file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires and expires < time.time():
+            self.delete(key)
+            return None
+        return value
+
+    def set(self, key, value, timeout=None):
+        """Store value, timeout 0 keeps it until pruned"""
+        timeout = self.default_timeout if timeout is None else timeout
+        expires = time.time() + timeout if timeout else 0
+        # write to a temp file and rename, readers never see half a file
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as tmp_file:
+            pickle.dump((expires, value), tmp_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path(key))
+        self._prune()
+
+    def delete(self, key):
+        """Remove key"""
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        """Remove everything"""
+        for name in os.listdir(self.cache_dir):
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+
+    def _prune(self):
+        """Remove the oldest files when there are more than threshold"""
+        names = os.listdir(self.cache_dir)
+        if len(names) <= self.threshold:
+            return
+        paths = [os.path.join(self.cache_dir, name) for name in names]
+        paths.sort(key=lambda path: os.path.getmtime(path) if os.path.exists(path) else 0)
+        for path in paths[:len(paths) - self.threshold]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def post_tags(posts):
+    """
+    Tags for a page showing posts: the content of each post,
+    and the profile (username, avatar) of each author
+    """
+    tags = set()
+    for post in posts:
+        tags.add(f'post:{post.id}')
+        tags.add(f'user:{post.user_id}')
+    return tags
+
+
+def post_validators(posts, *parts):
+    """
+    Validators for a page showing posts. No Last-Modified: the page
+    changes with its authors' names and pictures and with the sidebar,
+    the newest post.date_modified would still answer 304 then.
+    Args:
+        posts: the posts on the page, with their authors loaded
+        parts: anything else the page depends on, ie. pagination state
+    Returns: (etag, None)
+    """
+    # the layout differs for each logged in user
+    digest = sha1(f'{current_user.get_id()}|{parts!r}'.encode('utf-8'))
+    for post in posts:
+        author = post.author
+        digest.update(f'|{post.id}:{post.date_modified.isoformat()}'
+                      f':{author.id}:{author.version}'.encode('utf-8'))
+    return digest.hexdigest(), None
+
+
+def version_validators(version, *parts):
+    """
+    Validators for a page that changes only when version does, known
+    before the page's posts are read, so a streamed page can send them
+    Args:
+        version: version counter of everything the page shows, ie. feed_version()
+        parts: what else selects the page, ie. the request arguments
+    Returns: (etag, None)
+    """
+    digest = sha1(f'{current_user.get_id()}|{version}|{parts!r}'.encode('utf-8'))
+    return digest.hexdigest(), None
+
+
+def render_conditional(validators, template, stream=False, **context):
+    """
+    Answer 304 Not Modified, without rendering template, when the client's
+    If-None-Match/If-Modified-Since still match validators. Else render it.
+    Args:
+        validators: (etag, last_modified), last_modified may be None
+        template, context: as for render_template
+        stream: send the page while it renders, see streaming.py
+    """
+    etag, last_modified = validators
+    # pending flash messages must be rendered, never answer 304 then
+    fresh = '_flashes' not in session and not_modified(etag, last_modified)
+    if fresh:
+        response = current_app.response_class(status=304)
+    elif stream and streaming_allowed():
+        response = current_app.response_class(stream_template(template, **context))
+    else:
+        response = current_app.make_response(render_template(template, **context))
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    if current_user.is_authenticated:
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    else:
+        # shared caches may keep public pages, but have to revalidate them
+        response.cache_control.public = True
+        response.cache_control.max_age = 0
+        response.cache_control.must_revalidate = True
+        if current_app.config['HTTP_CACHE_SMAXAGE']:
+            response.cache_control.s_maxage = current_app.config['HTTP_CACHE_SMAXAGE']
+    response.vary.add('Cookie')
+    return response
+
+
+def not_modified(etag, last_modified):
+    """True if the request's conditional headers match the validators"""
+    # If-None-Match wins over If-Modified-Since (RFC 7232), and compares
+    # weakly: compression.py sends W/ etags for compressed responses
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified is not None:
+        # http dates have whole seconds
+        return last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+    return False
+
+
+class ResponseCache:
+    """
+    Caches rendered GET responses for anonymous readers.
+    Config:
+        PAGE_CACHE_TYPE: 'lru' (default), 'filesystem' or 'null'
+        PAGE_CACHE_DIR: directory for the filesystem backend
+        PAGE_CACHE_THRESHOLD: max number of entries
+        PAGE_CACHE_TIMEOUT: seconds an entry lives
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Create the backend for app and connect the invalidation signals"""
+        app.config.setdefault('PAGE_CACHE_TYPE', 'lru')
+        app.config.setdefault('PAGE_CACHE_DIR', None)
+        app.config.setdefault('PAGE_CACHE_THRESHOLD', 500)
+        app.config.setdefault('PAGE_CACHE_TIMEOUT', 300)
+        app.config.setdefault('HTTP_CACHE_SMAXAGE', 0)
+
+        cache_type = app.config['PAGE_CACHE_TYPE']
+        threshold = app.config['PAGE_CACHE_THRESHOLD']
+        timeout = app.config['PAGE_CACHE_TIMEOUT']
+        if cache_type == 'lru':
+            backend = LRUBackend(threshold, timeout)
+        elif cache_type == 'filesystem':
+            cache_dir = app.config['PAGE_CACHE_DIR'] or \
+                os.path.join(tempfile.gettempdir(), 'flaskblog-page-cache')
+            backend = FileSystemBackend(cache_dir, threshold, timeout)
+        elif cache_type == 'null':
+            backend = NullBackend()
+        else:
+            raise ValueError(f'Unknown PAGE_CACHE_TYPE {cache_type!r}')
+        # app specific state lives on the app, not on the extension object
+        app.extensions['page_cache'] = backend
+
+        signals.post_created.connect(_on_post_created, app)
+        signals.post_updated.connect(_on_post_updated, app)
+        signals.post_deleted.connect(_on_post_deleted, app)
+        signals.user_updated.connect(_on_user_updated, app)
+
+    @property
+    def backend(self):
+        """Backend of the current app"""
+        return current_app.extensions['page_cache']
+
+    def tag(self, *tags):
+        """Tag the response of the current request, with the tokens the tags have now"""
+        tokens = g.setdefault('page_cache_tokens', {})
+        for tag in tags:
+            if tag not in tokens:
+                tokens[tag] = self._tag_token(tag)
+
+    def invalidate(self, *tags):
+        """Drop every cached page carrying any of tags"""
+        _invalidate(current_app, *tags)
+
+    def clear(self):
+        """Drop every cached page, the tags get new tokens as well"""
+        self.backend.clear()
+
+    def _tag_token(self, tag):
+        """Current token of tag, a tag that was never seen gets a new one"""
+        return _tag_token(self.backend, tag)
+
+    def _store_streamed(self, key, response, timeout, generation):
+        """Body of the streamed response, stored once it was sent completely"""
+        # the request context is gone by then, keep what the store needs
+        backend = self.backend
+        # filled by the view's tag() calls while the page renders
+        tokens = g.setdefault('page_cache_tokens', {})
+        status = response.status_code
+        headers = _stored_headers(response)
+        chunks = response.iter_encoded()
+
+        def generate():
+            body = []
+            for chunk in chunks:
+                body.append(chunk)
+                yield chunk
+            _store(backend, key, (b''.join(body), status, headers, tokens), timeout,
+                   generation)
+        return generate()
+
+    def cached(self, timeout=None):
+        """
+        Decorator for GET views of public pages.
+        Skipped for logged in users and when flash messages are pending,
+        since those change the rendered layout.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                # anonymous users have no user id, so this does not hit the db
+                if request.method != 'GET' or current_user.is_authenticated \
+                        or '_flashes' in session:
+                    return view(*args, **kwargs)
+
+                key = f'page:{request.endpoint}:{request.full_path}'
+                entry = self.backend.get(key)
+                if entry is not None:
+                    body, status, headers, tokens = entry
+                    if all(self._tag_token(tag) == token for tag, token in tokens.items()):
+                        response = current_app.response_class(body, status, headers)
+                        response.headers['X-Cache'] = 'HIT'
+                        # 304 if the client already has this version
+                        return response.make_conditional(request)
+
+                # before the view reads anything
+                generation = _generation(self.backend)
+                response = current_app.make_response(view(*args, **kwargs))
+                # only store complete, successful responses
+                if response.status_code != 200:
+                    return response
+                if response.is_streamed:
+                    body = response.response
+                    response.response = self._store_streamed(key, response, timeout,
+                                                             generation)
+                    if hasattr(body, 'close'):
+                        response.call_on_close(body.close)
+                else:
+                    # the tokens the view's tag() calls took
+                    tokens = g.get('page_cache_tokens', {})
+                    _store(self.backend, key, (response.get_data(), response.status_code,
+                                               _stored_headers(response), tokens),
+                           timeout, generation)
+                response.headers['X-Cache'] = 'MISS'
+                return response
+            return wrapper
+        return decorator
+
+
+def _tag_token(backend, tag):
+    token = backend.get(f'tag:{tag}')
+    if token is None:
+        token = uuid.uuid4().hex
+        backend.set(f'tag:{tag}', token, timeout=0)
+    return token
+
+
+def _generation(backend):
+    """Token changed by every invalidation"""
+    return _tag_token(backend, GENERATION_TAG)
+
+
+def _store(backend, key, entry, timeout, generation):
+    # a tag added after the view's reads may have been invalidated in between
+    if _generation(backend) == generation:
+        backend.set(key, entry, timeout)
+
+
+def _stored_headers(response):
+    # the session cookie belongs to this reader, not to the page
+    return [(name, value) for name, value in response.headers
+            if name not in ('Content-Length', 'Set-Cookie', 'X-Cache')]
+
+
+# Invalidation, tags:
+#   feed          every home page
+#   sidebar       every page with the layout's sidebar: newest posts, archive
+#   posts_by:<id> every user posts page of user id
+#   post:<id>     every page showing post id
+#   user:<id>     every page showing the username/avatar of user id
+# and the generation, changed by every invalidation
+GENERATION_TAG = '*'
+
+
+def _invalidate(app, *tags):
+    backend = app.extensions['page_cache']
+    # the generation first: a page that saw a new tag token sees it changed
+    for tag in (GENERATION_TAG,) + tags:
+        backend.set(f'tag:{tag}', uuid.uuid4().hex, timeout=0)
+
+
+def _on_post_created(app, post):
+    _invalidate(app, 'feed', 'sidebar', f'posts_by:{post.user_id}')
+
+
+def _on_post_updated(app, post):
+    # the title may be in the sidebar's newest posts
+    _invalidate(app, 'sidebar', f'post:{post.id}')
+
+
+def _on_post_deleted(app, post):
+    _invalidate(app, 'feed', 'sidebar', f'posts_by:{post.user_id}', f'post:{post.id}')
+
+
+def _on_user_updated(app, user):
+    _invalidate(app, f'user:{user.id}')
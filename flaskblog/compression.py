@@ -0,0 +1,166 @@
+"""
+Response compression
+    init_app(app): compress the app's responses when COMPRESSION is on
+    negotiate(accept_encodings): best content coding the client accepts, or None
+    compress_response(response): after_request hook, gzip or brotli
+    compress_stream(chunks, encoding, level): compress a streamed body piece by piece
+"""
+import gzip
+import zlib
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+"""
+Imports:
+    gzip: whole bodies
+    zlib: streamed bodies, gzip framing with a flush after every piece
+    brotli (optional): preferred when installed and accepted
+    Flask:
+        current_app, config
+        request, Accept-Encoding
+
+Config:
+    COMPRESSION: compress responses, off when a front server does it
+    COMPRESS_MIN_SIZE: smaller bodies are sent as they are
+    COMPRESS_LEVEL: gzip level, 1 (fast) to 9 (small)
+    COMPRESS_BROTLI_QUALITY: brotli quality, 0 (fast) to 11 (small)
+
+Html, json and feeds shrink to a fifth or less. Left alone are responses
+that are already compressed or not text (pictures, the precompressed
+static files of assets.py, which also come as files handed to the
+server), that have no body, that asked for no-transform, and bodies
+under COMPRESS_MIN_SIZE, where the gzip framing and the time cost more
+than they save.
+
+A streamed page (streaming.py) is compressed piece by piece, each piece
+is flushed out of the compressor, so the head sent before the posts are
+read reaches the browser as soon as it would uncompressed.
+
+The page cache stores bodies uncompressed, a hit is compressed for the
+client that asks. A compressed response is another representation of
+the page, its ETag becomes weak (W/"..."), cache.not_modified compares
+If-None-Match weakly, so the 304s still work.
+"""
+
+# content types worth compressing
+COMPRESSIBLE = ('text/html', 'text/css', 'text/plain', 'text/xml', 'text/javascript',
+                'application/javascript', 'application/json', 'application/xml',
+                'application/atom+xml', 'image/svg+xml')
+
+
+def init_app(app):
+    """Compress responses when COMPRESSION is on"""
+    if app.config['COMPRESSION']:
+        app.after_request(compress_response)
+
+
+def negotiate(accept_encodings):
+    """
+    Content coding of a response to a client sending accept_encodings
+    Args:
+        accept_encodings: request.accept_encodings
+    Returns: 'br', 'gzip' or None for the body as it is
+    """
+    best, best_quality = None, 0
+    # brotli first, it wins a tie
+    for encoding in ('br', 'gzip'):
+        if encoding == 'br' and brotli is None:
+            continue
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def _compressible(response):
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return False
+    # files handed to the server, or to the front server by X-Sendfile
+    if response.direct_passthrough:
+        return False
+    if 'Content-Encoding' in response.headers or response.cache_control.no_transform:
+        return False
+    return response.mimetype in COMPRESSIBLE
+
+
+class _GzipStream:
+    """gzip compressor, what is compressed so far can be sent"""
+
+    def __init__(self, level):
+        # wbits 16 + 15: gzip header and trailer
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _BrotliStream:
+    """brotli compressor, what is compressed so far can be sent"""
+
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def compress_stream(chunks, encoding, level):
+    """
+    Compress the pieces of a streamed body as they come
+    Args:
+        chunks: the body, bytes
+        encoding: 'br' or 'gzip'
+        level: brotli quality or gzip level
+    """
+    stream = _BrotliStream(level) if encoding == 'br' else _GzipStream(level)
+    for chunk in chunks:
+        if chunk:
+            yield stream.compress(chunk)
+    yield stream.finish()
+
+
+def _compress(data, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(data, mode=brotli.MODE_TEXT, quality=level)
+    # mtime 0: the same body compresses to the same bytes
+    return gzip.compress(data, level, mtime=0)
+
+
+def compress_response(response):
+    """Compress response for the current request, if it is worth it"""
+    if not _compressible(response):
+        return response
+    # caches must keep the compressed and the plain response apart
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate(request.accept_encodings)
+    if encoding is None:
+        return response
+    config = current_app.config
+    level = config['COMPRESS_BROTLI_QUALITY'] if encoding == 'br' else config['COMPRESS_LEVEL']
+    if response.is_streamed:
+        body = response.response
+        response.response = compress_stream(response.iter_encoded(), encoding, level)
+        if hasattr(body, 'close'):
+            response.call_on_close(body.close)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < config['COMPRESS_MIN_SIZE']:
+            return response
+        # sets Content-Length as well
+        response.set_data(_compress(data, encoding, level))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
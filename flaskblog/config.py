@@ -1,6 +1,8 @@
 """
 App Configuration
-    Config class
+    Config class: settings shared by every profile
+    DevelopmentConfig, TestingConfig, ProductionConfig: profiles
+    get_config(name=None): profile selected by name or FLASK_CONFIG
 """
 import os
 
@@ -18,13 +20,193 @@ class Config:
 
     # secret key protects against XSS and modifying cookies
     SECRET_KEY = os.environ.get('FLASK_SECRET_KEY')
+    # rotation: the previous keys, comma separated, reset tokens signed with
+    # them stay valid until they expire
+    SECRET_KEY_FALLBACKS = [key for key in
+                            os.environ.get('FLASK_SECRET_KEY_FALLBACKS', '').split(',') if key]
+    # seconds a password reset token is valid
+    RESET_TOKEN_MAX_AGE = 1800
     # dev db sqlite, site db will be created in project-root
     SQLALCHEMY_DATABASE_URI = os.environ.get('FLASK_SQLALCHEMY_DATABASE_URI')
+    # the flask_sqlalchemy model signals are unused, flaskblog.signals are sent instead
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # create_engine() arguments, pool settings are per worker process
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    # read replicas, comma separated uris, used by the views marked replica_reads
+    SQLALCHEMY_REPLICA_URIS = [uri for uri in
+                               os.environ.get('FLASK_DB_REPLICAS', '').split(',') if uri]
+    # after writing, a client reads from the primary this long (replica lag)
+    DB_PRIMARY_STICKY_SECONDS = int(os.environ.get('FLASK_DB_PRIMARY_STICKY_SECONDS', 10))
+    # PRAGMA name -> value, run on every new sqlite connection, see database.py
+    # busy_timeout: ms a writer waits for the lock instead of failing at once
+    SQLITE_PRAGMAS = {'busy_timeout': 5000}
     # email settings
-    MAIL_SERVER = 'smtp.googlemail.com'
-    MAIL_PORT = 587
-    MAIL_USE_TLS = True
+    # env-vars override the server, ie. a local stand-in smtp server for testing
+    MAIL_SERVER = os.environ.get('FLASK_MAIL_SERVER', 'smtp.googlemail.com')
+    MAIL_PORT = int(os.environ.get('FLASK_MAIL_PORT', 587))
+    MAIL_USE_TLS = os.environ.get('FLASK_MAIL_USE_TLS', '1') == '1'
     # get env-vars
     MAIL_USERNAME = os.environ.get('FLASK_EMAIL_USER')
     MAIL_PASSWORD = os.environ.get('FLASK_EMAIL_PW')
     MAIL_SENDER = os.environ.get('FLASK_EMAIL_SENDER')
+    # password hashing: 'bcrypt' or 'pbkdf2:sha256', changing the method or
+    # cost rehashes each password on its next successful login
+    PASSWORD_HASH_METHOD = os.environ.get('FLASK_PASSWORD_HASH_METHOD', 'bcrypt')
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('FLASK_BCRYPT_LOG_ROUNDS', 12))
+    PBKDF2_ITERATIONS = 260000
+    # hashing process pool per worker process, 0 hashes on the request thread
+    PASSWORD_HASH_WORKERS = int(os.environ.get('FLASK_PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_MAX_PENDING = 16
+    # logged in users are cached per process for this many seconds, 0 disables
+    USER_CACHE_TTL = int(os.environ.get('FLASK_USER_CACHE_TTL', 30))
+    USER_CACHE_THRESHOLD = 10000
+    # mail outbox, the request path only stores mails, a sender thread sends them
+    # set FLASK_MAIL_OUTBOX_WORKER=0 when a separate `flask send-mail --loop` runs
+    MAIL_OUTBOX_WORKER = os.environ.get('FLASK_MAIL_OUTBOX_WORKER', '1') == '1'
+    MAIL_OUTBOX_BATCH_SIZE = 50
+    MAIL_OUTBOX_MAX_ATTEMPTS = 8
+    MAIL_OUTBOX_BACKOFF = 30
+    MAIL_OUTBOX_POLL_INTERVAL = 5
+    # largest accepted request body, uploads above are refused with 413
+    MAX_CONTENT_LENGTH = 8 * 1024 * 1024
+    # profile pictures: upload limits and resize worker threads per process
+    AVATAR_MAX_BYTES = 4 * 1024 * 1024
+    AVATAR_MAX_PIXELS = 24000000
+    AVATAR_WORKERS = 2
+    # a picture no user has is removed by resize-avatars --prune once unused this long
+    AVATAR_PRUNE_AGE = 24 * 3600
+    # let the front server (nginx X-Accel/apache X-Sendfile) send static files
+    USE_X_SENDFILE = os.environ.get('FLASK_USE_X_SENDFILE', '0') == '1'
+    # rendered page cache for anonymous readers: 'lru', 'filesystem' or 'null'
+    # use 'filesystem' when running several worker processes on one host
+    PAGE_CACHE_TYPE = os.environ.get('FLASK_PAGE_CACHE_TYPE', 'lru')
+    PAGE_CACHE_DIR = os.environ.get('FLASK_PAGE_CACHE_DIR')
+    PAGE_CACHE_THRESHOLD = 500
+    PAGE_CACHE_TIMEOUT = 300
+    # seconds the posts per month of the sidebar are kept, a post change
+    # (feed_version) has them read again sooner; 0 reads them on every page
+    ARCHIVE_SNAPSHOT_TTL = 60
+    # newest posts kept in memory per process for the home feed and the
+    # sidebar, 0 disables it; seconds between checks for other processes' changes
+    HOT_FEED_SIZE = int(os.environ.get('FLASK_HOT_FEED_SIZE', 50))
+    HOT_FEED_CHECK_SECONDS = 1.0
+    # rate limits, see ratelimit.py: 'memory' per process, 'sqlite' shared by
+    # the worker processes of one host, 'null' disables them
+    RATE_LIMIT_STORE = os.environ.get('FLASK_RATE_LIMIT_STORE', 'memory')
+    RATE_LIMIT_PATH = os.environ.get('FLASK_RATE_LIMIT_PATH')
+    # endpoint -> {'ip' or 'account': (requests, per seconds)}, on POST
+    # every login costs a password check, register a hash, reset a mail
+    RATE_LIMITS = {
+        'users.login': {'ip': (20, 60), 'account': (10, 60)},
+        'users.register': {'ip': (5, 3600)},
+        'users.reset_request': {'ip': (5, 3600)},
+    }
+    # this many failed logins of an account within the window (seconds) lock it
+    LOGIN_LOCKOUT_FAILURES = 5
+    LOGIN_LOCKOUT_WINDOW = 900
+    # reset mails per address: (mails, per seconds), more are silently dropped
+    RESET_EMAIL_LIMIT = (3, 3600)
+    # per request timings: Server-Timing header, /metrics, slow request log
+    INSTRUMENTATION = os.environ.get('FLASK_INSTRUMENTATION', '0') == '1'
+    SLOW_REQUEST_SECONDS = float(os.environ.get('FLASK_SLOW_REQUEST_SECONDS', 0.5))
+    # compiled templates on disk, shared by the worker processes and
+    # filled at build time by flask precompile-templates; None is a temp dir
+    TEMPLATE_BYTECODE_CACHE = os.environ.get('FLASK_TEMPLATE_BYTECODE_CACHE', '1') == '1'
+    TEMPLATE_CACHE_DIR = os.environ.get('FLASK_TEMPLATE_CACHE_DIR')
+    # load templates, url map and db connections in create_app, see warmup.py
+    WARM_UP = os.environ.get('FLASK_WARM_UP', '0') == '1'
+    WARM_UP_PATHS = ['/', '/login']
+    # production server, python run.py --production, see server.py
+    SERVER_BIND = os.environ.get('FLASK_BIND', '127.0.0.1:8000')
+    SERVER_WORKERS = int(os.environ.get('FLASK_WORKERS', 2 * (os.cpu_count() or 1) + 1))
+    SERVER_THREADS = int(os.environ.get('FLASK_THREADS', 1))
+    SERVER_MAX_REQUESTS = int(os.environ.get('FLASK_MAX_REQUESTS', 5000))
+    SERVER_MAX_REQUESTS_JITTER = 500
+    SERVER_TIMEOUT = 30
+    SERVER_GRACEFUL_TIMEOUT = 30
+    SERVER_KEEPALIVE = 5
+    SERVER_ACCESS_LOG = os.environ.get('FLASK_ACCESS_LOG')
+    # listing pages and feeds sent while they render, see streaming.py
+    STREAM_TEMPLATES = os.environ.get('FLASK_STREAM_TEMPLATES', '1') == '1'
+    STREAM_BUFFER_SIZE = 8192
+    # gzip (and brotli when installed) responses, see compression.py;
+    # turn off when the front server compresses
+    COMPRESSION = os.environ.get('FLASK_COMPRESSION', '1') == '1'
+    COMPRESS_MIN_SIZE = 500
+    COMPRESS_LEVEL = 6
+    COMPRESS_BROTLI_QUALITY = 4
+    # seconds a reverse proxy may serve public pages without revalidating
+    HTTP_CACHE_SMAXAGE = int(os.environ.get('FLASK_HTTP_CACHE_SMAXAGE', 0))
+
+
+class DevelopmentConfig(Config):
+    """Local development, the bundled sqlite database, run.py turns on debug"""
+
+
+class TestingConfig(Config):
+    """Tests: in-memory database, no background threads, cheap hashing"""
+    TESTING = True
+    SECRET_KEY = os.environ.get('FLASK_SECRET_KEY', 'testing')
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    SQLALCHEMY_REPLICA_URIS = []
+    WTF_CSRF_ENABLED = False
+    MAIL_OUTBOX_WORKER = False
+    PASSWORD_HASH_WORKERS = 0
+    BCRYPT_LOG_ROUNDS = 4
+    PAGE_CACHE_TYPE = 'null'
+    USER_CACHE_TTL = 0
+    ARCHIVE_SNAPSHOT_TTL = 0
+    HOT_FEED_SIZE = 0
+    RATE_LIMIT_STORE = 'null'
+    TEMPLATE_BYTECODE_CACHE = False
+
+
+class ProductionConfig(Config):
+    """Production: pooled connections, sqlite in WAL mode"""
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        # connections kept open per worker process, and extra ones under load
+        'pool_size': int(os.environ.get('FLASK_DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('FLASK_DB_MAX_OVERFLOW', 10)),
+        # seconds to wait for a free connection before failing the request
+        'pool_timeout': 10,
+        # reconnect before the server closes idle connections (mysql: 8h)
+        'pool_recycle': int(os.environ.get('FLASK_DB_POOL_RECYCLE', 1800)),
+        # test the connection on checkout, a restarted db costs no failed request
+        'pool_pre_ping': True,
+    }
+    SQLITE_PRAGMAS = {
+        # readers don't block the writer and the writer doesn't block readers
+        'journal_mode': 'WAL',
+        # fsync at checkpoints only, safe with WAL (no corruption, may lose
+        # the last commits on power loss)
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        # read the database file through a 256MB memory map
+        'mmap_size': 256 * 1024 * 1024,
+        # page cache per connection, negative is KiB: 64MB
+        'cache_size': -64000,
+        'temp_store': 'MEMORY',
+    }
+    # several worker processes per host share the filesystem page cache
+    PAGE_CACHE_TYPE = os.environ.get('FLASK_PAGE_CACHE_TYPE', 'filesystem')
+    # and the rate limits
+    RATE_LIMIT_STORE = os.environ.get('FLASK_RATE_LIMIT_STORE', 'sqlite')
+    # a new worker takes its first request warm
+    WARM_UP = os.environ.get('FLASK_WARM_UP', '1') == '1'
+
+
+# FLASK_CONFIG values
+CONFIGS = {
+    'dev': DevelopmentConfig,
+    'test': TestingConfig,
+    'prod': ProductionConfig,
+}
+
+
+def get_config(name=None):
+    """Config class for name, default the FLASK_CONFIG env var, else dev"""
+    name = name or os.environ.get('FLASK_CONFIG', 'dev')
+    try:
+        return CONFIGS[name]
+    except KeyError:
+        raise ValueError(f'Unknown FLASK_CONFIG {name!r}, use one of {", ".join(CONFIGS)}')
@@ -0,0 +1,105 @@
+"""
+Database engine setup
+    init_app(app): engine options and sqlite pragmas of the app
+    add_to_counter(connection, table, column, delta, **key): race free counter upsert
+"""
+from sqlalchemy import and_, event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+from flaskblog import db
+
+"""
+Imports:
+    sqlalchemy:
+        and_, the key of a counter row
+        event, run the pragmas on every new connection
+        IntegrityError, a concurrent transaction inserted the counter row
+        make_url, tell sqlite files from other databases
+        QueuePool, pooled sqlite connections
+    flaskblog: db
+
+Config:
+    SQLALCHEMY_ENGINE_OPTIONS: create_engine() arguments, ie. pool_size,
+        max_overflow, pool_recycle, pool_pre_ping
+    SQLITE_PRAGMAS: PRAGMA name -> value for sqlite connections
+
+Sqlite files get a NullPool by default, a new connection (and a cold page
+cache) per request. When pool settings are configured the connections are
+pooled instead, so the pragmas and the connection's cache outlive the request.
+"""
+
+# create_engine() arguments a NullPool refuses
+POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout')
+
+
+def init_app(app):
+    """
+    Adapt the engine options to the database and install the pragmas.
+    The binds get the same options, they are meant to be alike (replicas).
+    """
+    uri = app.config.get('SQLALCHEMY_DATABASE_URI') or ''
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    url = make_url(uri) if uri else None
+    sqlite = url is not None and url.drivername.startswith('sqlite')
+    if sqlite and url.database and any(key in options for key in POOL_OPTIONS):
+        options.setdefault('poolclass', QueuePool)
+        # pooled connections move between request threads, each is used
+        # by one thread at a time
+        connect_args = dict(options.get('connect_args') or {})
+        connect_args.setdefault('check_same_thread', False)
+        options['connect_args'] = connect_args
+    elif sqlite:
+        # flask_sqlalchemy gives in-memory databases a StaticPool, it has no pool sizes
+        for key in POOL_OPTIONS:
+            options.pop(key, None)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+    pragmas = app.config.get('SQLITE_PRAGMAS') or {}
+    if not (sqlite and pragmas):
+        return
+    listener = _pragmas_listener(pragmas)
+    # the primary and the binds, ie. the read replicas
+    with app.app_context():
+        for bind in [None] + list(app.config.get('SQLALCHEMY_BINDS') or {}):
+            event.listen(db.get_engine(app, bind=bind), 'connect', listener)
+
+
+def _pragmas_listener(pragmas):
+    """connect event listener setting pragmas on each new sqlite connection"""
+    statements = [f'PRAGMA {name} = {value}' for name, value in pragmas.items()]
+
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+    return set_pragmas
+
+
+def add_to_counter(connection, table, column, delta, **key):
+    """
+    Add delta to column of the row of table with the key column values,
+    insert the row with delta when there is none, in the caller's transaction.
+    Two transactions may both miss the row with their UPDATE and both
+    INSERT it. The second INSERT fails on the unique key once the first
+    commits, it is rolled back to a savepoint and the UPDATE is repeated,
+    it now finds the row.
+    Args:
+        connection: connection of the caller's transaction, which has
+            already written (pysqlite only begins it with a write)
+        table: Table with a unique key on the key columns
+        column: name of the counter column
+        key: key column name -> value
+    """
+    where = and_(*(table.c[name] == value for name, value in key.items()))
+    update = table.update().where(where).values({column: table.c[column] + delta})
+    if connection.execute(update).rowcount:
+        return
+    try:
+        with connection.begin_nested():
+            connection.execute(table.insert().values(dict(key, **{column: delta})))
+    except IntegrityError:
+        connection.execute(update)
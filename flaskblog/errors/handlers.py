@@ -22,7 +22,21 @@ def error_404(error):
     return render_template('errors/404.html'), 404
 
 
+@errors.app_errorhandler(429)
+def error_429(error):
+    """429 Errors, rate limited, RateLimited carries the Retry-After seconds"""
+    retry_after = getattr(error, 'retry_after', 60)
+    return render_template('errors/429.html', retry_after=retry_after), 429, \
+        {'Retry-After': str(retry_after)}
+
+
 @errors.app_errorhandler(500)
 def error_500(error):
     """500 Errors"""
     return render_template('errors/500.html'), 500
+
+
+@errors.app_errorhandler(503)
+def error_503(error):
+    """503 Errors, ie. password hashing overloaded"""
+    return render_template('errors/503.html', error=error), 503, {'Retry-After': '5'}
@@ -0,0 +1,109 @@
+"""
+Feeds.routes
+    feed(): /feed.atom
+    user_feed(username): /user/<string:username>/feed.atom
+"""
+
+from datetime import datetime
+from flask import url_for, Blueprint
+from flaskblog import page_cache
+from flaskblog.cache import post_tags, render_conditional, version_validators
+from flaskblog.models import User
+from flaskblog.posts.hotfeed import feed_version
+from flaskblog.posts.utils import listing_query
+from flaskblog.replicas import replica_reads, use_replica
+from flaskblog.streaming import Deferred
+
+"""
+Imports:
+    datetime: updated date of an empty feed
+    Flask
+        Blueprints to modularize the webapp
+        url_for, links of the feed
+    flaskblog:
+        page_cache, the serialized feed is cached until a post in it changes
+        post_tags, cache invalidation tags of the posts in the feed
+        version_validators, render_conditional for conditional GET (304),
+        streamed feeds
+    flaskblog.models:
+        User entity class
+    flaskblog.posts.hotfeed:
+        feed_version, the feeds' validator
+    flaskblog.posts.utils:
+        listing_query, same order as the home and user pages
+    flaskblog.replicas:
+        replica_reads, use_replica: feeds only read
+    flaskblog.streaming:
+        Deferred, the posts are read while the feed is sent
+
+Feed readers poll. A poll of an unchanged feed is answered from the page
+cache, or with a 304 when the reader sends the ETag it got last time.
+The feed is rendered again only after new_post, update_post or
+delete_post invalidated a tag of it. With the bodies of FEED_SIZE posts
+in it a feed is the largest page of the site, it is streamed, and
+compressed as it goes when the reader accepts that (compression.py).
+"""
+
+# Instantiate feeds blueprint
+feeds = Blueprint('feeds', __name__)
+
+# entries per feed
+FEED_SIZE = 20
+ATOM_MIMETYPE = 'application/atom+xml'
+
+# Create routes specifically to the feeds module and register in #
+
+
+def _atom(load, title, feed_url, site_url, *parts):
+    """
+    Atom response of the posts load() returns, or 304 when the reader's
+    copy is current. Streamed, the posts are read while it is sent.
+    """
+    posts = Deferred(load)
+    # no Last-Modified: deleting a post changes the feed but leaves no date
+    response = render_conditional(
+        version_validators(feed_version(), 'atom', *parts), 'feed.xml', stream=True,
+        posts=posts, feed_title=title, feed_url=feed_url, site_url=site_url,
+        updated=Deferred(lambda: max((post.date_modified for post in posts),
+                                     default=datetime.utcnow())))
+    response.mimetype = ATOM_MIMETYPE
+    return response
+
+
+@feeds.route("/feed.atom")
+@replica_reads
+@page_cache.cached()
+def feed():
+    """Atom feed of the newest posts"""
+    # before the posts are read, a post saved meanwhile invalidates the feed
+    page_cache.tag('feed')
+
+    def load():
+        # replica_reads has returned by the time the stream reads the posts
+        with use_replica():
+            posts = listing_query(bodies=True).limit(FEED_SIZE).all()
+        page_cache.tag(*post_tags(posts))
+        return posts
+
+    return _atom(load, 'Flask Blog', url_for('feeds.feed', _external=True),
+                 url_for('main.home', _external=True))
+
+
+@feeds.route("/user/<string:username>/feed.atom")
+@replica_reads
+@page_cache.cached()
+def user_feed(username):
+    """Atom feed of the newest posts of a user"""
+    user = User.query.filter_by(username=username).first_or_404()
+    page_cache.tag(f'posts_by:{user.id}', f'user:{user.id}')
+
+    def load():
+        with use_replica():
+            posts = listing_query(author=user, bodies=True).limit(FEED_SIZE).all()
+        page_cache.tag(*post_tags(posts))
+        return posts
+
+    return _atom(load, f'Flask Blog - {user.username}',
+                 url_for('feeds.user_feed', username=user.username, _external=True),
+                 url_for('users.user_posts', username=user.username, _external=True),
+                 user.id)
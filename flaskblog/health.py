@@ -0,0 +1,61 @@
+"""
+Health checks
+    init_app(app): /healthz and /readyz
+    healthz(): liveness, the process serves requests
+    readyz(): readiness, the primary and the replicas answer
+"""
+import time
+from flask import current_app, jsonify
+from flaskblog import db
+
+"""
+Imports:
+    time: perf_counter, latency of each database
+    Flask:
+        current_app, config and logger
+        jsonify, the result of each check
+    flaskblog: db, engines of the primary and the replicas
+
+/healthz never touches the database: a load balancer or supervisor that
+restarts dead workers should not restart all of them because the
+database is down. /readyz runs SELECT 1 on a pooled connection of every
+engine and answers 503 when one of them fails, so the load balancer
+takes the instance out of rotation until it answers again. Neither is
+cached, by the page cache or anyone else.
+"""
+
+
+def init_app(app):
+    """Add the health check routes"""
+    app.add_url_rule('/healthz', 'healthz', healthz)
+    app.add_url_rule('/readyz', 'readyz', readyz)
+
+
+def _no_store(response, status=200):
+    response.status_code = status
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+def healthz():
+    """The process is up and serving"""
+    return _no_store(jsonify(status='ok'))
+
+
+def readyz():
+    """SELECT 1 on every engine, 503 when one fails"""
+    checks = {}
+    for bind in [None] + list(current_app.config.get('SQLALCHEMY_BINDS') or {}):
+        name = bind or 'primary'
+        started = time.perf_counter()
+        try:
+            with db.get_engine(current_app, bind=bind).connect() as connection:
+                connection.execute('SELECT 1')
+            checks[name] = {'status': 'ok'}
+        except Exception as error:  # pylint: disable=broad-except
+            current_app.logger.warning('readiness check of %s failed: %s', name, error)
+            checks[name] = {'status': 'failed', 'error': error.__class__.__name__}
+        checks[name]['ms'] = round((time.perf_counter() - started) * 1000, 1)
+    ready = all(check['status'] == 'ok' for check in checks.values())
+    return _no_store(jsonify(status='ok' if ready else 'failed', databases=checks),
+                     200 if ready else 503)
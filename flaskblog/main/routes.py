@@ -1,11 +1,18 @@
 """
 Main.routes
     home(): /, /home
+    latest_posts(): /latest
     about(): /about
 """
 
 from flask import render_template, request, Blueprint
-from flaskblog.models import Post
+from flaskblog import page_cache
+from flaskblog.cache import (post_tags, post_validators, render_conditional,
+                             version_validators)
+from flaskblog.posts.utils import listing_query, keyset_paginate, pagination_state
+from flaskblog.posts.hotfeed import feed_version, hot_page
+from flaskblog.replicas import replica_reads, use_replica
+from flaskblog.streaming import Deferred
 
 """
 Imports:
@@ -13,11 +20,28 @@ Imports:
         Blueprints to modularize the webapp
         render_template to render the html form (ie. home.html, about.html...)
         request to GET http arguments
-    flaskblog.models:
-        User and Post entity class
+    flaskblog:
+        page_cache to cache the rendered page for anonymous readers
+        post_tags, cache invalidation tags of the listed posts
+        post_validators, version_validators, render_conditional for
+        conditional GET (304), streamed pages
+    flaskblog.posts.utils:
+        listing_query, posts with their authors eager loaded
+        keyset_paginate, cursor pagination of a listing
+        pagination_state, part of the page validators
+    flaskblog.posts.hotfeed:
+        hot_page, the first pages of the feed from the posts kept in memory
+        feed_version, the home page's validator, the sidebar's part of the others
+    flaskblog.replicas:
+        replica_reads, use_replica: the listing may be read from a replica
+    flaskblog.streaming:
+        Deferred, the posts are read after the page's head was sent
 
 """
 
+# posts on the /latest page
+LATEST_POSTS = 10
+
 # Instantiate main blueprint
 main = Blueprint('main', __name__)
 
@@ -26,29 +50,49 @@ main = Blueprint('main', __name__)
 
 @main.route("/")
 @main.route("/home")
+@replica_reads
+@page_cache.cached()
 def home():
     """Home route and render form"""
-    # set the page from GET, default 1, must be int else page throws valueerror!
-    page = request.args.get('page', 1, type=int)
-    # get 5 posts from db
-    # order by newest post
-    posts = Post.query.order_by(Post.date_posted.desc()).paginate(page=page, per_page=5)
-    return render_template('home.html', posts=posts)
+    # ?page=n is the old offset pagination, kept so existing links work
+    page = request.args.get('page', type=int)
+    cursor = request.args.get('cursor')
+    # before the posts are read, a post saved meanwhile invalidates the page
+    page_cache.tag('feed', 'sidebar')
 
+    def load():
+        # replica_reads has returned by the time a streamed page reads the posts
+        with use_replica():
+            # get 5 posts from db, authors loaded in the same query
+            # order by newest post
+            if page:
+                posts = listing_query().paginate(page=page, per_page=5)
+            else:
+                # default: seek from the ?cursor= token, no COUNT and no OFFSET,
+                # the first pages come from the hot feed without a query
+                posts = hot_page(cursor, per_page=5) or \
+                    keyset_paginate(listing_query(), cursor, per_page=5)
+        page_cache.tag(*post_tags(posts.items))
+        return posts
 
-@main.route("/home")
+    # the posts are read while the page streams, after its head was sent,
+    # but ?page= past the last page is a 404, decided before anything is sent
+    posts = load() if page else Deferred(load)
+    validators = version_validators(feed_version(), page, cursor)
+    return render_conditional(validators, 'home.html', stream=True, posts=posts)
+
+
+@main.route("/latest")
+@replica_reads
+@page_cache.cached()
 def latest_posts():
-    """Home route and render form"""
-    # set the page from GET, default 1, must be int else page throws valueerror!
-    page = request.args.get('page', 1, type=int)
-    # get 5 posts from db
-    # order by newest post
-    # query.(Model).filter(something).limit(5).all()
-    posts = Post.query\
-        .order_by(Post.date_posted.desc())\
-        .limit(2)\
-        .paginate(page=page, per_page=5)
-    return render_template('home.html', posts=posts)
+    """The newest posts on one page, older ones are paged by the home feed"""
+    page_cache.tag('feed', 'sidebar')
+    posts = hot_page(per_page=LATEST_POSTS) or \
+        keyset_paginate(listing_query(), per_page=LATEST_POSTS)
+    page_cache.tag(*post_tags(posts.items))
+    validators = post_validators(posts.items, feed_version(), *pagination_state(posts))
+    return render_conditional(validators, 'home.html', title='Latest Posts', posts=posts)
 
 
 @main.route("/about")
@@ -0,0 +1,259 @@
+"""
+Request instrumentation
+    init_app(app): instrument the app when INSTRUMENTATION is on
+    Histogram: cumulative histogram, prometheus style buckets
+    RequestTimings: sql, template and hashing time of one request
+    metrics_view(): /metrics, prometheus text format
+"""
+import threading
+import time
+from collections import Counter
+from flask import (current_app, g, has_request_context, request, Response,
+                   before_render_template, template_rendered)
+from sqlalchemy import event
+from flaskblog import db
+from flaskblog.outbox import outbox_metrics
+from flaskblog.signals import password_hashed
+from flaskblog.users.hashing import hashing_metrics
+
+"""
+Imports:
+    threading: lock of the histograms
+    time: perf_counter timings
+    collections.Counter: repeated statements in the slow request log
+    Flask:
+        current_app, config, logger and extensions
+        g, has_request_context: timings of the current request
+        request, endpoint label
+        Response, /metrics
+        before_render_template, template_rendered: template timings
+    sqlalchemy: event, cursor execute events time the statements
+    flaskblog: db, engines to instrument
+    flaskblog.outbox: outbox_metrics, mail queue gauges
+    flaskblog.signals: password_hashed, hashing time
+    flaskblog.users.hashing: hashing_metrics, hashing pool gauges
+
+Config:
+    INSTRUMENTATION: on or off, off installs nothing at all
+    SLOW_REQUEST_SECONDS: requests slower than this are logged with their SQL
+
+Per request, with INSTRUMENTATION on:
+    Server-Timing header: db (statements and time), tpl (rendering),
+        hash (password hashing) and total, visible in the browser devtools
+    /metrics: histograms and counters of this process since it started,
+        plus the outbox and hashing pool gauges
+    slow request log: a warning with the slowest and the most repeated
+        statements of the request
+"""
+
+# seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# statements per request
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+# statements kept per request for the slow request log
+MAX_STATEMENTS = 200
+
+
+class Histogram:
+    """
+    Cumulative histogram per label value, ie. per endpoint.
+    Counts only grow, prometheus computes the rates over its scrapes.
+    """
+
+    def __init__(self, name, description, buckets, label):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.label = label
+        # label value -> [bucket counts..., sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        """Count value under label_value"""
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def exposition(self):
+        """Lines of the prometheus text format"""
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {key: list(value) for key, value in self._series.items()}
+        for label_value, values in sorted(series.items()):
+            label = f'{self.label}="{label_value}"'
+            for bound, count in zip(self.buckets, values):
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {values[-1]}')
+            lines.append(f'{self.name}_sum{{{label}}} {values[-2]}')
+            lines.append(f'{self.name}_count{{{label}}} {values[-1]}')
+        return lines
+
+
+class RequestTimings:
+    """What the current request spent its time on"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        # (seconds, statement), the first MAX_STATEMENTS
+        self.statements = []
+        # template name -> seconds
+        self.templates = Counter()
+        self._rendering = []
+        self.hash_seconds = 0.0
+
+    def server_timing(self, total):
+        """Server-Timing header value, durations in ms"""
+        parts = [f'db;desc="{self.sql_count} queries";dur={self.sql_seconds * 1000:.1f}']
+        if self.templates:
+            parts.append(f'tpl;dur={sum(self.templates.values()) * 1000:.1f}')
+        if self.hash_seconds:
+            parts.append(f'hash;dur={self.hash_seconds * 1000:.1f}')
+        parts.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(parts)
+
+
+_histograms = {
+    'request': Histogram('flaskblog_request_duration_seconds',
+                         'Wall time of requests.', DURATION_BUCKETS, 'endpoint'),
+    'sql_count': Histogram('flaskblog_request_sql_statements',
+                           'SQL statements per request.', QUERY_BUCKETS, 'endpoint'),
+    'sql_seconds': Histogram('flaskblog_request_sql_seconds',
+                             'Time in SQL statements per request.', DURATION_BUCKETS, 'endpoint'),
+    'template': Histogram('flaskblog_template_render_seconds',
+                          'Rendering time per template.', DURATION_BUCKETS, 'template'),
+    'hash': Histogram('flaskblog_password_hash_seconds',
+                      'Password hash and check time, with the wait for the pool.',
+                      DURATION_BUCKETS, 'operation'),
+}
+
+
+def _timings():
+    """RequestTimings of the current request, None outside of requests"""
+    return g.get('request_timings') if has_request_context() else None
+
+
+def init_app(app):
+    """Install the hooks, the listeners and /metrics when INSTRUMENTATION is on"""
+    if not app.config.get('INSTRUMENTATION'):
+        return
+    app.before_request(_start_request)
+    app.after_request(_end_request)
+    before_render_template.connect(_start_template, app)
+    template_rendered.connect(_end_template, app)
+    password_hashed.connect(_on_password_hashed, app)
+    with app.app_context():
+        # the primary and the binds, ie. the read replicas
+        for bind in [None] + list(app.config.get('SQLALCHEMY_BINDS') or {}):
+            engine = db.get_engine(app, bind=bind)
+            event.listen(engine, 'before_cursor_execute', _start_statement)
+            event.listen(engine, 'after_cursor_execute', _end_statement)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+
+
+def _start_request():
+    g.request_timings = RequestTimings()
+
+
+def _end_request(response):
+    timings = _timings()
+    if timings is None:
+        return response
+    total = time.perf_counter() - timings.started
+    endpoint = request.endpoint or 'none'
+    response.headers['Server-Timing'] = timings.server_timing(total)
+    _histograms['request'].observe(endpoint, total)
+    _histograms['sql_count'].observe(endpoint, timings.sql_count)
+    _histograms['sql_seconds'].observe(endpoint, timings.sql_seconds)
+    if total >= current_app.config['SLOW_REQUEST_SECONDS']:
+        _log_slow_request(timings, total)
+    return response
+
+
+def _log_slow_request(timings, total):
+    slowest = sorted(timings.statements, reverse=True)[:5]
+    repeated = Counter(statement for _, statement in timings.statements).most_common(3)
+    lines = [f'Slow request {request.method} {request.full_path.rstrip("?")} ({request.endpoint}): '
+             f'{total * 1000:.0f}ms, {timings.sql_count} statements in '
+             f'{timings.sql_seconds * 1000:.0f}ms, templates '
+             f'{sum(timings.templates.values()) * 1000:.0f}ms, hashing '
+             f'{timings.hash_seconds * 1000:.0f}ms']
+    lines += [f'  {seconds * 1000:.1f}ms {statement[:500]}' for seconds, statement in slowest]
+    # the same statement many times is an N+1 query
+    lines += [f'  {count}x {statement[:500]}' for statement, count in repeated if count > 1]
+    current_app.logger.warning('\n'.join(lines))
+
+
+def _start_statement(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('statement_started', []).append(time.perf_counter())
+
+
+def _end_statement(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info['statement_started'].pop()
+    timings = _timings()
+    if timings is None:
+        return
+    timings.sql_count += 1
+    timings.sql_seconds += seconds
+    if len(timings.statements) < MAX_STATEMENTS:
+        timings.statements.append((seconds, statement))
+
+
+def _start_template(app, template, context):
+    timings = _timings()
+    if timings is not None:
+        timings._rendering.append(time.perf_counter())
+
+
+def _end_template(app, template, context):
+    timings = _timings()
+    if timings is None or not timings._rendering:
+        return
+    seconds = time.perf_counter() - timings._rendering.pop()
+    timings.templates[template.name] += seconds
+    _histograms['template'].observe(template.name, seconds)
+
+
+def _on_password_hashed(app, operation, seconds):
+    _histograms['hash'].observe(operation, seconds)
+    timings = _timings()
+    if timings is not None:
+        timings.hash_seconds += seconds
+
+
+def _gauge(name, description, value):
+    return [f'# HELP {name} {description}', f'# TYPE {name} gauge', f'{name} {value}']
+
+
+def _counter(name, description, value):
+    return [f'# HELP {name} {description}', f'# TYPE {name} counter', f'{name} {value}']
+
+
+def metrics_view():
+    """Metrics of this worker process, prometheus text format"""
+    lines = []
+    for histogram in _histograms.values():
+        lines += histogram.exposition()
+    outbox = outbox_metrics()
+    lines += _gauge('flaskblog_outbox_queue_depth', 'Mails waiting to be sent.',
+                    outbox['queue_depth'])
+    for name in ('sent', 'retried', 'failed'):
+        lines += _counter(f'flaskblog_outbox_{name}_total', f'Mails {name} by this process.',
+                          outbox[name])
+    lines += _counter('flaskblog_outbox_send_seconds_total', 'Time spent sending mails.',
+                      outbox['send_seconds_total'])
+    hashing = hashing_metrics()
+    lines += _gauge('flaskblog_password_hash_in_flight',
+                    'Password hashes running or waiting for the pool.', hashing['in_flight'])
+    if hashing['capacity'] is not None:
+        lines += _gauge('flaskblog_password_hash_capacity',
+                        'Password hashes allowed to run or wait at once.', hashing['capacity'])
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
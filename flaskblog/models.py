@@ -2,64 +2,39 @@
 Entity models
 """
 from datetime import datetime
-from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
-from flask import current_app
-from flaskblog import db, login_mgmr
+from flaskblog import db
 from flask_login import UserMixin
 """
 Imports:
     Python:
         datetime to post default date
-        itsdangerous to handle tokens used in mail. Used i User.
     flaskblog:
         db (database created in flaskblog.py)
-        login_manager to handle logged in users, def load_user
-        current_app to get the secret key, used in User
     flask_login:
         UserMixin to add required attributes and functions, inherited in User class
 """
 
-# decorate so LoginManager extension knows this is the function that gets the user by id
-@login_mgmr.user_loader
-def load_user(user_id):
-    """Get user by id"""
-    return User.query.get(int(user_id))
+# the flask_login user loader is users.loader.load_user
+# password reset tokens are made and checked in users.tokens
 
 
 # Create db model classes
 class User(db.Model, UserMixin):
     """
     User entity class
-        id, username, email, image_file, password, posts-relation
+        id, username, email, image_file, password, version, posts-relation
     """
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(20), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     image_file = db.Column(db.String(20), nullable=False,
                            default='default.png')
-    password = db.Column(db.String(60), nullable=False)
+    # method and cost are stored in the hash, see users.hashing
+    password = db.Column(db.String(128), nullable=False)
+    # bumped on every profile change, part of the validators of cached pages
+    version = db.Column(db.Integer, nullable=False, default=1)
     posts = db.relationship('Post', backref='author', lazy=True)
 
-    def get_reset_token(self, expires_sec=1800):
-        """get_reset_token"""
-        s = Serializer(current_app.config['SECRET_KEY'], expires_sec)
-        return s.dumps({'user_id': self.id}).decode('utf-8')
-
-    # decorator to tell py not to expect the self parameter as an argument
-    @staticmethod
-    def verify_reset_token(token):
-        """verify_reset_token"""
-        s = Serializer(current_app.config['SECRET_KEY'])
-        # handle SignatureExpired exeption
-        try:
-            user_id = s.loads(token)['user_id']
-        except:
-            # Do nothing
-            return None
-        # return the user with the user_id from the token payload
-        return User.query.get(user_id)
-
-
     def __repr__(self):
         return f"User('{self.username}', '{self.email}', '{self.image_file}')"
 
@@ -67,14 +42,106 @@ class User(db.Model, UserMixin):
 class Post(db.Model):
     """
     Post entity class
-        id, title, data_posted, content, user_id
+        id, title, data_posted, date_modified, content, user_id,
+        content_html, excerpt, word_count (derived from content)
     """
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     date_posted = db.Column(db.DateTime, nullable=False,
-                            default=datetime.utcnow())
+                            default=datetime.utcnow)
+    # last edit, part of the ETag of the pages showing the post
+    date_modified = db.Column(db.DateTime, nullable=False,
+                              default=datetime.utcnow, onupdate=datetime.utcnow)
     content = db.Column(db.Text, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # derived from content by posts.utils.render_post whenever it is saved,
+    # flask render-posts fills them for older rows
+    content_html = db.Column(db.Text)
+    excerpt = db.Column(db.String(255))
+    word_count = db.Column(db.Integer)
+
+    # composite indexes for the listings' keyset seek on (date_posted, id),
+    # the per user index also covers id since sqlite appends the rowid
+    __table_args__ = (
+        db.Index('ix_post_date_posted_id', 'date_posted', 'id'),
+        db.Index('ix_post_user_id_date_posted', 'user_id', 'date_posted'),
+    )
+
+    @property
+    def excerpt_truncated(self):
+        """True when the excerpt is not the whole post"""
+        return bool(self.excerpt) and self.excerpt.endswith('\u2026')
 
     def __repr__(self):
         return f"Post('{self.title}', '{self.date_posted}')"
+
+
+class PostMonthCount(db.Model):
+    """
+    Posts per month, maintained by archive.utils on every post insert and delete
+        year, month, user_id (0 counts the posts of all authors), count
+    """
+    year = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    month = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    # no foreign key, 0 is the row of all authors
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"PostMonthCount('{self.year}-{self.month:02}', '{self.user_id}', '{self.count}')"
+
+
+class ChangeCounter(db.Model):
+    """
+    Named counters, bumped in the transaction of a change so the caches of
+    other processes notice it, ie. 'hot_feed' by posts.hotfeed
+        name, value
+    """
+    name = db.Column(db.String(40), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"ChangeCounter('{self.name}', '{self.value}')"
+
+
+class OutboxMessage(db.Model):
+    """
+    Outbox entity class, an email waiting to be sent by the outbox worker
+        id, subject, sender, recipients, body, html, status, attempts,
+        next_attempt_at, created_at, sent_at, last_error
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(255), nullable=False)
+    sender = db.Column(db.String(120), nullable=False)
+    # comma separated addresses
+    recipients = db.Column(db.Text, nullable=False)
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    # pending, sending (claimed by a worker), sent or failed (gave up)
+    status = db.Column(db.String(10), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # when a worker may pick it (again), also the lease end while sending
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+
+    # the worker's claim query: status in (...) and next_attempt_at <= now
+    __table_args__ = (
+        db.Index('ix_outbox_message_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+
+    def __repr__(self):
+        return f"OutboxMessage('{self.subject}', '{self.recipients}', '{self.status}')"
+
+
+class ImportCheckpoint(db.Model):
+    """
+    Progress of an import-posts run, written in the transaction of each batch
+        source (absolute path of the imported file), rows_done
+    """
+    source = db.Column(db.String(255), primary_key=True)
+    rows_done = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"ImportCheckpoint('{self.source}', '{self.rows_done}')"
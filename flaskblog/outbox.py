@@ -0,0 +1,279 @@
+"""
+Mail outbox
+    enqueue(msg): store a flask_mail Message, the request path only does this
+    deliver_batch(): send due messages over one SMTP connection
+    OutboxWorker: background thread calling deliver_batch()
+    start_worker(app): start the sender thread of this process, when MAIL_OUTBOX_WORKER is on
+    queue_depth(), outbox_metrics(): queue and send latency metrics
+    send_mail_command: flask send-mail, drain the outbox from the cli
+"""
+import os
+import smtplib
+import threading
+import time
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from flask_mail import Message
+from flaskblog import db, mail
+from flaskblog.models import OutboxMessage
+
+"""
+Imports:
+    os: pid, a forked worker process starts its own sender thread
+    smtplib: SMTP errors that make a message retry
+    threading, time: the sender thread and its wake up event
+    datetime: retry backoff and sending lease
+    click, flask.cli.with_appcontext: the send-mail command
+    Flask:
+        current_app, config and the app handed to the sender thread
+    flask_mail: Message, rebuilt from the stored row
+    flaskblog: db, mail
+    flaskblog.models: OutboxMessage entity class
+
+Config:
+    MAIL_OUTBOX_WORKER: a sender thread in each process serving requests,
+        started with the process (server.post_fork, run.py) and by an
+        enqueue when it isn't running
+    MAIL_OUTBOX_BATCH_SIZE: messages sent per SMTP connection
+    MAIL_OUTBOX_MAX_ATTEMPTS: attempts before a message is marked failed
+    MAIL_OUTBOX_BACKOFF: seconds before the first retry, doubled each retry
+    MAIL_OUTBOX_POLL_INTERVAL: seconds the sender sleeps when idle
+
+The messages stay in the outbox over restarts and deploys: the sender
+thread started with a worker process sends those pending or due for a
+retry, before anyone enqueues a new one. The gunicorn master and the
+cli commands start none, a thread does not survive the fork and a
+command may exit in the middle of a send.
+
+Point MAIL_SERVER/MAIL_PORT at a local stand-in SMTP server to try it,
+ie. python -m aiosmtpd -n -l localhost:8025, tests/test_outbox.py runs one.
+"""
+
+# seconds a claimed message stays with one worker before others may retry it
+SEND_LEASE = 300
+# retry delays never grow beyond this
+MAX_BACKOFF = 3600
+
+_metrics_lock = threading.Lock()
+_metrics = {
+    'sent': 0,
+    'retried': 0,
+    'failed': 0,
+    'send_seconds_total': 0.0,
+    'send_seconds_max': 0.0,
+}
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def enqueue(msg):
+    """
+    Store msg in the outbox and wake the sender, no SMTP on the request path
+    Args: msg, flask_mail Message
+    """
+    row = OutboxMessage(subject=msg.subject, sender=msg.sender,
+                        recipients=','.join(msg.recipients),
+                        body=msg.body, html=msg.html)
+    db.session.add(row)
+    db.session.commit()
+    app = current_app._get_current_object()
+    if app.config['MAIL_OUTBOX_WORKER']:
+        _ensure_worker(app).wake()
+    return row
+
+
+def _claim(batch_size):
+    """
+    Claim up to batch_size due messages for this worker.
+    A claim is a conditional UPDATE, so two workers never send the same row.
+    It counts the attempt: a worker that dies while sending leaves the row
+    to be claimed again once the lease ends, and that must give up as well.
+    """
+    now = datetime.utcnow()
+    max_attempts = current_app.config['MAIL_OUTBOX_MAX_ATTEMPTS']
+    due = OutboxMessage.query\
+        .filter(OutboxMessage.status.in_(('pending', 'sending')),
+                OutboxMessage.next_attempt_at <= now)\
+        .order_by(OutboxMessage.next_attempt_at)\
+        .limit(batch_size).all()
+    claimed = []
+    lease_end = now + timedelta(seconds=SEND_LEASE)
+    for row in due:
+        current = OutboxMessage.query\
+            .filter_by(id=row.id, next_attempt_at=row.next_attempt_at)
+        if row.attempts >= max_attempts:
+            # every attempt was claimed by workers that never finished it
+            if current.update({'status': 'failed', 'last_error': 'sending lease expired'},
+                              synchronize_session=False):
+                _count('failed')
+            continue
+        won = current.update({'status': 'sending', 'next_attempt_at': lease_end,
+                              'attempts': OutboxMessage.attempts + 1},
+                             synchronize_session=False)
+        if won:
+            claimed.append(row.id)
+    db.session.commit()
+    if not claimed:
+        return []
+    return OutboxMessage.query.filter(OutboxMessage.id.in_(claimed)).all()
+
+
+def _retry(row, error):
+    """Schedule row again with exponential backoff, or give up"""
+    # row.attempts counts this attempt, _claim did
+    row.last_error = str(error)
+    if row.attempts >= current_app.config['MAIL_OUTBOX_MAX_ATTEMPTS']:
+        row.status = 'failed'
+        _count('failed')
+    else:
+        delay = min(current_app.config['MAIL_OUTBOX_BACKOFF'] * 2 ** (row.attempts - 1),
+                    MAX_BACKOFF)
+        row.status = 'pending'
+        row.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+        _count('retried')
+
+
+def deliver_batch():
+    """
+    Send one batch of due messages over a single SMTP connection.
+    Needs an app context.
+    Returns: number of messages claimed
+    """
+    rows = _claim(current_app.config['MAIL_OUTBOX_BATCH_SIZE'])
+    if not rows:
+        return 0
+    try:
+        with mail.connect() as conn:
+            for index, row in enumerate(rows):
+                msg = Message(row.subject, sender=row.sender,
+                              recipients=row.recipients.split(','),
+                              body=row.body, html=row.html)
+                started = time.perf_counter()
+                try:
+                    conn.send(msg)
+                except smtplib.SMTPServerDisconnected as error:
+                    # the connection is gone, the rest of the batch retries later
+                    for unsent in rows[index:]:
+                        _retry(unsent, error)
+                    break
+                except (smtplib.SMTPException, OSError) as error:
+                    _retry(row, error)
+                else:
+                    _observe_send(time.perf_counter() - started)
+                    row.status = 'sent'
+                    row.sent_at = datetime.utcnow()
+                # commit each message, a crash must not resend the sent ones
+                db.session.commit()
+    except (smtplib.SMTPException, OSError) as error:
+        # connecting, starttls or login failed: retry everything still claimed
+        for row in rows:
+            if row.status == 'sending':
+                _retry(row, error)
+        db.session.commit()
+    return len(rows)
+
+
+class OutboxWorker(threading.Thread):
+    """Sender thread, delivers batches until the outbox is drained, then waits"""
+
+    def __init__(self, app):
+        super().__init__(name='outbox-worker', daemon=True)
+        self.app = app
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+
+    def wake(self):
+        """Deliver now instead of at the next poll"""
+        self._wake.set()
+
+    def stop(self):
+        """Exit after the batch being sent"""
+        self._stopped.set()
+        self._wake.set()
+
+    def run(self):
+        interval = self.app.config['MAIL_OUTBOX_POLL_INTERVAL']
+        while not self._stopped.is_set():
+            with self.app.app_context():
+                try:
+                    while deliver_batch():
+                        pass
+                except Exception:  # pylint: disable=broad-except
+                    # keep the sender alive, the rows are retried after their lease
+                    self.app.logger.exception('Outbox delivery failed')
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            self._wake.wait(interval)
+            self._wake.clear()
+
+
+def start_worker(app):
+    """
+    Start the sender thread of this process, it sends what earlier
+    processes left in the outbox right away
+    Returns: the OutboxWorker, None when MAIL_OUTBOX_WORKER is off
+    """
+    if not app.config['MAIL_OUTBOX_WORKER']:
+        return None
+    return _ensure_worker(app)
+
+
+def _ensure_worker(app):
+    """The sender thread of this process, started if it isn't running"""
+    global _worker
+    with _worker_lock:
+        # threads do not survive fork, each worker process starts its own
+        if _worker is None or _worker.pid != os.getpid() or not _worker.is_alive():
+            _worker = OutboxWorker(app)
+            _worker.pid = os.getpid()
+            _worker.start()
+        return _worker
+
+
+def _count(name):
+    with _metrics_lock:
+        _metrics[name] += 1
+
+
+def _observe_send(seconds):
+    with _metrics_lock:
+        _metrics['sent'] += 1
+        _metrics['send_seconds_total'] += seconds
+        _metrics['send_seconds_max'] = max(_metrics['send_seconds_max'], seconds)
+
+
+def queue_depth():
+    """Messages waiting to be sent, needs an app context"""
+    return OutboxMessage.query\
+        .filter(OutboxMessage.status.in_(('pending', 'sending'))).count()
+
+
+def outbox_metrics():
+    """Counters of this process plus the current queue depth"""
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    metrics['send_seconds_avg'] = \
+        metrics['send_seconds_total'] / metrics['sent'] if metrics['sent'] else 0.0
+    metrics['queue_depth'] = queue_depth()
+    return metrics
+
+
+@click.command('send-mail')
+@click.option('--loop', is_flag=True,
+              help='Keep polling the outbox instead of exiting when it is empty.')
+@with_appcontext
+def send_mail_command(loop):
+    """Send the messages waiting in the mail outbox."""
+    interval = current_app.config['MAIL_OUTBOX_POLL_INTERVAL']
+    while True:
+        sent_before = _metrics['sent']
+        while deliver_batch():
+            pass
+        click.echo(f'sent {_metrics["sent"] - sent_before}, queue depth {queue_depth()}')
+        if not loop:
+            break
+        time.sleep(interval)
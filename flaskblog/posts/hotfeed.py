@@ -0,0 +1,392 @@
+"""
+Hot feed
+    init_app(app): hot feed of the app, recent_posts template helper
+    HotFeed: the newest posts of the site, per process
+    HotPost, HotAuthor: read only copies of a post and its author
+    hot_page(cursor, per_page): KeysetPage of the home feed from the hot feed
+    recent_posts(count=5): the newest posts, for the sidebar
+    feed_version(): version counter of the listings, for their validators
+    bump_version(connection): mark the newest posts as changed, in the caller's transaction
+"""
+import threading
+import time
+from collections import deque
+from itertools import islice
+from flask import current_app
+from sqlalchemy import event, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import object_session
+from flaskblog import db
+from flaskblog.database import add_to_counter
+from flaskblog.models import ChangeCounter, Post, User
+from flaskblog.posts.utils import (CURSOR_NEXT, decode_cursor, keyset_page,
+                                   listing_query)
+from flaskblog.signals import post_created, post_updated, post_deleted, user_updated
+
+"""
+Imports:
+    threading: lock of the buffer, the picture job changes users from its own thread
+    time: monotonic, when the version counter was last read
+    collections.deque: bounded buffer, the oldest post falls off the end
+    itertools.islice: read a page without copying the buffer
+    Flask:
+        current_app, config and extensions
+    sqlalchemy:
+        event, mapper events bump the version in the transaction of the change
+        select, the bumped version
+        OperationalError, no tables yet when the app starts
+        object_session, the session that flushed a change
+    flaskblog: db
+    flaskblog.database: add_to_counter, the counter row is upserted
+    flaskblog.models: ChangeCounter, Post and User entity classes
+    flaskblog.posts.utils:
+        CURSOR_NEXT, decode_cursor: the cursors of the home feed
+        keyset_page, a page of the buffer is built like a page read from the db
+        listing_query, loads the buffer
+    flaskblog.signals: post_created, post_updated, post_deleted, user_updated,
+        apply the change to the buffer of this process
+
+Config:
+    HOT_FEED_SIZE: posts kept per process, 0 disables the hot feed
+    HOT_FEED_CHECK_SECONDS: how often the version counter is read, the most
+        a change made by another process takes to show up
+
+Most page views are the first pages of the home feed and every page shows
+the sidebar's newest posts. Each worker process keeps the newest
+HOT_FEED_SIZE posts, with their authors, in memory and serves those from
+it. A page reaching past the buffer is read from the database as before.
+
+The buffer is loaded when the app starts. Changes made by this process
+are applied to it by the signal handlers. Changes made by other processes
+are noticed through the 'hot_feed' row of change_counter: the mapper
+events below bump it in the transaction of every post insert, update and
+delete and of every change to a username or picture, the importer and
+render-posts bump it themselves. Every HOT_FEED_CHECK_SECONDS a reader
+compares it with the version of its buffer and reloads the buffer when
+they differ.
+
+The same counter versions the listing pages: feed_version() goes into
+their ETag, which is then known before their posts are read.
+"""
+
+# change_counter row of the hot feed
+COUNTER = 'hot_feed'
+# session.info key, the version the last change of the session produced
+SESSION_VERSION_KEY = 'hot_feed_version'
+
+
+class HotAuthor:
+    """What the listings show of an author"""
+    __slots__ = ('id', 'username', 'image_file', 'version')
+
+    def __init__(self, user):
+        self.id = user.id
+        self.username = user.username
+        self.image_file = user.image_file
+        self.version = user.version
+
+
+class HotPost:
+    """What the listings show of a post, same attribute names as Post"""
+    __slots__ = ('id', 'title', 'date_posted', 'date_modified', 'excerpt',
+                 'word_count', 'user_id', 'author')
+
+    def __init__(self, post, author=None):
+        self.id = post.id
+        self.title = post.title
+        self.date_posted = post.date_posted
+        self.date_modified = post.date_modified
+        self.excerpt = post.excerpt
+        self.word_count = post.word_count
+        self.user_id = post.user_id
+        self.author = author or HotAuthor(post.author)
+
+    excerpt_truncated = Post.excerpt_truncated
+
+    def __repr__(self):
+        return f"HotPost('{self.title}', '{self.date_posted}')"
+
+
+def _position(post):
+    """Sort key of the listings, (date_posted, id)"""
+    return post.date_posted, post.id
+
+
+class HotFeed:
+    """
+    The newest posts of the site, newest first. complete is True when the
+    buffer holds every post, then no page needs the database.
+    """
+
+    def __init__(self, size, check_seconds):
+        self.size = size
+        self.check_seconds = check_seconds
+        self._lock = threading.Lock()
+        self._posts = deque(maxlen=size)
+        self._complete = False
+        # version counter value the buffer reflects, None to reload on the next read
+        self._version = None
+        self._checked = 0.0
+
+    def load(self):
+        """Read the newest posts and the version counter from the database"""
+        # the counter first: a change committed in between is loaded now
+        # and reloaded after the next check, never missed
+        version = _read_version()
+        rows = listing_query().limit(self.size + 1).all()
+        posts = deque((HotPost(row) for row in rows[:self.size]), maxlen=self.size)
+        with self._lock:
+            self._posts = posts
+            self._complete = len(rows) <= self.size
+            self._version = version
+            self._checked = time.monotonic()
+
+    def _current(self):
+        """Reload when another process changed the newest posts"""
+        now = time.monotonic()
+        if self._version is not None and now - self._checked < self.check_seconds:
+            return
+        if self._version is not None and _read_version() == self._version:
+            self._checked = now
+            return
+        self.load()
+
+    @property
+    def version(self):
+        """Version counter value the buffer reflects, checked like a read"""
+        self._current()
+        return self._version
+
+    def newest(self, start, count):
+        """
+        Posts start to start + count of the buffer, and whether the buffer
+        holds every post. Must run in an app context.
+        """
+        self._current()
+        with self._lock:
+            return list(islice(self._posts, start, start + count)), self._complete
+
+    def seek(self, position, count):
+        """
+        Posts older (CURSOR_NEXT) or newer (CURSOR_PREV) than position, up to
+        count in seek order, or None when the buffer does not hold all of them
+        """
+        direction, date_posted, post_id = position
+        key = (date_posted, post_id)
+        self._current()
+        with self._lock:
+            posts = list(self._posts)
+            complete = self._complete
+        # index of the first post older than the cursor
+        index = next((index for index, post in enumerate(posts) if _position(post) < key),
+                     len(posts))
+        if direction == CURSOR_NEXT:
+            if not complete and index + count > len(posts):
+                return None
+            return posts[index:index + count]
+        # newer posts, read upwards
+        newer = index - 1 if index and _position(posts[index - 1]) == key else index
+        if not complete and newer == len(posts):
+            # the cursor is older than the buffer, the posts just above it are not in it
+            return None
+        return posts[max(0, newer - count):newer][::-1]
+
+    def apply(self, change, version):
+        """
+        Apply change(posts) to the buffer, version is the counter value the
+        change produced. A change the buffer can't follow (another process
+        changed posts too) reloads it on the next read.
+        """
+        with self._lock:
+            if self._version is None or version != self._version + 1:
+                self._version = None
+                return
+            self._version = version
+            change(self._posts)
+
+    def add(self, post):
+        """Put a new post in its place, the oldest post may fall off"""
+        hot = HotPost(post)
+
+        def change(posts):
+            if len(posts) == self.size and _position(hot) < _position(posts[-1]):
+                # older than the buffer, only shown by pages from the database
+                return
+            if len(posts) == self.size:
+                self._complete = False
+            items = [item for item in posts if item.id != hot.id] + [hot]
+            items.sort(key=_position, reverse=True)
+            posts.clear()
+            posts.extend(items[:self.size])
+        return change
+
+    def replace(self, post):
+        """Put the edited copy of post in place of the old one"""
+        hot = HotPost(post)
+
+        def change(posts):
+            for index, item in enumerate(posts):
+                if item.id == hot.id:
+                    posts[index] = hot
+        return change
+
+    def remove(self, post_id):
+        """Drop a deleted post"""
+        def change(posts):
+            for item in posts:
+                if item.id == post_id:
+                    posts.remove(item)
+                    if not self._complete:
+                        # the next older post is not in the buffer, read it with the rest
+                        self._version = None
+                    break
+        return change
+
+    def reauthor(self, user):
+        """Put the changed author into the posts of user"""
+        author = HotAuthor(user)
+
+        def change(posts):
+            for index, item in enumerate(posts):
+                if item.user_id == author.id:
+                    posts[index] = HotPost(item, author)
+        return change
+
+
+def _read_version():
+    return db.session.query(ChangeCounter.value).filter(
+        ChangeCounter.name == COUNTER).scalar() or 0
+
+
+def bump_version(connection):
+    """
+    Count a change of the newest posts, in the caller's transaction
+    Args:
+        connection: connection of the transaction making the change
+    Returns: the new version
+    """
+    table = ChangeCounter.__table__
+    # the first change ever may be made by two transactions at once
+    add_to_counter(connection, table, 'value', 1, name=COUNTER)
+    # the row stays locked until the transaction ends, the value is ours
+    return connection.execute(select([table.c.value]).where(table.c.name == COUNTER)).scalar()
+
+
+def _bump(connection, target):
+    # the signal handler after the commit applies the change as this version
+    object_session(target).info[SESSION_VERSION_KEY] = bump_version(connection)
+
+
+@event.listens_for(Post, 'after_insert')
+def _on_post_insert(mapper, connection, target):
+    _bump(connection, target)
+
+
+@event.listens_for(Post, 'after_update')
+def _on_post_update(mapper, connection, target):
+    _bump(connection, target)
+
+
+@event.listens_for(Post, 'after_delete')
+def _on_post_delete(mapper, connection, target):
+    _bump(connection, target)
+
+
+@event.listens_for(User, 'after_update')
+def _on_user_update(mapper, connection, target):
+    # the email and the password are not shown by the listings
+    state = db.inspect(target)
+    for name in ('username', 'image_file'):
+        history = state.attrs[name].history
+        if history.added and history.added != history.deleted:
+            _bump(connection, target)
+            return
+
+
+def init_app(app):
+    """Create and load the hot feed, HOT_FEED_SIZE 0 disables it"""
+    app.add_template_global(recent_posts)
+    if not app.config['HOT_FEED_SIZE']:
+        return
+    feed = HotFeed(app.config['HOT_FEED_SIZE'], app.config['HOT_FEED_CHECK_SECONDS'])
+    app.extensions['hot_feed'] = feed
+    post_created.connect(_on_post_created, app)
+    post_updated.connect(_on_post_updated, app)
+    post_deleted.connect(_on_post_deleted, app)
+    user_updated.connect(_on_user_updated, app)
+    with app.app_context():
+        try:
+            feed.load()
+        except OperationalError:
+            # no tables yet (ie. before create_all), loaded by the first reader
+            db.session.rollback()
+
+
+def _feed():
+    return current_app.extensions.get('hot_feed')
+
+
+def hot_page(cursor=None, per_page=5):
+    """
+    Page of the home feed from the hot feed, same cursors as keyset_paginate
+    Returns: KeysetPage, or None when the page reaches past the hot feed
+    """
+    feed = _feed()
+    if feed is None:
+        return None
+    position = decode_cursor(cursor) if cursor else None
+    if position is None:
+        rows, complete = feed.newest(0, per_page + 1)
+        if not complete and len(rows) <= per_page:
+            return None
+        return keyset_page(rows, CURSOR_NEXT, None, per_page)
+    rows = feed.seek(position, per_page + 1)
+    if rows is None:
+        return None
+    return keyset_page(rows, position[0], position, per_page)
+
+
+def recent_posts(count=5):
+    """The newest count posts, from the hot feed when it holds them"""
+    feed = _feed()
+    if feed is not None:
+        rows, complete = feed.newest(0, count)
+        if complete or len(rows) == count:
+            return rows
+    return listing_query().limit(count).all()
+
+
+def feed_version():
+    """
+    Version of everything the listings show: the posts, their authors'
+    names and pictures. From the hot feed, which checks it every
+    HOT_FEED_CHECK_SECONDS, else read from the database.
+    """
+    feed = _feed()
+    version = feed.version if feed is not None else None
+    return _read_version() if version is None else version
+
+
+def _session_version():
+    # sent in the request or the job that committed the change, same session
+    return db.session.info.pop(SESSION_VERSION_KEY, None)
+
+
+def _on_post_created(app, post):
+    feed = app.extensions['hot_feed']
+    feed.apply(feed.add(post), _session_version())
+
+
+def _on_post_updated(app, post):
+    feed = app.extensions['hot_feed']
+    feed.apply(feed.replace(post), _session_version())
+
+
+def _on_post_deleted(app, post):
+    feed = app.extensions['hot_feed']
+    feed.apply(feed.remove(post.id), _session_version())
+
+
+def _on_user_updated(app, user):
+    feed = app.extensions['hot_feed']
+    feed.apply(feed.reauthor(user), _session_version())
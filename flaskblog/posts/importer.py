@@ -0,0 +1,273 @@
+"""
+Posts importer
+    iter_rows(path): stream the posts of a .json or .jsonl file
+    BadRow: a .jsonl line that is not json
+    validate_row(row, user_ids): a post row ready for insert, or an error
+    import_posts_command: flask import-posts
+"""
+import json
+import os
+import time
+from datetime import datetime
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from flaskblog import db, page_cache
+from flaskblog.models import ImportCheckpoint, Post, User
+from flaskblog.search.utils import search_index
+from flaskblog.archive.utils import add_month_counts
+from flaskblog.posts.utils import post_fields
+from flaskblog.posts.hotfeed import bump_version
+
+"""
+Imports:
+    json: decode one post at a time, the file is never loaded whole
+    os: path of the imported file, the key of its checkpoint
+    time: throughput
+    datetime: date_posted of the rows
+    click, flask.cli.with_appcontext: import-posts command
+    Flask:
+        current_app, logger
+    flaskblog:
+        db
+        page_cache, the listings showing the imported posts are invalidated
+    flaskblog.models: ImportCheckpoint, Post and User entity classes
+    flaskblog.search.utils: search_index, imported posts are indexed per batch
+    flaskblog.archive.utils: add_month_counts, the core inserts skip the
+        mapper events that count posts per month
+    flaskblog.posts.utils: post_fields, html, excerpt and word count of a row
+    flaskblog.posts.hotfeed: bump_version, the hot feeds reload the newest posts
+
+Accepted files:
+    .jsonl: one post object per line
+    .json: a list of posts, or an object with the list under "posts"
+           (the format of __temp__/posts.json)
+A post: {"title": ..., "content": ..., "user_id": ..., "date_posted": iso date (optional)}
+A .jsonl line that is not json is skipped and logged like an invalid post.
+In a .json list the next item can't be found after a malformed one, the
+import stops there, the batches before it stay imported.
+
+With --checkpoint the rows read so far are recorded in import_checkpoint,
+keyed by the file's path, in the transaction of each batch: after a crash
+the next run starts at the first batch that was not committed, no post
+is imported twice.
+
+Sqlite gives the posts their ids, so the site may take new posts while
+an import runs. The core inserts send no post_created signal, each batch
+invalidates the cached pages itself: the web workers see that when the
+page cache is shared (PAGE_CACHE_TYPE 'filesystem'), an 'lru' cache
+expires instead.
+"""
+
+CHUNK_SIZE = 1 << 16
+# a decode error this close to the end of the buffer may be an item cut by the chunk
+TRUNCATED_MARGIN = 16
+
+
+class BadRow:
+    """A row of the file that is not json, skipped like an invalid post"""
+    __slots__ = ('error',)
+
+    def __init__(self, error):
+        self.error = error
+
+
+def _truncated(error, buffer):
+    """True if error may come from an item that continues in the next chunk"""
+    # an unterminated string runs to the end of the buffer, wherever it started
+    return error.msg.startswith('Unterminated string') or \
+        len(buffer) - error.pos < TRUNCATED_MARGIN
+
+
+def _iter_json_array(json_file):
+    """
+    Yield the items of the first json list in json_file, one at a time
+    Raises: click.ClickException at the first malformed item
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    # characters of the file before the buffer
+    offset = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, eof
+        chunk = json_file.read(CHUNK_SIZE)
+        if not chunk:
+            eof = True
+        buffer += chunk
+
+    # find the start of the list: the file itself or the "posts" value
+    while '[' not in buffer and not eof:
+        fill()
+    if '[' not in buffer:
+        return
+    start = buffer.index('[') + 1
+    buffer, offset = buffer[start:], offset + start
+    while True:
+        # skip whitespace and the separating comma
+        stripped = buffer.lstrip().lstrip(',').lstrip()
+        buffer, offset = stripped, offset + len(buffer) - len(stripped)
+        if not buffer:
+            if eof:
+                return
+            fill()
+            continue
+        if buffer[0] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError as error:
+            if eof or not _truncated(error, buffer):
+                # the rest of the list can't be told apart, stop here
+                raise click.ClickException(
+                    f'malformed json at character {offset + error.pos}: {error.msg}')
+            # the item continues in the next chunk
+            fill()
+            continue
+        buffer, offset = buffer[end:], offset + end
+        yield item
+
+
+def iter_rows(path):
+    """
+    Yield the post dicts of path, .jsonl line by line, .json streamed.
+    A .jsonl line that is not json is yielded as a BadRow.
+    """
+    with open(path, encoding='utf-8') as json_file:
+        if path.endswith('.jsonl'):
+            for line in json_file:
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError as error:
+                        yield BadRow(f'malformed json at column {error.colno}: {error.msg}')
+        else:
+            yield from _iter_json_array(json_file)
+
+
+def validate_row(row, user_ids):
+    """
+    Check a post read from the file
+    Returns: (row for Post.__table__ without id, None) or (None, error message)
+    """
+    if isinstance(row, BadRow):
+        return None, row.error
+    if not isinstance(row, dict):
+        return None, 'not an object'
+    title, content, user_id = row.get('title'), row.get('content'), row.get('user_id')
+    if not isinstance(title, str) or not title.strip() or len(title) > 100:
+        return None, 'title missing or longer than 100 characters'
+    if not isinstance(content, str) or not content.strip():
+        return None, 'content missing'
+    if user_id not in user_ids:
+        return None, f'unknown user_id {user_id!r}'
+    date_posted = row.get('date_posted')
+    if date_posted is None:
+        date_posted = datetime.utcnow()
+    else:
+        try:
+            date_posted = datetime.fromisoformat(date_posted)
+        except (TypeError, ValueError):
+            return None, f'invalid date_posted {date_posted!r}'
+    return dict(post_fields(content), title=title, content=content, user_id=user_id,
+                date_posted=date_posted, date_modified=date_posted), None
+
+
+def _load_checkpoint(source):
+    checkpoint = ImportCheckpoint.query.get(source)
+    return checkpoint.rows_done if checkpoint else 0
+
+
+def _save_checkpoint(source, rows_done):
+    """Record rows_done in the current transaction, the caller commits"""
+    db.session.merge(ImportCheckpoint(source=source, rows_done=rows_done))
+
+
+def _insert_batch(batch, index_search, checkpoint=None):
+    """
+    Insert batch in one transaction, sqlite assigns the ids
+    Args:
+        checkpoint: (source, rows_done) recorded in the same transaction, or None
+    """
+    # core executemany, no ORM objects, no identity map
+    db.session.execute(Post.__table__.insert(), batch)
+    # the first insert took the write lock, no other process inserts until
+    # the commit, so the batch got the ids up to the last one in a row
+    first_id = db.session.execute('SELECT last_insert_rowid()').scalar() - len(batch) + 1
+    for offset, row in enumerate(batch):
+        row['id'] = first_id + offset
+    add_month_counts(db.session.connection(), batch)
+    bump_version(db.session.connection())
+    if index_search:
+        search_index().add_many(batch)
+    if checkpoint:
+        # a batch is imported and counted as done, or neither
+        _save_checkpoint(*checkpoint)
+    db.session.commit()
+    # what the post_created signal does for a post saved by a route
+    page_cache.invalidate('feed', 'sidebar', *{f'posts_by:{row["user_id"]}' for row in batch})
+
+
+@click.command('import-posts')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=5000, show_default=True,
+              help='Posts per insert statement and transaction.')
+@click.option('--checkpoint', is_flag=True,
+              help='Record progress in the database and resume an earlier run of PATH.')
+@click.option('--drop-indexes', is_flag=True,
+              help='Drop the secondary post indexes while loading, recreate them after.')
+@click.option('--search-index/--no-search-index', 'index_search', default=True,
+              show_default=True,
+              help='Index the posts for search while loading.')
+@with_appcontext
+def import_posts_command(path, batch_size, checkpoint, drop_indexes, index_search):
+    """Bulk import posts from a .json or .jsonl file."""
+    source = os.path.abspath(path)
+    rows_done = _load_checkpoint(source) if checkpoint else 0
+    user_ids = {user_id for user_id, in db.session.query(User.id)}
+
+    secondary = list(Post.__table__.indexes)
+    if drop_indexes:
+        for index in secondary:
+            index.drop(bind=db.engine)
+        click.echo(f'dropped {len(secondary)} indexes')
+
+    started = time.perf_counter()
+    imported = skipped = read = 0
+    batch = []
+    try:
+        for read, row in enumerate(iter_rows(path), start=1):
+            if read <= rows_done:
+                # done in an earlier run
+                continue
+            post_row, error = validate_row(row, user_ids)
+            if error:
+                skipped += 1
+                current_app.logger.warning('row %s skipped: %s', read, error)
+                continue
+            batch.append(post_row)
+            if len(batch) >= batch_size:
+                _insert_batch(batch, index_search, (source, read) if checkpoint else None)
+                imported += len(batch)
+                batch = []
+                seconds = time.perf_counter() - started
+                click.echo(f'{imported} posts imported, {skipped} skipped, '
+                           f'{imported / seconds:.0f} posts/s')
+        if batch:
+            _insert_batch(batch, index_search,
+                          (source, max(read, rows_done)) if checkpoint else None)
+            imported += len(batch)
+        elif checkpoint:
+            # the rows after the last full batch were all skipped
+            _save_checkpoint(source, max(read, rows_done))
+            db.session.commit()
+    finally:
+        if drop_indexes:
+            for index in secondary:
+                index.create(bind=db.engine)
+            click.echo(f'recreated {len(secondary)} indexes')
+
+    seconds = time.perf_counter() - started
+    click.echo(f'done: {imported} posts imported, {skipped} skipped in {seconds:.1f}s '
+               f'({imported / seconds if seconds else 0:.0f} posts/s)')
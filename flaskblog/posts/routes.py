@@ -7,11 +7,17 @@ Posts.routes
 """
 
 from flask import (render_template, url_for, flash,
-                   redirect, request, abort, Blueprint)
+                   redirect, request, abort, Blueprint, current_app)
 from flask_login import current_user, login_required
-from flaskblog import db
+from sqlalchemy.orm import joinedload
+from flaskblog import db, page_cache
+from flaskblog.cache import post_tags, post_validators, render_conditional
 from flaskblog.models import Post
 from flaskblog.posts.forms import PostForm
+from flaskblog.posts.utils import render_post
+from flaskblog.posts.hotfeed import feed_version
+from flaskblog.replicas import replica_reads
+from flaskblog.signals import post_created, post_updated, post_deleted
 
 """
 Imports:
@@ -23,15 +29,29 @@ Imports:
         redirect to redirect between forms and pages
         request to GET http arguments
         abort to handle abortion of code execution, used in update_post()
+        current_app, sender of the signals
     flask_login:
         current_user: register and login to vheck for a logged in user
         login_required decorator to routes that needs user is logged in
+    sqlalchemy.orm:
+        joinedload to fetch the author together with the post
     flaskblog:
         db
+        page_cache to cache the rendered page for anonymous readers
+        post_tags, cache invalidation tags of the post
+        post_validators, render_conditional for conditional GET (304)
     flaskblog.models:
         Post entity class
     flaskblog.posts.forms:
         user-defined forms: posts forms
+    flaskblog.posts.utils:
+        render_post, html, excerpt and word count stored with the post
+    flaskblog.posts.hotfeed:
+        feed_version, the sidebar's part of the validators
+    flaskblog.replicas:
+        replica_reads, the post page may be read from a replica
+    flaskblog.signals:
+        post_created, post_updated, post_deleted sent after commit
 """
 
 # Instantiate posts blueprint
@@ -46,9 +66,11 @@ def new_post():
     form = PostForm()
     if form.validate_on_submit():
         post_new = Post(title=form.title.data, content=form.content.data, author=current_user)
+        render_post(post_new)
         # set the author by using the backref author in stead of user_id
         db.session.add(post_new)
         db.session.commit()
+        post_created.send(current_app._get_current_object(), post=post_new)
         flash('Your post has been created.', 'success')
         return redirect(url_for('main.home'))
     return render_template('create_post.html', title="New Post",
@@ -56,10 +78,17 @@ def new_post():
 
 
 @posts.route("/post/<int:post_id>")
+@replica_reads
+@page_cache.cached()
 def post(post_id):
     """Show a post"""
-    post_cur = Post.query.get_or_404(post_id)
-    return render_template('post.html', title=post_cur.title, post=post_cur)
+    # before the post is read, an edit saved meanwhile invalidates the page;
+    # the sidebar shows the newest posts and the archive counts
+    page_cache.tag('sidebar', f'post:{post_id}')
+    post_cur = Post.query.options(joinedload(Post.author)).get_or_404(post_id)
+    page_cache.tag(*post_tags([post_cur]))
+    return render_conditional(post_validators([post_cur], feed_version()), 'post.html',
+                              title=post_cur.title, post=post_cur)
 
 
 @posts.route("/post/<int:post_id>/update", methods=['GET', 'POST'])
@@ -75,8 +104,10 @@ def update_post(post_id):
     if form.validate_on_submit():
         post_upd.title = form.title.data
         post_upd.content = form.content.data
+        render_post(post_upd)
         db.session.add(post_upd)
         db.session.commit()
+        post_updated.send(current_app._get_current_object(), post=post_upd)
         flash('Post updated.', 'success')
         return redirect(url_for('posts.post', post_id=post_upd.id))
     elif request.method == 'GET':
@@ -96,5 +127,6 @@ def delete_post(post_id):
         abort(403)
     db.session.delete(post_del)
     db.session.commit()
+    post_deleted.send(current_app._get_current_object(), post=post_del)
     flash('Post deleted!', 'success')
     return redirect(url_for('main.home'))
@@ -0,0 +1,285 @@
+"""
+Posts utils
+    listing_query(author=None, bodies=False)
+    render_content(content), post_fields(content), render_post(post):
+        content_html, excerpt and word_count of a post
+    format_date(value), format_month(value): post_date and month template filters
+    render_posts_command: flask render-posts
+    KeysetPage(items, next_cursor, prev_cursor)
+    keyset_paginate(query, cursor, per_page)
+    keyset_page(rows, direction, position, per_page): page of rows read by a seek
+    encode_cursor(direction, post), decode_cursor(cursor)
+    pagination_state(posts)
+"""
+
+import base64
+import binascii
+import re
+from datetime import datetime
+from functools import lru_cache
+import click
+from flask.cli import with_appcontext
+from markupsafe import Markup
+from sqlalchemy import and_, bindparam, or_
+from sqlalchemy.orm import defer, joinedload
+from flaskblog import db, page_cache
+from flaskblog.models import Post
+
+"""
+Imports:
+    base64, binascii: encode and decode the opaque cursor tokens
+    re: paragraphs of a post
+    datetime: parse the date_posted part of a cursor
+    functools.lru_cache: formatted dates, a page shows few distinct days
+    click, flask.cli.with_appcontext: render-posts command
+    markupsafe: Markup, content_html is escaped text in html markup
+    sqlalchemy:
+        and_, or_ to build the keyset seek condition
+        bindparam, one executemany UPDATE per batch in render-posts
+    sqlalchemy.orm:
+        joinedload to fetch the post author in the same SELECT as the post
+        defer, the listings don't load the post bodies
+    flaskblog:
+        db
+        page_cache, the pages of the posts render-posts changed
+    flaskblog.models:
+        Post entity class
+
+The listings show the stored excerpt of each post, not its body, so a
+long post costs a listing page no more than a short one. content_html,
+excerpt and word_count are computed when a post is saved, never while a
+page renders.
+"""
+
+# cursor directions: 'n' pages to older posts, 'p' back to newer posts
+CURSOR_NEXT = 'n'
+CURSOR_PREV = 'p'
+# ids of cursors are below this, the range of a (sqlite) 64 bit INTEGER
+MAX_POST_ID = 2 ** 63
+# characters of the excerpt, cut at a word and ended with ELLIPSIS
+EXCERPT_LENGTH = 240
+ELLIPSIS = '\u2026'
+PARAGRAPH_RE = re.compile(r'\n\s*\n')
+
+
+def listing_query(author=None, bodies=False):
+    """
+    Base query for every paginated post listing, newest post first.
+    The author is joined into the same SELECT, so templates reading
+    post.author.* do not fire one extra query per post on the page.
+    Args:
+        author: optional User to only list posts by that user
+        bodies: load content and content_html, the listings only show the excerpt
+    """
+    query = Post.query.options(joinedload(Post.author))
+    if not bodies:
+        query = query.options(defer(Post.content), defer(Post.content_html))
+    if author is not None:
+        query = query.filter(Post.user_id == author.id)
+    # id breaks ties between posts with the same date_posted
+    return query.order_by(Post.date_posted.desc(), Post.id.desc())
+
+
+class KeysetPage:
+    """
+    One page of a keyset (cursor) paginated listing.
+    Has no total and no page numbers, only opaque next/prev cursors.
+        items, next_cursor, prev_cursor, has_next, has_prev
+    """
+    # lets templates tell a KeysetPage from a flask_sqlalchemy Pagination
+    keyset = True
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        """True if there are older posts"""
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        """True if there are newer posts"""
+        return self.prev_cursor is not None
+
+
+def encode_cursor(direction, post):
+    """Opaque, url safe token pointing at post, (date_posted, id)"""
+    raw = f'{direction}|{post.date_posted.isoformat()}|{post.id}'
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a token made by encode_cursor
+    Returns: (direction, date_posted, id) or None if the token is malformed
+    """
+    try:
+        # restore the stripped base64 padding
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        direction, date_posted, post_id = raw.split('|')
+        post_id = int(post_id)
+        # a larger id would overflow the INTEGER parameter of the seek query
+        if direction not in (CURSOR_NEXT, CURSOR_PREV) or not 0 < post_id < MAX_POST_ID:
+            return None
+        return direction, datetime.fromisoformat(date_posted), post_id
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def keyset_paginate(query, cursor=None, per_page=5):
+    """
+    Seek to the page after/before cursor on (date_posted, id) instead of
+    using OFFSET, so deep pages cost the same as the first page and no
+    COUNT(*) is run. A missing or malformed cursor gives the first page.
+    Args:
+        query: a listing_query()
+        cursor: token from a previous KeysetPage, or None
+        per_page: posts per page
+    """
+    position = decode_cursor(cursor) if cursor else None
+    # drop the listing order, the seek direction decides it
+    query = query.order_by(None)
+    if position is None:
+        direction = CURSOR_NEXT
+        rows = query.order_by(Post.date_posted.desc(), Post.id.desc())\
+            .limit(per_page + 1).all()
+    else:
+        direction, date_posted, post_id = position
+        if direction == CURSOR_NEXT:
+            # older than the cursor: date <= d, and id < i when dates are equal
+            seek = and_(Post.date_posted <= date_posted,
+                        or_(Post.date_posted < date_posted, Post.id < post_id))
+            order = (Post.date_posted.desc(), Post.id.desc())
+        else:
+            # newer than the cursor, read upwards and reverse afterwards
+            seek = and_(Post.date_posted >= date_posted,
+                        or_(Post.date_posted > date_posted, Post.id > post_id))
+            order = (Post.date_posted.asc(), Post.id.asc())
+        rows = query.filter(seek).order_by(*order).limit(per_page + 1).all()
+    return keyset_page(rows, direction, position, per_page)
+
+
+def keyset_page(rows, direction, position, per_page):
+    """
+    KeysetPage of up to per_page + 1 rows read in the seek direction
+    Args:
+        rows: posts in seek order, newest first for CURSOR_NEXT
+        direction: CURSOR_NEXT or CURSOR_PREV
+        position: the decoded cursor, None for the first page
+        per_page: posts per page
+    """
+    # the extra row only tells us if there is more in the seek direction
+    more = len(rows) > per_page
+    items = rows[:per_page]
+    if direction == CURSOR_PREV:
+        items.reverse()
+
+    if not items:
+        return KeysetPage(items)
+    if direction == CURSOR_NEXT:
+        has_older, has_newer = more, position is not None
+    else:
+        has_older, has_newer = True, more
+    return KeysetPage(
+        items,
+        next_cursor=encode_cursor(CURSOR_NEXT, items[-1]) if has_older else None,
+        prev_cursor=encode_cursor(CURSOR_PREV, items[0]) if has_newer else None)
+
+
+def pagination_state(posts):
+    """What the pagination links of a KeysetPage or Pagination depend on"""
+    if getattr(posts, 'keyset', False):
+        return posts.next_cursor, posts.prev_cursor
+    return posts.page, posts.pages
+
+
+def render_content(content):
+    """
+    Html of a post body: escaped text, blank lines separate paragraphs,
+    line breaks are kept. The one place to plug in a markdown renderer.
+    """
+    paragraphs = PARAGRAPH_RE.split(content.replace('\r\n', '\n').strip())
+    return str(Markup('\n').join(
+        Markup('<p>{}</p>').format(Markup('<br>\n').join(paragraph.split('\n')))
+        for paragraph in paragraphs if paragraph.strip()))
+
+
+def post_fields(content):
+    """The columns derived from content: content_html, excerpt and word_count"""
+    words = content.split()
+    text = ' '.join(words)
+    if len(text) > EXCERPT_LENGTH:
+        text = text[:EXCERPT_LENGTH].rsplit(' ', 1)[0] + ELLIPSIS
+    return {'content_html': render_content(content), 'excerpt': text,
+            'word_count': len(words)}
+
+
+def render_post(post):
+    """Set the derived columns of post from its content, before it is saved"""
+    for key, value in post_fields(post.content).items():
+        setattr(post, key, value)
+
+
+@lru_cache(maxsize=1024)
+def _format_day(day):
+    return f'{day:%A}, {day.day}. {day:%B} {day.year}'
+
+
+def format_date(value):
+    """post_date filter: Monday, 3. December 2018"""
+    return _format_day(value.date())
+
+
+@lru_cache(maxsize=1024)
+def _format_month(year, month):
+    return f'{datetime(year, month, 1):%B} {year}'
+
+
+def format_month(value):
+    """month filter: December 2018"""
+    return _format_month(value.year, value.month)
+
+
+@click.command('render-posts')
+@click.option('--all', 'render_all', is_flag=True,
+              help='Render every post, ie. after the renderer changed. '
+                   'Default: only posts never rendered.')
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Posts per transaction.')
+@with_appcontext
+def render_posts_command(render_all, batch_size):
+    """Compute content_html, excerpt and word_count of the stored posts."""
+    # imported here, posts.hotfeed builds on this module
+    from flaskblog.posts.hotfeed import bump_version
+    table = Post.__table__
+    # the SET columns come from the keys of each row; rendering is no edit,
+    # date_modified set to itself keeps its onupdate from firing
+    update = table.update().where(table.c.id == bindparam('post_id')).values(
+        date_modified=table.c.date_modified)
+    last_id = 0
+    done = 0
+    while True:
+        # seek on the id, each batch is its own transaction
+        query = db.session.query(Post.id, Post.content).filter(Post.id > last_id)
+        if not render_all:
+            query = query.filter(Post.content_html.is_(None))
+        rows = query.order_by(Post.id).limit(batch_size).all()
+        if not rows:
+            break
+        db.session.execute(update, [dict(post_fields(content), post_id=post_id)
+                                    for post_id, content in rows])
+        # the excerpts of the hot feeds changed
+        bump_version(db.session.connection())
+        db.session.commit()
+        if not render_all:
+            page_cache.invalidate(*(f'post:{post_id}' for post_id, _ in rows))
+        last_id = rows[-1][0]
+        done += len(rows)
+        click.echo(f'{done} posts rendered')
+    if render_all and done:
+        # every page with a post changed, once after the last batch committed
+        page_cache.clear()
+    click.echo(f'done, {done} posts rendered')
@@ -0,0 +1,306 @@
+"""
+Rate limiting
+    MemoryStore, SqliteStore, NullStore: token bucket and failure storage
+    init_app(app): rate limit store of the app
+    RateLimited: 429 error, carries the Retry-After seconds
+    rate_limit: view decorator, the RATE_LIMITS of the endpoint
+    take_token(name, key, limit): seconds to wait, 0 when a token was taken
+    login_lockout(email): seconds the account stays locked, 0 when it is not
+    login_failed(email), login_succeeded(email): record a login attempt
+"""
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, request
+from werkzeug.exceptions import TooManyRequests
+
+"""
+Imports:
+    os, sqlite3, tempfile: SqliteStore, shared by the worker processes of a host
+    threading: locks of the MemoryStore, connections per thread of the SqliteStore
+    time: bucket refill and failure windows, unix time so processes agree
+    collections.deque: recent failures of a key
+    contextlib.contextmanager: SqliteStore transactions
+    functools.wraps: rate_limit decorator
+    Flask:
+        current_app, config and extensions
+        request, endpoint, client address and the submitted email
+    werkzeug.exceptions: TooManyRequests, base of RateLimited
+
+Config:
+    RATE_LIMIT_STORE: 'memory' (per process), 'sqlite' (shared by the
+        processes of one host) or 'null' (no limits)
+    RATE_LIMIT_PATH: database file of the sqlite store
+    RATE_LIMITS: endpoint -> {'ip' or 'account': (requests, per seconds)},
+        applied to the POSTs of the endpoint
+    LOGIN_LOCKOUT_FAILURES, LOGIN_LOCKOUT_WINDOW: that many failed logins of
+        an account within the window lock it until the oldest one leaves it
+    RESET_EMAIL_LIMIT: (mails, per seconds) per address
+
+A limit (requests, per) is a token bucket holding up to `requests` tokens,
+refilled at requests/per tokens a second: bursts up to the limit pass,
+then one request per refill. The 'ip' scope keys on request.remote_addr,
+so a reverse proxy needs ProxyFix in front of the app. The 'account' scope
+keys on the submitted email, it slows down an attack spread over many
+addresses.
+
+A store implements take(key, rate, burst), failures(key, window),
+add_failure(key, window, keep) and clear_failures(key). A store for
+several hosts (ie. redis) implements the same four methods.
+"""
+
+
+class NullStore:
+    """Store without limits"""
+
+    def take(self, key, rate, burst):
+        """Always allowed"""
+        return 0.0
+
+    def failures(self, key, window):
+        """No failures"""
+        return []
+
+    def add_failure(self, key, window, keep):
+        """Forget the failure"""
+
+    def clear_failures(self, key):
+        """Nothing to clear"""
+
+
+class MemoryStore:
+    """
+    In-process store. Keys are spread over stripes with a lock each, so
+    requests for different clients rarely wait for each other.
+    Each worker process has its own buckets.
+    """
+
+    def __init__(self, stripes=64, threshold=100000):
+        # stripe: (lock, {key: (tokens, updated, full_at)}, {key: (deque, expires)})
+        self._stripes = [(threading.Lock(), {}, {}) for _ in range(stripes)]
+        self._threshold = max(1, threshold // stripes)
+
+    def _stripe(self, key):
+        return self._stripes[hash(key) % len(self._stripes)]
+
+    def take(self, key, rate, burst):
+        """Take a token from the bucket of key, seconds to wait when it is empty"""
+        now = time.time()
+        lock, buckets, _ = self._stripe(key)
+        with lock:
+            tokens, updated, _ = buckets.get(key, (burst, now, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            buckets[key] = (tokens, now, now + (burst - tokens) / rate)
+            if len(buckets) > self._threshold:
+                # a full bucket is the same as no bucket
+                for stale in [stale for stale, entry in buckets.items() if entry[2] <= now]:
+                    del buckets[stale]
+        return wait
+
+    def failures(self, key, window):
+        """Times of the failures of key within the last window seconds, oldest first"""
+        since = time.time() - window
+        lock, _, failures = self._stripe(key)
+        with lock:
+            entry = failures.get(key)
+            return [at for at in entry[0] if at > since] if entry else []
+
+    def add_failure(self, key, window, keep):
+        """Record a failure of key, the last keep failures are kept for window seconds"""
+        now = time.time()
+        lock, _, failures = self._stripe(key)
+        with lock:
+            entry = failures.get(key)
+            times = entry[0] if entry and entry[0].maxlen == keep else deque(maxlen=keep)
+            times.append(now)
+            failures[key] = (times, now + window)
+            if len(failures) > self._threshold:
+                for stale in [stale for stale, entry in failures.items() if entry[1] <= now]:
+                    del failures[stale]
+
+    def clear_failures(self, key):
+        """Forget the failures of key"""
+        lock, _, failures = self._stripe(key)
+        with lock:
+            failures.pop(key, None)
+
+
+class SqliteStore:
+    """
+    Store in a sqlite file, shared by the worker processes of one host.
+    Every take is a short write transaction, BEGIN IMMEDIATE serializes them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        # operations between two deletes of expired rows
+        self._prune_every = 1000
+        self._operations = 0
+        with self._transaction() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS bucket '
+                         '(key TEXT PRIMARY KEY, tokens REAL, updated REAL, full_at REAL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS failure (key TEXT, at REAL, expires REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_failure_key_at ON failure (key, at)')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = OFF')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _prune(self, conn, now):
+        self._operations += 1
+        if self._operations % self._prune_every == 0:
+            conn.execute('DELETE FROM bucket WHERE full_at <= ?', (now,))
+            conn.execute('DELETE FROM failure WHERE expires <= ?', (now,))
+
+    def take(self, key, rate, burst):
+        """Take a token from the bucket of key, seconds to wait when it is empty"""
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute('SELECT tokens, updated FROM bucket WHERE key = ?',
+                               (key,)).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            conn.execute('INSERT OR REPLACE INTO bucket VALUES (?, ?, ?, ?)',
+                         (key, tokens, now, now + (burst - tokens) / rate))
+            self._prune(conn, now)
+        return wait
+
+    def failures(self, key, window):
+        """Times of the failures of key within the last window seconds, oldest first"""
+        rows = self._connection().execute(
+            'SELECT at FROM failure WHERE key = ? AND at > ? ORDER BY at',
+            (key, time.time() - window))
+        return [at for at, in rows]
+
+    def add_failure(self, key, window, keep):
+        """Record a failure of key, the last keep failures are kept for window seconds"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute('INSERT INTO failure VALUES (?, ?, ?)', (key, now, now + window))
+            conn.execute('DELETE FROM failure WHERE key = ? AND at NOT IN '
+                         '(SELECT at FROM failure WHERE key = ? ORDER BY at DESC LIMIT ?)',
+                         (key, key, keep))
+            self._prune(conn, now)
+
+    def clear_failures(self, key):
+        """Forget the failures of key"""
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM failure WHERE key = ?', (key,))
+
+
+class RateLimited(TooManyRequests):
+    """429 with the seconds until the client may try again"""
+
+    def __init__(self, retry_after, description=None):
+        super().__init__(description)
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+def init_app(app):
+    """Create the store of RATE_LIMIT_STORE"""
+    store_type = app.config['RATE_LIMIT_STORE']
+    if store_type == 'memory':
+        store = MemoryStore()
+    elif store_type == 'sqlite':
+        store = SqliteStore(app.config['RATE_LIMIT_PATH'] or
+                            os.path.join(tempfile.gettempdir(), 'flaskblog-rate-limits.db'))
+    elif store_type == 'null':
+        store = NullStore()
+    else:
+        raise ValueError(f'Unknown RATE_LIMIT_STORE {store_type!r}')
+    app.extensions['rate_limit'] = store
+
+
+def _store():
+    return current_app.extensions['rate_limit']
+
+
+def _email_key(email):
+    return (email or '').strip().lower()
+
+
+def take_token(name, key, limit):
+    """
+    Take a token from the bucket name:key
+    Args:
+        name: what is limited, ie. the endpoint
+        key: who is limited, ie. the client address
+        limit: (requests, per seconds)
+    Returns: 0 when allowed, else the seconds until a token is available
+    """
+    requests, per = limit
+    return _store().take(f'{name}:{key}', requests / per, requests)
+
+
+def rate_limit(view):
+    """Apply the RATE_LIMITS of the endpoint to its POSTs, 429 when exceeded"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        limits = current_app.config['RATE_LIMITS'].get(request.endpoint)
+        if limits and request.method == 'POST':
+            scopes = {'ip': request.remote_addr, 'account': _email_key(request.form.get('email'))}
+            for scope, limit in limits.items():
+                if not scopes[scope]:
+                    continue
+                wait = take_token(f'{request.endpoint}:{scope}', scopes[scope], limit)
+                if wait:
+                    current_app.logger.info('rate limited %s %s %s', request.endpoint,
+                                            scope, scopes[scope])
+                    raise RateLimited(wait)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def login_lockout(email):
+    """Seconds the account of email stays locked after failed logins, 0 when it is not"""
+    failures, window = (current_app.config['LOGIN_LOCKOUT_FAILURES'],
+                        current_app.config['LOGIN_LOCKOUT_WINDOW'])
+    times = _store().failures(f'login:{_email_key(email)}', window)
+    if len(times) < failures:
+        return 0
+    # unlocked when the oldest of the last `failures` leaves the window
+    return max(0.0, times[-failures] + window - time.time())
+
+
+def login_failed(email):
+    """Record a failed login of the account of email"""
+    _store().add_failure(f'login:{_email_key(email)}',
+                         current_app.config['LOGIN_LOCKOUT_WINDOW'],
+                         current_app.config['LOGIN_LOCKOUT_FAILURES'])
+
+
+def login_succeeded(email):
+    """Forget the failed logins of the account of email"""
+    _store().clear_failures(f'login:{_email_key(email)}')
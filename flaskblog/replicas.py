@@ -0,0 +1,132 @@
+"""
+Read replicas
+    RoutingSQLAlchemy: flask_sqlalchemy extension with the RoutingSession
+    RoutingSession: sends the reads of replica_reads views to a replica
+    init_app(app): replica binds of the app, primary stickiness after writes
+    replica_reads: view decorator, the view's reads may go to a replica
+    use_replica(): context manager, the same for a block of code
+"""
+import random
+import time
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, g, has_request_context, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import event, orm
+from sqlalchemy.sql import Select
+
+"""
+Imports:
+    random: pick a replica per request
+    time: end of the primary window
+    contextlib.contextmanager: use_replica()
+    functools.wraps: replica_reads decorator
+    Flask:
+        current_app, config and extensions
+        g, the replica of the current request
+        has_request_context, session: the primary window travels in the
+            session cookie, so it holds in every worker process
+    flask_sqlalchemy:
+        SQLAlchemy, SignallingSession, get_state: the session class is
+        replaced through create_session
+    sqlalchemy: event, orm, Select: bind routing and write tracking
+
+Config:
+    SQLALCHEMY_REPLICA_URIS: database uris of the replicas, none disables routing
+    DB_PRIMARY_STICKY_SECONDS: after a request that wrote, the same client
+        reads from the primary for this long, so the page it is redirected
+        to shows its change even when the replicas lag behind
+
+Replicas become the binds replica_0, replica_1, ... Only SELECTs run
+outside a flush, with nothing pending in the session, go to a replica.
+Everything else, and every view without replica_reads, uses the primary.
+"""
+
+# session key holding the end of the primary window, a unix time
+PRIMARY_UNTIL_KEY = '_db_primary_until'
+
+
+class RoutingSession(SignallingSession):
+    """SignallingSession sending plain reads to the replica of the request"""
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = g.get('db_replica') if has_request_context() else None
+        if replica is not None and not self._flushing \
+                and (clause is None or isinstance(clause, Select)) \
+                and not (self.new or self.dirty or self.deleted):
+            # models with a __bind_key__ of their own stay on it
+            table = getattr(mapper, 'persist_selectable', None)
+            if table is None:
+                # SA < 1.3
+                table = getattr(mapper, 'mapped_table', None)
+            if 'bind_key' not in getattr(table, 'info', {}):
+                return get_state(self.app).db.get_engine(self.app, bind=replica)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy extension creating RoutingSessions"""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def init_app(app):
+    """Add the replicas as binds, call before the engines are created"""
+    uris = app.config.get('SQLALCHEMY_REPLICA_URIS') or []
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    keys = []
+    for number, uri in enumerate(uris):
+        keys.append(f'replica_{number}')
+        binds[keys[-1]] = uri
+    app.config['SQLALCHEMY_BINDS'] = binds or None
+    app.extensions['db_replicas'] = keys
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _on_flush(db_session, flush_context):
+    db_session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _on_commit(db_session):
+    if db_session.info.pop('wrote', False) and has_request_context():
+        # this client reads its own writes from the primary for a while
+        session[PRIMARY_UNTIL_KEY] = \
+            time.time() + current_app.config['DB_PRIMARY_STICKY_SECONDS']
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _on_rollback(db_session):
+    db_session.info.pop('wrote', None)
+
+
+def _pick_replica():
+    """Bind key of the replica of this request, or None to stay on the primary"""
+    if 'db_replica_pick' not in g:
+        replicas = current_app.extensions.get('db_replicas')
+        if not replicas or session.get(PRIMARY_UNTIL_KEY, 0) > time.time():
+            g.db_replica_pick = None
+        else:
+            g.db_replica_pick = random.choice(replicas)
+    return g.db_replica_pick
+
+
+def replica_reads(view):
+    """The reads of view may go to a replica, unless this client wrote recently"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with use_replica():
+            return view(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def use_replica():
+    """Reads inside the block may go to a replica, one per request"""
+    previous = g.get('db_replica')
+    g.db_replica = previous or _pick_replica()
+    try:
+        yield
+    finally:
+        g.db_replica = previous
@@ -0,0 +1,53 @@
+"""
+Search.routes
+    search(): /search
+"""
+
+from flask import render_template, request, Blueprint, abort
+from flask_sqlalchemy import Pagination
+from sqlalchemy.orm import joinedload
+from flaskblog.models import Post
+from flaskblog.search.utils import search_index
+
+"""
+Imports:
+    Flask
+        Blueprints to modularize the webapp
+        render_template to render the html form (ie. search.html)
+        request to GET http arguments
+        abort, 404 past the last page
+    flask_sqlalchemy:
+        Pagination, page links for the results
+    sqlalchemy.orm:
+        joinedload to fetch the authors of the hits in the same query
+    flaskblog.models:
+        Post entity class
+    flaskblog.search.utils:
+        search_index, fts5 or python index of the app
+"""
+
+# Instantiate search blueprint
+search = Blueprint('search', __name__)
+
+# Create routes specifically to the search module and register in #
+
+
+@search.route("/search")
+def search_posts():
+    """Search posts, best match first"""
+    q = request.args.get('q', '').strip()
+    # set the page from GET, default 1, must be int else page throws valueerror!
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = 5
+    total, hits = search_index().search(q, page=page, per_page=per_page)
+    # like the listings, a page past the last one is a 404
+    if page > 1 and not hits:
+        abort(404)
+    # load the hit posts and their authors in one query, keep the ranking
+    by_id = {}
+    if hits:
+        by_id = {post.id: post for post in Post.query.options(joinedload(Post.author))
+                 .filter(Post.id.in_([post_id for post_id, _ in hits]))}
+    results = [(by_id[post_id], snippet) for post_id, snippet in hits if post_id in by_id]
+    posts = Pagination(None, page, per_page, total, results)
+    return render_template('search.html', title='Search', q=q, posts=posts)
@@ -0,0 +1,345 @@
+"""
+Search utils
+    init_app(app): pick the index for the app and keep it current
+    search_index(): index of the current app
+    FTS5Index: sqlite fts5 virtual table, ranked by its bm25()
+    MemoryIndex: inverted index in python, bm25 ranking, any database
+    query_terms(q): words of a search query
+    rebuild_search_index_command: flask rebuild-search-index
+"""
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter, defaultdict
+import click
+from flask import current_app, has_app_context
+from flask.cli import with_appcontext
+from markupsafe import Markup, escape
+from sqlalchemy import event
+from flaskblog import db
+from flaskblog.models import Post
+from flaskblog.signals import post_created, post_updated, post_deleted
+
+"""
+Imports:
+    math, collections: bm25 scoring of the MemoryIndex
+    re: tokenizer
+    sqlite3: check the sqlite library has fts5
+    threading: lock of the MemoryIndex
+    click, flask.cli.with_appcontext: rebuild-search-index command
+    Flask:
+        current_app, config and extensions
+        has_app_context, a flush outside of an app has no index to keep
+    markupsafe: Markup, escape, highlighted snippets are safe html
+    sqlalchemy: event, mapper events write the fts5 index in the post's transaction
+    flaskblog: db
+    flaskblog.models: Post entity class
+    flaskblog.signals: post_created, post_updated, post_deleted, keep the
+        MemoryIndex current one post at a time instead of rebuilding it
+
+Both indexes search for posts containing every word of the query and
+return (total, [(post_id, snippet), ...]) for a page of results.
+
+The fts5 table is in the app database: the mapper events below write it
+in the flush that saves the post, so it commits or rolls back with the
+post and never commits anything of the caller. The MemoryIndex follows
+the signals sent after the commit, it only changes this process.
+"""
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+# title matches weigh more than content matches
+TITLE_WEIGHT = 5.0
+# words around the first match in a snippet
+SNIPPET_WORDS = 24
+# markers around matches, replaced by <mark> after html escaping
+MARK_START, MARK_END = '\x02', '\x03'
+
+
+def query_terms(q):
+    """Lowercased words of a query, no fts5 syntax gets through"""
+    return [term.lower() for term in WORD_RE.findall(q or '')]
+
+
+def _highlight(text):
+    """Escape text, then turn the match markers into <mark> tags"""
+    return Markup(str(escape(text))
+                  .replace(MARK_START, '<mark>').replace(MARK_END, '</mark>'))
+
+
+class FTS5Index:
+    """
+    Sqlite fts5 table post_fts(title, content), rowid is the post id.
+    Lives in the app database, so it is shared by all worker processes.
+    """
+
+    def __init__(self):
+        self._ready = False
+
+    def _execute(self, sql, params=None, connection=None):
+        # the session's transaction unless a flush hands over its connection
+        connection = connection or db.session
+        if not self._ready:
+            connection.execute(db.text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS post_fts "
+                "USING fts5(title, content, tokenize='porter unicode61')"))
+            self._ready = True
+        return connection.execute(db.text(sql), params or {})
+
+    def add(self, post, connection=None):
+        """Index post, replacing what was indexed for it before, the caller commits"""
+        self.add_many([{'id': post.id, 'title': post.title, 'content': post.content}],
+                      connection)
+
+    def add_many(self, rows, connection=None):
+        """Index rows of id, title and content, the caller commits"""
+        rows = list(rows)
+        ids = [{'id': row['id']} for row in rows]
+        if not ids:
+            return
+        self._execute('DELETE FROM post_fts WHERE rowid = :id', ids, connection)
+        self._execute(
+            'INSERT INTO post_fts (rowid, title, content) VALUES (:id, :title, :content)',
+            rows, connection)
+
+    def remove(self, post_id, connection=None):
+        """Drop post_id from the index, the caller commits"""
+        self._execute('DELETE FROM post_fts WHERE rowid = :id', {'id': post_id}, connection)
+
+    def clear(self):
+        """Empty the index, the caller commits"""
+        self._execute('DELETE FROM post_fts')
+
+    def search(self, q, page=1, per_page=5):
+        """Best bm25 matches of every query word, with highlighted snippets"""
+        terms = query_terms(q)
+        if not terms:
+            return 0, []
+        # quoted terms, so user input is never parsed as fts5 syntax
+        match = ' '.join(f'"{term}"' for term in terms)
+        total = self._execute('SELECT count(*) FROM post_fts WHERE post_fts MATCH :match',
+                              {'match': match}).scalar()
+        if (page - 1) * per_page >= total:
+            # past the last page, and an OFFSET over 64 bits can't be bound
+            return total, []
+        rows = self._execute(
+            'SELECT rowid, snippet(post_fts, 1, :start, :end, :ellipsis, :words) '
+            'FROM post_fts WHERE post_fts MATCH :match '
+            'ORDER BY bm25(post_fts, :title_weight, 1.0) LIMIT :limit OFFSET :offset',
+            {'match': match, 'start': MARK_START, 'end': MARK_END, 'ellipsis': '…',
+             'words': SNIPPET_WORDS, 'title_weight': TITLE_WEIGHT,
+             'limit': per_page, 'offset': (page - 1) * per_page}).fetchall()
+        return total, [(post_id, _highlight(snippet)) for post_id, snippet in rows]
+
+
+class MemoryIndex:
+    """
+    Inverted index in this process: term -> {post_id: weighted term frequency}.
+    Built from the database on first use, then updated one post at a time.
+    """
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built = False
+        self._postings = defaultdict(dict)
+        # post_id -> (length, terms of the post), to unindex a post
+        self._docs = {}
+        self._total_length = 0.0
+
+    def _build(self):
+        if self._built:
+            return
+        self.clear()
+        query = db.session.query(Post.id, Post.title, Post.content).yield_per(1000)
+        self.add_many({'id': post_id, 'title': title, 'content': content}
+                      for post_id, title, content in query)
+        self._built = True
+
+    def _unindex(self, post_id):
+        doc = self._docs.pop(post_id, None)
+        if doc is None:
+            return
+        length, terms = doc
+        self._total_length -= length
+        for term in terms:
+            postings = self._postings[term]
+            postings.pop(post_id, None)
+            if not postings:
+                del self._postings[term]
+
+    def add(self, post):
+        """Index post, replacing what was indexed for it before"""
+        with self._lock:
+            if self._built:
+                self.add_many([{'id': post.id, 'title': post.title, 'content': post.content}])
+
+    def add_many(self, rows):
+        """Index rows of id, title and content"""
+        with self._lock:
+            for row in rows:
+                self._unindex(row['id'])
+                weights = Counter()
+                for term in query_terms(row['title']):
+                    weights[term] += TITLE_WEIGHT
+                for term in query_terms(row['content']):
+                    weights[term] += 1
+                length = sum(weights.values())
+                for term, weight in weights.items():
+                    self._postings[term][row['id']] = weight
+                self._docs[row['id']] = (length, tuple(weights))
+                self._total_length += length
+
+    def remove(self, post_id):
+        """Drop post_id from the index"""
+        with self._lock:
+            self._unindex(post_id)
+
+    def clear(self):
+        """Empty the index"""
+        with self._lock:
+            self._postings.clear()
+            self._docs.clear()
+            self._total_length = 0.0
+
+    def search(self, q, page=1, per_page=5):
+        """Best bm25 matches of every query word, with highlighted snippets"""
+        terms = list(dict.fromkeys(query_terms(q)))
+        if not terms:
+            return 0, []
+        with self._lock:
+            self._build()
+            postings = [self._postings.get(term, {}) for term in terms]
+            # every word must match, start from the rarest
+            postings.sort(key=len)
+            matches = set(postings[0]).intersection(*postings[1:])
+            docs = len(self._docs)
+            avg_length = self._total_length / docs if docs else 0.0
+            scores = {}
+            for post_id in matches:
+                length = self._docs[post_id][0]
+                score = 0.0
+                for term_postings in postings:
+                    freq = term_postings[post_id]
+                    idf = math.log(1 + (docs - len(term_postings) + 0.5) / (len(term_postings) + 0.5))
+                    score += idf * freq * (self.k1 + 1) / \
+                        (freq + self.k1 * (1 - self.b + self.b * length / avg_length))
+                scores[post_id] = score
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        page_ids = ranked[(page - 1) * per_page:page * per_page]
+        contents = dict(db.session.query(Post.id, Post.content)
+                        .filter(Post.id.in_(page_ids)).all()) if page_ids else {}
+        return len(ranked), [(post_id, _snippet(contents.get(post_id, ''), terms))
+                             for post_id in page_ids]
+
+
+def _snippet(content, terms):
+    """SNIPPET_WORDS words of content around the first match, matches marked"""
+    words = content.split()
+    wanted = set(terms)
+    first = next((index for index, word in enumerate(words)
+                  if set(query_terms(word)) & wanted), 0)
+    start = max(0, first - SNIPPET_WORDS // 4)
+    window = words[start:start + SNIPPET_WORDS]
+    marked = [f'{MARK_START}{word}{MARK_END}' if set(query_terms(word)) & wanted else word
+              for word in window]
+    text = ' '.join(marked)
+    if start > 0:
+        text = '…' + text
+    if start + SNIPPET_WORDS < len(words):
+        text += '…'
+    return _highlight(text)
+
+
+def _fts5_available():
+    try:
+        conn = sqlite3.connect(':memory:')
+        conn.execute('CREATE VIRTUAL TABLE probe USING fts5(body)')
+        conn.close()
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def init_app(app):
+    """Use fts5 on sqlite, the python index elsewhere, and follow post changes"""
+    uri = app.config.get('SQLALCHEMY_DATABASE_URI') or ''
+    if uri.startswith('sqlite') and _fts5_available():
+        index = FTS5Index()
+    else:
+        index = MemoryIndex()
+    app.extensions['search_index'] = index
+    if isinstance(index, MemoryIndex):
+        # the fts5 index is written by the mapper events below
+        post_created.connect(_on_post_saved, app)
+        post_updated.connect(_on_post_saved, app)
+        post_deleted.connect(_on_post_deleted, app)
+
+
+def search_index():
+    """Index of the current app"""
+    return current_app.extensions['search_index']
+
+
+def _on_post_saved(app, post):
+    app.extensions['search_index'].add(post)
+
+
+def _on_post_deleted(app, post):
+    app.extensions['search_index'].remove(post.id)
+
+
+def _fts5_index():
+    """The FTS5Index of the current app, None for a MemoryIndex or no app"""
+    if not has_app_context():
+        return None
+    index = current_app.extensions.get('search_index')
+    return index if isinstance(index, FTS5Index) else None
+
+
+@event.listens_for(Post, 'after_insert')
+def _on_post_insert(mapper, connection, target):
+    index = _fts5_index()
+    if index is not None:
+        index.add(target, connection)
+
+
+@event.listens_for(Post, 'after_update')
+def _on_post_update(mapper, connection, target):
+    index = _fts5_index()
+    state = db.inspect(target)
+    # the derived columns and the dates are not indexed
+    if index is not None and (state.attrs.title.history.has_changes()
+                              or state.attrs.content.history.has_changes()):
+        index.add(target, connection)
+
+
+@event.listens_for(Post, 'after_delete')
+def _on_post_delete(mapper, connection, target):
+    index = _fts5_index()
+    if index is not None:
+        index.remove(target.id, connection)
+
+
+@click.command('rebuild-search-index')
+@click.option('--batch-size', default=5000, show_default=True)
+@with_appcontext
+def rebuild_search_index_command(batch_size):
+    """Index every post again, ie. after restoring or importing posts."""
+    index = search_index()
+    index.clear()
+    done = 0
+    last_id = 0
+    while True:
+        # seek on the primary key, memory stays flat on big tables
+        rows = db.session.query(Post.id, Post.title, Post.content)\
+            .filter(Post.id > last_id).order_by(Post.id).limit(batch_size).all()
+        if not rows:
+            break
+        index.add_many([{'id': post_id, 'title': title, 'content': content}
+                        for post_id, title, content in rows])
+        db.session.commit()
+        done += len(rows)
+        last_id = rows[-1][0]
+        click.echo(f'indexed {done} posts')
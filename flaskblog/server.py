@@ -0,0 +1,134 @@
+"""
+Production server
+    run(config_class=None, **overrides): serve the app with gunicorn, python run.py --production
+    Server: gunicorn application, the app is created once in the master
+    options(config, **overrides): gunicorn settings of a config class
+    post_fork(server, worker): setup of a new worker, before it accepts requests
+"""
+import gc
+from gunicorn.app.base import BaseApplication
+from flaskblog import create_app, db
+from flaskblog.config import get_config
+from flaskblog.outbox import start_worker
+from flaskblog.warmup import open_connections
+
+"""
+Imports:
+    gc: freeze, keeps the collector from writing to the shared pages
+    gunicorn.app.base: BaseApplication, gunicorn configured from python
+    flaskblog: create_app, db
+    flaskblog.config: get_config, the config class of FLASK_CONFIG
+    flaskblog.outbox: start_worker, each worker sends the mail outbox
+    flaskblog.warmup: open_connections, each worker fills its own pools
+
+Config:
+    SERVER_BIND: host:port, or unix:/path of a socket
+    SERVER_WORKERS: worker processes
+    SERVER_THREADS: requests served at once by a worker, 1 (sync workers)
+        or more (gthread workers)
+    SERVER_MAX_REQUESTS, SERVER_MAX_REQUESTS_JITTER: a worker is replaced
+        after this many requests, plus up to the jitter, so they don't all
+        restart at once. 0 never replaces them
+    SERVER_TIMEOUT: seconds a worker may hang before the master kills it
+    SERVER_GRACEFUL_TIMEOUT: seconds a stopping worker gets to finish
+    SERVER_KEEPALIVE: seconds an idle keep-alive connection is kept
+    SERVER_ACCESS_LOG: access log file, '-' for stdout, None for none
+
+The master process creates the app (and warms it up, see warmup.py)
+before it forks the workers, so code, compiled templates and the hot
+feed are loaded once and shared copy-on-write. gc.freeze() moves them
+out of the collector's reach, else every collection in a worker would
+touch, and copy, their pages. The master closes its database
+connections before forking, each worker opens its own.
+
+Sync workers (SERVER_THREADS 1) serve one request at a time and accept
+the next only when done, so a worker that stops (reload, max-requests)
+leaves every waiting connection to the others. gthread workers serve
+several at once and hold on to slow clients better, but a stopping
+gthread worker resets the connections it accepted and hadn't read yet.
+Behind a buffering proxy (nginx) slow clients never reach the workers,
+use sync workers there.
+
+Signals of the master:
+    HUP: graceful reload. The app is created again (templates, hot feed
+        and caches start over), new workers are forked from it, then the
+        old workers stop accepting, finish their requests and exit. The
+        listening socket stays open, no request is dropped.
+    USR2, then QUIT to the old master: deploy new code or config, they
+        are read when a process starts. A new master is started next to
+        the old one on the same socket
+    TTIN, TTOU: one worker more, one less
+    TERM: graceful shutdown, INT and QUIT: immediate
+"""
+
+
+def options(config, **overrides):
+    """
+    gunicorn settings of config
+    Args:
+        config: config class, ie. ProductionConfig
+        overrides: settings given on the command line, ie. bind, workers
+    """
+    settings = {
+        'bind': config.SERVER_BIND,
+        'workers': config.SERVER_WORKERS,
+        'worker_class': 'gthread' if config.SERVER_THREADS > 1 else 'sync',
+        'threads': config.SERVER_THREADS,
+        'preload_app': True,
+        'max_requests': config.SERVER_MAX_REQUESTS,
+        'max_requests_jitter': config.SERVER_MAX_REQUESTS_JITTER,
+        'timeout': config.SERVER_TIMEOUT,
+        'graceful_timeout': config.SERVER_GRACEFUL_TIMEOUT,
+        'keepalive': config.SERVER_KEEPALIVE,
+        'accesslog': config.SERVER_ACCESS_LOG,
+        'post_fork': post_fork,
+    }
+    settings.update({key: value for key, value in overrides.items() if value is not None})
+    return settings
+
+
+class Server(BaseApplication):
+    """gunicorn application creating the app in the master"""
+
+    def __init__(self, config_class, **overrides):
+        self.config_class = config_class
+        self.overrides = overrides
+        super().__init__()
+
+    def load_config(self):
+        for key, value in options(self.config_class, **self.overrides).items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        app = create_app(self.config_class)
+        # the connections of the master (startup, warm-up) must not reach the workers
+        with app.app_context():
+            for bind in [None] + list(app.config.get('SQLALCHEMY_BINDS') or {}):
+                db.get_engine(app, bind=bind).dispose()
+        gc.freeze()
+        return app
+
+    def reload(self):
+        """HUP: load the app again, the new workers are forked from it"""
+        super().reload()
+        # the old app may be collected now
+        gc.unfreeze()
+        # with preload_app gunicorn would fork the new workers from the old app
+        self.callable = None
+
+
+def post_fork(server, worker):
+    """
+    Fill the connection pools of the new worker before it accepts
+    requests, start its mail sender
+    """
+    app = worker.app.wsgi()
+    if app.config['WARM_UP']:
+        open_connections(app)
+    # threads of the master are not forked, the outbox waits for this one
+    start_worker(app)
+
+
+def run(config_class=None, **overrides):
+    """Serve the app of config_class (default FLASK_CONFIG) until the master is stopped"""
+    Server(config_class or get_config(), **overrides).run()
@@ -0,0 +1,29 @@
+"""
+App signals
+    post_created, post_updated, post_deleted: sent by the posts routes
+    user_updated: sent when a user's public profile changes
+    password_hashed: sent after each password hash or check, for metrics
+"""
+from blinker import Namespace
+
+"""
+Imports:
+    blinker: Namespace, same signal library flask uses for its own signals
+
+Signals are sent after the change is committed, with the app as sender:
+    post_created.send(current_app._get_current_object(), post=post)
+    user_updated.send(current_app._get_current_object(), user=user)
+Caches and indexes that depend on posts or users connect to these, so
+the routes don't have to know about each of them.
+"""
+
+_signals = Namespace()
+
+# kwargs: post
+post_created = _signals.signal('post-created')
+post_updated = _signals.signal('post-updated')
+post_deleted = _signals.signal('post-deleted')
+# kwargs: user
+user_updated = _signals.signal('user-updated')
+# kwargs: operation ('hash' or 'check'), seconds including the wait for the pool
+password_hashed = _signals.signal('password-hashed')
@@ -0,0 +1,134 @@
+"""
+Streamed rendering
+    init_app(app): stream_flush template helper
+    Deferred: a context value loaded when the template first uses it
+    streaming_allowed(): whether the current request may get a streamed page
+    stream_template(template_name, **context): response body rendered piece by piece
+    stream_flush(): template helper, send what is rendered so far
+"""
+from flask import (current_app, g, session, stream_with_context,
+                   before_render_template, template_rendered)
+from markupsafe import Markup
+
+"""
+Imports:
+    Flask:
+        current_app, config and jinja_env
+        g, marks the render that is streamed
+        session, pending flash messages
+        stream_with_context, the request context stays up while the body is sent
+        before_render_template, template_rendered: signals render_template sends,
+            the template timings of metrics.py
+    markupsafe: Markup, the flush mark is not escaped
+
+Config:
+    STREAM_TEMPLATES: stream the listing pages, off renders them whole
+    STREAM_BUFFER_SIZE: characters collected before a piece is sent
+
+render_template returns the page once all of it is rendered, so the
+browser waits for the listing's queries before it sees the <head> and
+can start fetching the stylesheets. A streamed page is a generator: the
+layout up to {{ stream_flush() }} (the head and the navigation) is sent
+first, then the view's Deferred posts are read while the content block
+renders, and the rest follows in STREAM_BUFFER_SIZE pieces.
+
+The status and the headers go out with the first piece, so a streamed
+view decides them before: a 404 for an unknown user, the validators of
+a 304 (see cache.py, version_validators). An error after that can only
+cut the page short, werkzeug or gunicorn logs it. The session is saved
+with the headers as well, so a request with pending flash messages,
+which rendering removes from the session, gets a whole page. For the
+same reason the Server-Timing header of metrics.py leaves out the
+streamed rendering, /metrics counts it.
+"""
+
+# what stream_flush() puts into a streamed page, taken out again before sending
+FLUSH_MARK = '<!-- flush -->'
+
+
+def init_app(app):
+    """Add the stream_flush template helper"""
+    app.add_template_global(stream_flush)
+
+
+class Deferred:
+    """
+    A context value loaded by func when the template first reads it, ie.
+    the posts of a listing, so a streamed page sends its head first.
+    Attribute access, iteration, len and truth go to the loaded value.
+    """
+    __slots__ = ('_func', '_value', '_loaded')
+
+    def __init__(self, func):
+        self._func = func
+        self._value = None
+        self._loaded = False
+
+    @property
+    def value(self):
+        """The loaded value, func is called once"""
+        if not self._loaded:
+            self._value = self._func()
+            self._loaded = True
+        return self._value
+
+    def __getattr__(self, name):
+        return getattr(self.value, name)
+
+    def __iter__(self):
+        return iter(self.value)
+
+    def __len__(self):
+        return len(self.value)
+
+    def __bool__(self):
+        return bool(self.value)
+
+
+def streaming_allowed():
+    """True if the current request may get a streamed page"""
+    # rendering pops the flashes, the session would be saved without that
+    return current_app.config['STREAM_TEMPLATES'] and '_flashes' not in session
+
+
+def stream_flush():
+    """Mark where a streamed page sends what is rendered so far, nothing otherwise"""
+    return Markup(FLUSH_MARK) if g.get('streaming') else Markup('')
+
+
+def stream_template(template_name, **context):
+    """
+    Render template_name as a response body, the text before each
+    stream_flush() and every STREAM_BUFFER_SIZE characters are sent as
+    soon as they are rendered. Must be called in a request context.
+    """
+    app = current_app._get_current_object()
+    template = app.jinja_env.get_template(template_name)
+    app.update_template_context(context)
+    size = app.config['STREAM_BUFFER_SIZE']
+
+    def generate():
+        g.streaming = True
+        before_render_template.send(app, template=template, context=context)
+        pieces = []
+        buffered = 0
+        for text in template.generate(context):
+            if FLUSH_MARK in text:
+                *sent, text = text.split(FLUSH_MARK)
+                pieces.extend(sent)
+                if buffered or any(sent):
+                    yield ''.join(pieces)
+                pieces = []
+                buffered = 0
+            pieces.append(text)
+            buffered += len(text)
+            if buffered >= size:
+                yield ''.join(pieces)
+                pieces = []
+                buffered = 0
+        if pieces:
+            yield ''.join(pieces)
+        g.streaming = False
+        template_rendered.send(app, template=template, context=context)
+
+    return stream_with_context(generate())
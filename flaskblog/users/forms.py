@@ -13,6 +13,8 @@ from wtforms import StringField, PasswordField, SubmitField, BooleanField
 from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError
 from flask_login import current_user
 from flaskblog.models import User
+from flaskblog.users.utils import check_picture
+from flaskblog.replicas import use_replica
 
 """
 Imports:
@@ -24,6 +26,9 @@ Imports:
     wt forms: validationerror used in custom field validation function
     flask_login: current_user used in updateaccount form
     user model: used in customr field validation function
+    check_picture: size and pixel limits of an uploaded picture
+    use_replica: the uniqueness checks may read from a replica, the unique
+        constraints of the user table still guard the insert
 """
 
 # Create forms specifically to the users module
@@ -46,14 +51,16 @@ class RegistrationForm(FlaskForm):
 
     def validate_username(self, username):
         """Validation if username is unique"""
-        user = User.query.filter_by(username=username.data).first()
+        with use_replica():
+            user = User.query.filter_by(username=username.data).first()
         # raise an error and send message to form
         if user:
             raise ValidationError('Username already exists. Please choose another.')
 
     def validate_email(self, email):
         """Validation if email is unique"""
-        user = User.query.filter_by(email=email.data).first()
+        with use_replica():
+            user = User.query.filter_by(email=email.data).first()
         # raise an error and send message to form
         if user:
             raise ValidationError('Email already exists. Please choose another.')
@@ -96,7 +103,8 @@ class UpdateAccountForm(FlaskForm):
         """Validation if username is unique"""
         # only validate if username is changed
         if username.data != current_user.username:
-            user = User.query.filter_by(username=username.data).first()
+            with use_replica():
+                user = User.query.filter_by(username=username.data).first()
             # raise an error and send message to form
             if user:
                 raise ValidationError('Username already exists. Please choose another.')
@@ -105,11 +113,20 @@ class UpdateAccountForm(FlaskForm):
         """Validation if email is unique"""
         # only validate if email is changed
         if email.data != current_user.email:
-            user = User.query.filter_by(email=email.data).first()
+            with use_replica():
+                user = User.query.filter_by(email=email.data).first()
             # raise an error and send message to form
             if user:
                 raise ValidationError('Email already exists. Please choose another.')
 
+    def validate_picture(self, picture):
+        """Validation of picture size, before anything is decoded"""
+        if picture.data:
+            try:
+                check_picture(picture.data)
+            except ValueError as error:
+                raise ValidationError(str(error))
+
 
 class RequestResetForm(FlaskForm):
     """Reset pw page to submit reset request"""
@@ -0,0 +1,142 @@
+"""
+Password hashing
+    hash_password(password): hash with the configured method and cost
+    check_password(hashed, password): verify against a stored hash
+    needs_rehash(hashed): stored with other parameters than configured
+    hashing_metrics(): hashes in flight in this process
+    HashingBusy: 503, too many hashes waiting for the pool
+"""
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt
+from flask import current_app
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import generate_password_hash, check_password_hash
+from flaskblog.signals import password_hashed
+
+"""
+Imports:
+    os: pid, every worker process gets its own hashing pool
+    threading: bound on the hashes waiting for the pool
+    time: duration of a hash, sent with password_hashed
+    concurrent.futures: ProcessPoolExecutor, hashing runs outside the
+        request thread and the GIL
+    bcrypt: bcrypt hashes, cost is stored in the hash ($2b$12$...)
+    Flask:
+        current_app, config
+    werkzeug.exceptions: ServiceUnavailable, base of HashingBusy
+    werkzeug.security: pbkdf2 hashes, method and iterations are stored
+        in the hash (pbkdf2:sha256:260000$...)
+    flaskblog.signals: password_hashed, hashing time for the metrics
+
+Config:
+    PASSWORD_HASH_METHOD: 'bcrypt' or 'pbkdf2:sha256'
+    BCRYPT_LOG_ROUNDS: bcrypt cost
+    PBKDF2_ITERATIONS: pbkdf2 iterations
+    PASSWORD_HASH_WORKERS: pool processes, 0 hashes on the request thread
+    PASSWORD_HASH_MAX_PENDING: hashes allowed to wait for the pool, above
+        that requests get a 503 instead of queueing up behind each other
+"""
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_pending = None
+# hashes running or waiting for the pool
+_in_flight = 0
+
+
+class HashingBusy(ServiceUnavailable):
+    """All hashing slots are taken"""
+    description = 'Too many logins right now, please try again in a moment.'
+
+
+def _hash(method, cost, password):
+    """Hash password, runs in a pool process"""
+    if method == 'bcrypt':
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(cost)).decode('utf-8')
+    return generate_password_hash(password, method=f'{method}:{cost}')
+
+
+def _check(hashed, password):
+    """Verify password, runs in a pool process"""
+    if hashed.startswith('$2'):
+        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    return check_password_hash(hashed, password)
+
+
+def _configured():
+    """(method, cost) from the config"""
+    method = current_app.config['PASSWORD_HASH_METHOD']
+    if method == 'bcrypt':
+        return method, current_app.config['BCRYPT_LOG_ROUNDS']
+    return method, current_app.config['PBKDF2_ITERATIONS']
+
+
+def _run(func, *args):
+    """Run func in the hashing pool, or inline when there is no pool"""
+    global _in_flight
+    started = time.perf_counter()
+    with _pool_lock:
+        _in_flight += 1
+    try:
+        return _submit(func, *args)
+    finally:
+        with _pool_lock:
+            _in_flight -= 1
+        password_hashed.send(current_app._get_current_object(),
+                             operation=func.__name__.lstrip('_'),
+                             seconds=time.perf_counter() - started)
+
+
+def _submit(func, *args):
+    """Run func in the pool, HashingBusy when every slot is taken"""
+    global _pool, _pool_pid, _pending
+    workers = current_app.config['PASSWORD_HASH_WORKERS']
+    if not workers:
+        return func(*args)
+    with _pool_lock:
+        # pools do not survive fork, each worker process creates its own
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(max_workers=workers)
+            _pool_pid = os.getpid()
+            _pending = threading.BoundedSemaphore(
+                workers + current_app.config['PASSWORD_HASH_MAX_PENDING'])
+    if not _pending.acquire(blocking=False):
+        raise HashingBusy()
+    try:
+        return _pool.submit(func, *args).result()
+    finally:
+        _pending.release()
+
+
+def hash_password(password):
+    """Hash password with the configured method and cost"""
+    method, cost = _configured()
+    return _run(_hash, method, cost, password)
+
+
+def check_password(hashed, password):
+    """True if password matches the stored hash"""
+    return _run(_check, hashed, password)
+
+
+def needs_rehash(hashed):
+    """True if hashed was made with another method or cost than configured"""
+    method, cost = _configured()
+    if method == 'bcrypt':
+        # $2b$12$<salt and hash>
+        parts = hashed.split('$')
+        return not hashed.startswith('$2') or len(parts) < 4 or int(parts[2]) != cost
+    # pbkdf2:sha256:260000$<salt>$<hash>
+    return hashed.split('$', 1)[0] != f'{method}:{cost}'
+
+
+def hashing_metrics():
+    """Hashes running or waiting in this process, and the most allowed"""
+    config = current_app.config
+    return {'in_flight': _in_flight,
+            'capacity': config['PASSWORD_HASH_WORKERS'] + config['PASSWORD_HASH_MAX_PENDING']
+            if config['PASSWORD_HASH_WORKERS'] else None}
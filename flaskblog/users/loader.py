@@ -0,0 +1,96 @@
+"""
+Users loader
+    init_app(app): user cache of the app
+    load_user(user_id): flask_login user loader, served from the user cache
+    remember_version(user): the session needs at least this version of user
+    user_changed(user): drop the cached copy after user is modified
+"""
+from flask import current_app, session
+from flask_login import current_user
+from sqlalchemy.orm import make_transient_to_detached
+from flaskblog import db, login_mgmr
+from flaskblog.cache import LRUBackend, NullBackend
+from flaskblog.models import User
+from flaskblog.signals import user_updated
+
+"""
+Imports:
+    Flask:
+        current_app, config and extensions
+        session, holds the version of the logged in user
+    flask_login:
+        current_user, user_changed records the version when it is the
+        logged in user
+    sqlalchemy.orm: make_transient_to_detached, a cached row becomes a
+        User without a query
+    flaskblog: db, login_mgmr to register the user loader
+    flaskblog.cache: LRUBackend, NullBackend, storage of the user cache
+    flaskblog.models: User entity class
+    flaskblog.signals: user_updated, the picture job changes users outside
+        of their requests
+
+Every request of a logged in user loads the user, even when the view only
+checks current_user.is_authenticated. The loader keeps the columns of
+recently seen users per process for USER_CACHE_TTL seconds.
+
+The session carries the user's version. A cached copy older than that
+version is not used, so a user always sees their own changes, whichever
+worker process serves the next request. Changes made by others (ie. the
+picture job in another process) show up after at most USER_CACHE_TTL.
+"""
+
+# session key of the logged in user's version
+SESSION_VERSION_KEY = '_user_version'
+
+
+def init_app(app):
+    """Create the user cache, USER_CACHE_TTL 0 disables it"""
+    ttl = app.config['USER_CACHE_TTL']
+    if ttl:
+        backend = LRUBackend(app.config['USER_CACHE_THRESHOLD'], ttl)
+    else:
+        backend = NullBackend()
+    app.extensions['user_cache'] = backend
+    user_updated.connect(_on_user_updated, app)
+
+
+def _cache():
+    return current_app.extensions['user_cache']
+
+
+# decorate so LoginManager extension knows this is the function that gets the user by id
+@login_mgmr.user_loader
+def load_user(user_id):
+    """Get user by id, from the user cache when its copy is current"""
+    user_id = int(user_id)
+    values = _cache().get(user_id)
+    if values is not None and values['version'] >= session.get(SESSION_VERSION_KEY, 0):
+        # a detached User from the cached columns, merged without a SELECT
+        user = User(**values)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+    user = User.query.get(user_id)
+    if user is not None:
+        _cache().set(user_id, {column.key: getattr(user, column.key)
+                               for column in User.__table__.columns})
+    return user
+
+
+def user_changed(user):
+    """
+    Call after committing a change of user. Drops the cached copy in this
+    process and, for the logged in user, records the new version in the
+    session so other processes don't serve their older copy.
+    """
+    _cache().delete(user.id)
+    if current_user.is_authenticated and current_user.id == user.id:
+        remember_version(user)
+
+
+def remember_version(user):
+    """Cached copies of user older than its current version are not used in this session"""
+    session[SESSION_VERSION_KEY] = user.version
+
+
+def _on_user_updated(app, user):
+    app.extensions['user_cache'].delete(user.id)
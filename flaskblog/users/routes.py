@@ -9,14 +9,26 @@ Users.routes
     reset_token(token): /reset_password/<token>
 """
 
-from flask import render_template, url_for, flash, redirect, request, Blueprint
+from flask import (render_template, url_for, flash, redirect, request,
+                   Blueprint, current_app)
 from flask_login import login_user, current_user, logout_user, login_required
-from flaskblog import db, bcrypt_flask
-from flaskblog.models import User, Post
+from flaskblog import db, page_cache
+from flaskblog.cache import post_tags, render_conditional, version_validators
+from flaskblog.models import User
 from flaskblog.users.forms import (RegistrationForm, LoginForm,
                                    UpdateAccountForm, RequestResetForm,
                                    ResetPasswordForm)
-from flaskblog.users.utils import save_picture, send_reset_email
+from flaskblog.users.utils import (save_picture, picture_pending,
+                                   avatar_url, send_reset_email)
+from flaskblog.users.hashing import hash_password, check_password, needs_rehash
+from flaskblog.users.loader import remember_version, user_changed
+from flaskblog.users.tokens import verify_reset_token
+from flaskblog.posts.utils import listing_query, keyset_paginate
+from flaskblog.posts.hotfeed import feed_version
+from flaskblog.signals import user_updated
+from flaskblog.replicas import replica_reads, use_replica
+from flaskblog.ratelimit import rate_limit, login_lockout, login_failed, login_succeeded
+from flaskblog.streaming import Deferred
 
 """
 Imports:
@@ -27,19 +39,45 @@ Imports:
         flash to show messages to user
         redirect to redirect between forms and pages
         request to GET http arguments
+        current_app, sender of the signals
     flask_login:
         login_user function used in login route
         current_user: register and login to vheck for a logged in user
         logout_user logout user out used in logout route
         login_required decorator to routes that needs user is logged in
     flaskblog:
-        db, bcrypt_flask
+        db
+        page_cache to cache the rendered page for anonymous readers
+        post_tags, cache invalidation tags of the listed posts
+        version_validators, render_conditional for conditional GET (304),
+        streamed pages
     flaskblog.models:
-        User and Post entity class
+        User entity class
     flaskblog.users.forms:
         user-defined forms: register, login, updateaccount, reset password forms
     flaskblog.users.utils:
-        save_picture and send_reset_email
+        save_picture, picture_pending, avatar_url and send_reset_email
+    flaskblog.users.hashing:
+        hash_password, check_password, needs_rehash, configured cost, off the request thread
+    flaskblog.users.loader:
+        remember_version, user_changed, keep the cached current_user current
+    flaskblog.users.tokens:
+        verify_reset_token, user of a valid and unused reset token
+    flaskblog.posts.utils:
+        listing_query, posts with their authors eager loaded
+        keyset_paginate, cursor pagination of a listing
+    flaskblog.posts.hotfeed:
+        feed_version, the user page's validator
+    flaskblog.signals:
+        user_updated, sent when username or picture changes
+    flaskblog.replicas:
+        replica_reads, use_replica: the posts of a user may be read from a replica
+    flaskblog.ratelimit:
+        rate_limit, RATE_LIMITS of the login, register and reset routes
+        login_lockout, login_failed, login_succeeded: lock an account after
+        repeated failed logins
+    flaskblog.streaming:
+        Deferred, the posts are read after the page's head was sent
 """
 
 # Instantiate users blueprint
@@ -50,6 +88,7 @@ users = Blueprint('users', __name__)
 
 @users.route("/register", methods=['GET', 'POST'])
 # must accept both get and post requests.
+@rate_limit
 def register():
     """Register route and render form. Validate user."""
     if current_user.is_authenticated:
@@ -61,7 +100,7 @@ def register():
         # if validate ok, show message to user. use bootstrap alert style class: success
         # Create account:
         #  hash the pw
-        hsh_pw = bcrypt_flask.generate_password_hash(form.password.data, 12).decode('utf-8')
+        hsh_pw = hash_password(form.password.data)
         # create user with form-data
         user = User(username=form.username.data, email=form.email.data, password=hsh_pw)
         db.session.add(user)
@@ -75,6 +114,7 @@ def register():
 
 
 @users.route("/login", methods=['GET', 'POST'])
+@rate_limit
 def login():
     """Login route and render form. Login user."""
     # If user is already logged in send to home
@@ -83,15 +123,35 @@ def login():
 
     form = LoginForm()
     if form.validate_on_submit():
+        locked = login_lockout(form.email.data)
+        if locked:
+            # no password check while locked, not even a right one
+            flash(f'Too many failed logins. Try again in {int(locked // 60) + 1} minutes.',
+                  'danger')
+            return render_template('login.html', title='Login', form=form), 429, \
+                {'Retry-After': str(int(locked) + 1)}
         user = User.query.filter_by(email=form.email.data).first()
-        if user and bcrypt_flask.check_password_hash(user.password, form.password.data):
+        if user and check_password(user.password, form.password.data):
+            login_succeeded(form.email.data)
             # if user exists and password is validated
+            if needs_rehash(user.password):
+                # hashed with an older method or cost, upgrade it now we know the password;
+                # a new hash like any password change: cached copies are dropped, and
+                # reset links still pending stop working (their fingerprint is of the hash)
+                user.password = hash_password(form.password.data)
+                user.version = User.version + 1
+                db.session.commit()
+                user_changed(user)
             login_user(user, remember=form.remember.data)
+            # cached copies older than this login are not used
+            remember_version(user)
             # get next parameter if it exists
             next_page = request.args.get('next')
             return redirect(next_page) if next_page else redirect(url_for('main.home'))
             # flash('You have been logged in', 'success')
         else:
+            # unknown emails count too, the lockout tells nothing about accounts
+            login_failed(form.email.data)
             flash('Access denied. Login failed!', 'danger')
     return render_template('login.html', title='Login', form=form)
 
@@ -110,13 +170,20 @@ def account():
     form = UpdateAccountForm()
     if form.validate_on_submit():
         # check if theres picture data
+        # username and picture are shown on public pages
+        profile_changed = form.username.data != current_user.username
         if form.picture.data:
-            picture_file = save_picture(form.picture.data)
-            # update currentuser with new image
-            current_user.image_file = picture_file
+            # resized off the request, the job updates current user's image
+            save_picture(form.picture.data, current_user)
+            flash('Your new picture is being processed.', 'info')
         current_user.username = form.username.data
         current_user.email = form.email.data
+        # in sql, current_user may be a cached copy with an older version
+        current_user.version = User.version + 1
         db.session.commit()
+        user_changed(current_user)
+        if profile_changed:
+            user_updated.send(current_app._get_current_object(), user=current_user)
         flash('Your account has been updated.', 'success')
         return redirect(url_for('users.account'))
     elif request.method == 'GET':
@@ -125,28 +192,49 @@ def account():
         form.email.data = current_user.email
 
     # get users imagefile from db and load it
-    image_file = url_for('static',
-                         filename=f'profile_pics/{current_user.image_file}')
+    image_file = avatar_url(current_user.image_file)
+    image_webp = avatar_url(current_user.image_file, webp=True)
     return render_template('account.html', title='Account',
-                           image_file=image_file, form=form)
+                           image_file=image_file, image_webp=image_webp,
+                           picture_pending=picture_pending(current_user), form=form)
 
 
 @users.route("/user/<string:username>")
+@replica_reads
+@page_cache.cached()
 def user_posts(username):
     """User route and render form"""
-    # set the page from GET, default 1, must be int else page throws valueerror!
-    page = request.args.get('page', 1, type=int)
-    # get user
+    # ?page=n is the old offset pagination, kept so existing links work
+    page = request.args.get('page', type=int)
+    cursor = request.args.get('cursor')
+    # get user, an unknown one is a 404 before anything is sent
     user = User.query.filter_by(username=username).first_or_404()
-    # get 5 posts from user from db
-    # order by newest post
-    posts = Post.query.filter_by(author=user)\
-        .order_by(Post.date_posted.desc())\
-        .paginate(page=page, per_page=5)
-    return render_template('user_posts.html', posts=posts, user=user)
+    # before the posts are read, a post saved meanwhile invalidates the page
+    page_cache.tag('sidebar', f'posts_by:{user.id}', f'user:{user.id}')
+
+    def load():
+        # replica_reads has returned by the time a streamed page reads the posts
+        with use_replica():
+            # get 5 posts from user from db, author loaded in the same query
+            # order by newest post
+            if page:
+                posts = listing_query(author=user).paginate(page=page, per_page=5)
+            else:
+                # default: seek from the ?cursor= token, no COUNT and no OFFSET
+                posts = keyset_paginate(listing_query(author=user), cursor, per_page=5)
+        page_cache.tag(*post_tags(posts.items))
+        return posts
+
+    # the posts are read while the page streams, after its head was sent,
+    # but ?page= past the last page is a 404, decided before anything is sent
+    posts = load() if page else Deferred(load)
+    validators = version_validators(feed_version(), user.id, page, cursor)
+    return render_conditional(validators, 'user_posts.html', stream=True, posts=posts,
+                              user=user, archive_user=user)
 
 
 @users.route("/reset_password", methods=['GET', 'POST'])
+@rate_limit
 def reset_request():
     """Request password reset"""
     # The user must be logged out to get to the form
@@ -157,7 +245,7 @@ def reset_request():
     if form.validate_on_submit():
         # get the user
         user = User.query.filter_by(email=form.email.data).first()
-        # send email to user
+        # send email to user, unless the address got RESET_EMAIL_LIMIT mails lately
         send_reset_email(user)
         flash('An email has been sent with reset instructions.', 'info')
         return redirect(url_for('users.login'))
@@ -170,16 +258,18 @@ def reset_token(token):
     # is token active? get from url
     if current_user.is_authenticated:
         return redirect(url_for('main.home'))
-    user = User.verify_reset_token(token)
+    user = verify_reset_token(token)
     # If no user, token invalid or expired
     if user is None:
         flash('Invalid or expired token', 'warning')
         return redirect(url_for('users.reset_request'))
     form = ResetPasswordForm()
     if form.validate_on_submit():
-        hsh_pw = bcrypt_flask.generate_password_hash(form.password.data, 12).decode('utf-8')
+        hsh_pw = hash_password(form.password.data)
         user.password = hsh_pw
+        user.version += 1
         db.session.commit()
+        user_changed(user)
         flash('Password updated. Please login.', 'success')
         return redirect(url_for('users.login'))
     return render_template('reset_token.html', title='Reset Password', form=form)
@@ -0,0 +1,98 @@
+"""
+Users tokens
+    reset_token(user): signed, expiring password reset token for user
+    verify_reset_token(token): the user of a valid, unused token, or None
+    password_fingerprint(password_hash): what binds a token to the current password
+"""
+import hashlib
+import hmac
+import re
+from functools import lru_cache
+from flask import current_app
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+from flaskblog.models import User
+
+"""
+Imports:
+    hashlib: password_fingerprint
+    hmac: compare_digest, constant time fingerprint check
+    re: shape of a token, checked before any crypto
+    functools.lru_cache: one serializer per secret key
+    Flask:
+        current_app, config
+    itsdangerous:
+        URLSafeTimedSerializer, signed payload with a timestamp
+        BadSignature, SignatureExpired: tampered or malformed, expired
+    flaskblog.models: User entity class
+
+Config:
+    SECRET_KEY: signs new tokens
+    SECRET_KEY_FALLBACKS: older secret keys, their tokens are still accepted
+        until they expire, so the key can be rotated without breaking the
+        mails already sent
+    RESET_TOKEN_MAX_AGE: seconds a token stays valid
+
+A token carries the user id and a fingerprint of the user's password hash.
+Resetting the password changes the hash, so a token works once. So does
+the rehash of a login with an outdated hash (users.routes.login): the
+user got in with their password, the links they asked for stop working.
+Malformed, tampered and expired tokens are rejected by the signature
+check, only a token this app signed costs a database lookup.
+"""
+
+# separates reset tokens from anything else signed with the same key
+SALT = 'password-reset'
+# url safe base64 payload.timestamp.signature, generously sized
+TOKEN_RE = re.compile(r'^[A-Za-z0-9_\-]{1,200}\.[A-Za-z0-9_\-]{1,20}\.[A-Za-z0-9_\-]{1,100}$')
+
+
+@lru_cache(maxsize=8)
+def _serializer(secret_key):
+    return URLSafeTimedSerializer(secret_key, salt=SALT)
+
+
+def _secret_keys():
+    """The current key first, then the fallbacks"""
+    return [current_app.config['SECRET_KEY']] + \
+        list(current_app.config.get('SECRET_KEY_FALLBACKS') or [])
+
+
+def password_fingerprint(password_hash):
+    """Short digest of a password hash, changes whenever the password does"""
+    return hashlib.sha256(password_hash.encode('utf-8')).hexdigest()[:16]
+
+
+def reset_token(user):
+    """Password reset token of user, signed with the current secret key"""
+    return _serializer(current_app.config['SECRET_KEY']).dumps(
+        {'user_id': user.id, 'fp': password_fingerprint(user.password)})
+
+
+def verify_reset_token(token):
+    """
+    User of token, or None when the token is malformed, tampered with,
+    expired, or was used already (the password changed since it was made)
+    """
+    if not TOKEN_RE.match(token):
+        return None
+    max_age = current_app.config['RESET_TOKEN_MAX_AGE']
+    for secret_key in _secret_keys():
+        try:
+            payload = _serializer(secret_key).loads(token, max_age=max_age)
+            break
+        except SignatureExpired:
+            # signed by this app, too old
+            return None
+        except BadSignature:
+            # malformed, or signed with another key
+            continue
+    else:
+        return None
+    if not isinstance(payload, dict) or not isinstance(payload.get('user_id'), int) \
+            or not isinstance(payload.get('fp'), str):
+        return None
+    user = User.query.get(payload['user_id'])
+    if user is None or not hmac.compare_digest(payload['fp'],
+                                               password_fingerprint(user.password)):
+        return None
+    return user
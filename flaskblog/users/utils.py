@@ -1,50 +1,351 @@
 """
 Users utils
-    save_picture(form_picture)
+    check_picture(form_picture)
+    save_picture(form_picture, user)
+    picture_pending(user)
+    avatar_url(image_file, size=None, webp=False)
+    prune_pictures(pictures_dir, max_age): remove the pictures no user has
+    resize_avatars_command: flask resize-avatars [--prune]
     send_reset_email(user)
 """
 
+import hashlib
 import os
 import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import click
 from PIL import Image
 from flask import url_for, current_app
+from flask.cli import with_appcontext
 from flask_mail import Message
-from flaskblog import mail
+from flaskblog import db
+from flaskblog.models import User
+from flaskblog.outbox import enqueue
+from flaskblog.ratelimit import take_token
+from flaskblog.users.tokens import reset_token
+from flaskblog.signals import user_updated
 
 """
 Imports:
+    hashlib: content hash naming of pictures, used in save_picture
     os: used in save_picture
-    secrets: used in save_picture
+    secrets: temp file names
+    threading, concurrent.futures: picture worker pool
+    time: age of the pictures resize-avatars --prune removes
+    click, flask.cli.with_appcontext: resize-avatars command
     PIL (Pillow): used in save_picture(), resize image
     Flask:
         url_for to manage links properly
     flask_mail: Message, used in send_mail, to send emails
     flaskblog:
-        current_app, mail
+        current_app, db
+    flaskblog.models:
+        User entity class, the picture job sets the new image_file
+    flaskblog.outbox:
+        enqueue, mails are sent by the outbox worker, not in the request
+    flaskblog.ratelimit:
+        take_token, reset mails per address
+    flaskblog.users.tokens:
+        reset_token, single use token of the reset mail
+    flaskblog.signals:
+        user_updated, sent when the new picture is in place
+
+Pictures are named by the hash of the uploaded file, so identical uploads
+share one set of files and a name never points at other content.
+Avatar files, for image_file 'abc.png':
+    abc.png, abc.webp        125px, account page and post page
+    abc_65.png, abc_65.webp  65px, the article-img in listings
+
+Config:
+    AVATAR_PRUNE_AGE: seconds a picture no user has must go unused
+        before resize-avatars --prune removes it
+
+A replaced picture may be shared, or be taken up again by an identical
+upload at any time: the upload finds the files, skips the resizing and
+the user is switched to them a moment later. So pictures are not
+removed when they are replaced. Reusing the files touches them, and
+resize-avatars --prune removes the pictures no user has whose files
+were not touched for AVATAR_PRUNE_AGE, longer than any picture job runs.
 """
 
-def save_picture(form_picture):
-    """Save the picture"""
-    # Randomize the filename to avoid filename collision
-    random_hex = secrets.token_hex(8)
+# (suffix, size) of every avatar variant, the first one is the largest
+AVATAR_VARIANTS = (('', 125), ('_65', 65))
+PICTURE_FORMATS = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG'}
+# upload extension -> extension of the avatar, 16 hex digits and .jpg fit User.image_file
+PICTURE_EXTENSIONS = {'.jpeg': '.jpg'}
+# the picture of users who have not uploaded one, never removed
+DEFAULT_PICTURE = 'default.png'
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+# user id -> future of the picture job, pictures still being processed
+_pending = {}
+
+
+def _pictures_dir():
+    return os.path.join(current_app.root_path, 'static/profile_pics')
+
+
+def check_picture(form_picture):
+    """
+    Cheap checks before a picture is accepted: file size and pixel count.
+    Only the image header is read, nothing is decoded.
+    Raises: ValueError with a message for the user
+    """
+    stream = form_picture.stream
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    if size > current_app.config['AVATAR_MAX_BYTES']:
+        raise ValueError('Picture file is too large.')
+    try:
+        img = Image.open(stream)
+        width, height = img.size
+    except (OSError, Image.DecompressionBombError):
+        raise ValueError('Not a valid picture.')
+    finally:
+        stream.seek(0)
+    if width * height > current_app.config['AVATAR_MAX_PIXELS']:
+        raise ValueError('Picture has too many pixels.')
+
+
+def save_picture(form_picture, user):
+    """
+    Save the upload and queue the resizing, the request does not wait for it.
+    The job sets user.image_file when all variants are written.
+    """
+    # name the picture by its content, identical uploads get the same name
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: form_picture.stream.read(65536), b''):
+        digest.update(chunk)
+    form_picture.stream.seek(0)
     # get extension
     _, f_ext = os.path.splitext(form_picture.filename)
+    f_ext = f_ext.lower()
     # construct picture name and path
-    picture_fn = random_hex + f_ext
-    picture_path = os.path.join(current_app.root_path, 'static/profile_pics', picture_fn)
-    # resize image with Pillow image module
-    output_size = (125, 125)
-    img = Image.open(form_picture)
-    img.thumbnail(output_size)
-    # save resized image
-    img.save(picture_path)
+    picture_fn = digest.hexdigest()[:16] + PICTURE_EXTENSIONS.get(f_ext, f_ext)
+    app = current_app._get_current_object()
+    if _touch_picture(picture_fn, _pictures_dir()):
+        # someone uploaded this picture before, just switch to it
+        upload_path = None
+    else:
+        # keep the raw upload next to the avatars until the job has resized it
+        upload_path = os.path.join(_pictures_dir(), f'.upload-{secrets.token_hex(8)}')
+        form_picture.save(upload_path)
+    _pending[user.id] = _picture_pool(app).submit(
+        _process_picture, app, user.id, upload_path, picture_fn)
     return picture_fn
 
 
+def picture_pending(user):
+    """True while a new picture of user is processed in this process"""
+    future = _pending.get(user.id)
+    return future is not None and not future.done()
+
+
+def avatar_url(image_file, size=None, webp=False):
+    """
+    Url of an avatar variant
+    Args:
+        image_file: User.image_file
+        size: 65 for the listing variant, None for the 125px picture
+        webp: the webp variant instead of the original format
+    """
+    stem, ext = os.path.splitext(image_file)
+    suffix = dict((variant_size, suffix) for suffix, variant_size in AVATAR_VARIANTS)\
+        .get(size, '')
+    return url_for('static', filename=f'profile_pics/{stem}{suffix}{".webp" if webp else ext}')
+
+
+def _picture_pool(app):
+    """Worker pool of this process, Pillow releases the GIL while resizing"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(max_workers=app.config['AVATAR_WORKERS'],
+                                       thread_name_prefix='picture-worker')
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _save_atomic(img, path, img_format):
+    """Write to a temp file and rename, no one ever serves half a picture"""
+    tmp_path = f'{path}.tmp-{secrets.token_hex(4)}'
+    try:
+        img.save(tmp_path, img_format)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def write_variants(source, pictures_dir, picture_fn, max_pixels):
+    """
+    Write every AVATAR_VARIANTS size of source as picture_fn and webp
+    Args:
+        source: path of the original picture
+        pictures_dir: where the variants go
+        picture_fn: avatar name, ie. abc.png
+        max_pixels: refuse pictures above this before decoding them
+    """
+    stem, ext = os.path.splitext(picture_fn)
+    img_format = PICTURE_FORMATS.get(ext, 'PNG')
+    with Image.open(source) as img:
+        # the header is read, the pixels are not decoded yet
+        if img.size[0] * img.size[1] > max_pixels:
+            raise ValueError(f'{img.size} is above the pixel limit')
+        largest = AVATAR_VARIANTS[0][1]
+        # jpeg can decode at 1/2, 1/4 or 1/8 scale, never decode more than needed
+        img.draft('RGB', (largest, largest))
+        img.load()
+        # palette and other modes can't be written as webp/jpeg
+        if img.mode not in ('RGB', 'RGBA', 'L'):
+            img = img.convert('RGBA')
+        if img_format == 'JPEG' and img.mode == 'RGBA':
+            img = img.convert('RGB')
+        for suffix, size in AVATAR_VARIANTS:
+            variant = img.copy()
+            variant.thumbnail((size, size), Image.LANCZOS)
+            path = os.path.join(pictures_dir, f'{stem}{suffix}')
+            _save_atomic(variant, path + ext, img_format)
+            _save_atomic(variant, path + '.webp', 'WEBP')
+
+
+def _variant_paths(picture_fn, pictures_dir):
+    """Paths of every variant of picture_fn"""
+    stem, ext = os.path.splitext(picture_fn)
+    return [os.path.join(pictures_dir, f'{stem}{suffix}{variant_ext}')
+            for suffix, _ in AVATAR_VARIANTS for variant_ext in (ext, '.webp')]
+
+
+def _touch_picture(picture_fn, pictures_dir):
+    """
+    Mark the variants of picture_fn as just used, --prune spares them
+    Returns: False when a variant is missing
+    """
+    try:
+        for path in _variant_paths(picture_fn, pictures_dir):
+            os.utime(path)
+    except OSError:
+        return False
+    return True
+
+
+def _last_used(picture_fn, pictures_dir):
+    """When a variant of picture_fn was last written or touched"""
+    times = [os.path.getmtime(path) for path in _variant_paths(picture_fn, pictures_dir)
+             if os.path.exists(path)]
+    return max(times, default=0)
+
+
+def _remove_picture(picture_fn, pictures_dir):
+    """Delete every variant of picture_fn"""
+    for path in _variant_paths(picture_fn, pictures_dir):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _process_picture(app, user_id, upload_path, picture_fn):
+    """
+    Picture job: resize and switch the user to the new picture, the old
+    one is left to resize-avatars --prune.
+    upload_path is None when the variants of picture_fn already exist
+    """
+    with app.app_context():
+        pictures_dir = _pictures_dir()
+        try:
+            if upload_path is not None:
+                write_variants(upload_path, pictures_dir, picture_fn,
+                               app.config['AVATAR_MAX_PIXELS'])
+            elif not _touch_picture(picture_fn, pictures_dir):
+                # pruned since the upload found it, the user keeps the old picture
+                app.logger.warning('Picture %s of user %s was removed before use',
+                                   picture_fn, user_id)
+                return
+            user = User.query.get(user_id)
+            if user.image_file == picture_fn:
+                return
+            user.image_file = picture_fn
+            user.version += 1
+            db.session.commit()
+            user_updated.send(app, user=user)
+        except Exception:  # pylint: disable=broad-except
+            app.logger.exception('Processing picture of user %s failed', user_id)
+            db.session.rollback()
+        finally:
+            db.session.remove()
+            if upload_path is not None:
+                os.remove(upload_path)
+
+
+def _originals(pictures_dir):
+    """Names of the pictures in pictures_dir, without variants and unfinished uploads"""
+    for name in sorted(os.listdir(pictures_dir)):
+        stem, ext = os.path.splitext(name)
+        if ext.lower() not in PICTURE_FORMATS or stem.startswith('.') \
+                or any(suffix and stem.endswith(suffix) for suffix, _ in AVATAR_VARIANTS):
+            continue
+        yield name
+
+
+def prune_pictures(pictures_dir, max_age):
+    """
+    Remove the pictures no user has that were not used for max_age seconds
+    Returns: the names of the removed pictures
+    """
+    # the times first: a picture taken up after the query was touched before its
+    # commit, it is younger than max_age
+    last_used = {name: _last_used(name, pictures_dir) for name in _originals(pictures_dir)}
+    in_use = {image_file for image_file, in db.session.query(User.image_file).distinct()}
+    cutoff = time.time() - max_age
+    removed = []
+    for name, used in last_used.items():
+        if name == DEFAULT_PICTURE or name in in_use or used > cutoff:
+            continue
+        # touched since the times were taken, ie. by an upload just now
+        if _last_used(name, pictures_dir) > cutoff:
+            continue
+        _remove_picture(name, pictures_dir)
+        removed.append(name)
+    return removed
+
+
+@click.command('resize-avatars')
+@click.option('--prune', is_flag=True,
+              help='Also remove pictures no user has and unused for AVATAR_PRUNE_AGE.')
+@with_appcontext
+def resize_avatars_command(prune):
+    """Write missing avatar variants of the pictures in profile_pics."""
+    pictures_dir = _pictures_dir()
+    if prune:
+        for name in prune_pictures(pictures_dir, current_app.config['AVATAR_PRUNE_AGE']):
+            click.echo(f'removed {name}')
+    for name in _originals(pictures_dir):
+        stem, _ = os.path.splitext(name)
+        if all(os.path.exists(os.path.join(pictures_dir, f'{stem}{suffix}.webp'))
+               for suffix, _ in AVATAR_VARIANTS):
+            continue
+        write_variants(os.path.join(pictures_dir, name), pictures_dir, name,
+                       current_app.config['AVATAR_MAX_PIXELS'])
+        click.echo(f'resized {name}')
+
+
 def send_reset_email(user):
-    """send email to user with reset token"""
+    """
+    send email to user with reset token, at most RESET_EMAIL_LIMIT per address
+    Returns: False when the mail was dropped by the limit
+    """
+    if take_token('reset_email', user.email.lower(), current_app.config['RESET_EMAIL_LIMIT']):
+        # the route answers the same either way, the limit tells nothing
+        current_app.logger.info('reset mail to user %s dropped by RESET_EMAIL_LIMIT', user.id)
+        return False
     # get token:
-    token = user.get_reset_token()
+    token = reset_token(user)
     # Message(title, sender,
     msg = Message('Password reset request',
                   sender='noreply@demo.com',
@@ -55,4 +356,6 @@ To reset your password, click this link: {url_for('users.reset_token', token=tok
 
 If you did not request this, just ignore this email!
 '''
-    # mail.send(msg)
+    # store in the outbox, the smtp handshake happens off the request path
+    enqueue(msg)
+    return True
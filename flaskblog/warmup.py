@@ -0,0 +1,147 @@
+"""
+Worker warm-up
+    init_app(app): template bytecode cache of the app
+    warm_up(app): load the templates, build the url map, open the db connections, GET a few pages
+    load_templates(app): compile every template, {name: seconds}
+    open_connections(app): fill the connection pools
+    precompile_templates_command: flask precompile-templates
+"""
+import os
+import time
+import click
+from flask import current_app, url_for
+from flask.cli import with_appcontext
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy.pool import QueuePool
+from flaskblog import db
+
+"""
+Imports:
+    os: cache directory
+    time: perf_counter, warm-up timings
+    click, flask.cli.with_appcontext: precompile-templates command
+    Flask:
+        current_app, config, logger and jinja_env
+        url_for, builds the url adapter of the url map
+    jinja2: FileSystemBytecodeCache, compiled templates on disk
+    sqlalchemy.pool: QueuePool, how many connections the pool keeps
+    flaskblog: db, engines of the primary and the replicas
+
+Config:
+    TEMPLATE_BYTECODE_CACHE: keep compiled templates on disk
+    TEMPLATE_CACHE_DIR: where, None is jinja's per user temp directory
+    WARM_UP: warm up in create_app, before the worker takes requests
+    WARM_UP_PATHS: pages requested by the warm-up, through the test client
+
+Jinja compiles a template to python code the first time each process
+renders it, tens of ms for layout.html and its children. With the
+bytecode cache only the first process after a template change compiles
+it, the others load the code from TEMPLATE_CACHE_DIR. flask
+precompile-templates fills the cache at build time. The cache is keyed
+on the template's path and checked against its source, so a stale entry
+is recompiled, never served.
+
+Warm-up moves the rest of the first request's one-time work into
+create_app: loading the templates, building the url map's rules,
+opening the pooled database connections and requesting a few public
+pages, which primes what only a real request touches (the first
+statements of each query, lazy imports, the sidebar's snapshots).
+Connections opened before a fork must not be shared by the children:
+server.py closes them in the master once the app is loaded and each
+worker opens its own after the fork.
+"""
+
+
+def init_app(app):
+    """Install the template bytecode cache when TEMPLATE_BYTECODE_CACHE is on"""
+    if not app.config['TEMPLATE_BYTECODE_CACHE']:
+        return
+    directory = app.config['TEMPLATE_CACHE_DIR']
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # templates are loaded on first render, after create_app set the cache
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+
+def load_templates(app):
+    """Compile (or load from the bytecode cache) every template of app, {name: seconds}"""
+    timings = {}
+    for name in app.jinja_env.list_templates():
+        started = time.perf_counter()
+        app.jinja_env.get_template(name)
+        timings[name] = time.perf_counter() - started
+    return timings
+
+
+def open_connections(app):
+    """Open the pooled connections of every engine, {bind: connections}"""
+    opened = {}
+    with app.app_context():
+        for bind in [None] + list(app.config.get('SQLALCHEMY_BINDS') or {}):
+            engine = db.get_engine(app, bind=bind)
+            size = engine.pool.size() if isinstance(engine.pool, QueuePool) else 1
+            connections = [engine.connect() for _ in range(size)]
+            for connection in connections:
+                connection.execute('SELECT 1')
+            # back into the pool, open and with their pragmas set
+            for connection in connections:
+                connection.close()
+            opened[bind or 'primary'] = size
+    return opened
+
+
+def _build_urls(app):
+    with app.test_request_context('/'):
+        # matching sorts the rules, building compiles their converters
+        app.url_map.bind('localhost').match('/')
+        for rule in app.url_map.iter_rules():
+            if not rule.arguments:
+                url_for(rule.endpoint)
+
+
+def _get_pages(app):
+    """GET WARM_UP_PATHS: the queries, imports and caches only a real request touches"""
+    client = app.test_client()
+    for path in app.config['WARM_UP_PATHS']:
+        status = client.get(path).status_code
+        if status != 200:
+            app.logger.warning('warm-up GET %s: %s', path, status)
+
+
+def warm_up(app):
+    """
+    Do the one-time work of the first requests now. A failing step is
+    logged, the worker starts anyway and does that work on demand.
+    Returns: {step: seconds}
+    """
+    timings = {}
+    for step, func in (('templates', load_templates), ('urls', _build_urls),
+                       ('db', open_connections), ('pages', _get_pages)):
+        started = time.perf_counter()
+        try:
+            func(app)
+        except Exception:  # pylint: disable=broad-except
+            app.logger.exception('warm-up step %s failed', step)
+        timings[step] = time.perf_counter() - started
+    app.logger.info('warmed up in %s', ', '.join(f'{step} {seconds * 1000:.0f}ms'
+                                                  for step, seconds in timings.items()))
+    return timings
+
+
+@click.command('precompile-templates')
+@click.option('--directory', type=click.Path(file_okay=False),
+              help='Bytecode cache to fill. Default: TEMPLATE_CACHE_DIR.')
+@with_appcontext
+def precompile_templates_command(directory):
+    """Compile every template into the bytecode cache, ie. at build time."""
+    app = current_app._get_current_object()
+    directory = directory or app.config['TEMPLATE_CACHE_DIR']
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # an entry left by an older build is replaced, its source checksum differs
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+    timings = load_templates(app)
+    for name, seconds in sorted(timings.items()):
+        click.echo(f'{name:<30} {seconds * 1000:6.1f}ms')
+    click.echo(f'{len(timings)} templates compiled into '
+               f'{app.jinja_env.bytecode_cache.directory}')
@@ -1,11 +1,49 @@
 """
 Main application
+    python run.py: development server, debugger and reloader
+    python run.py --production: prefork server, see flaskblog/server.py
+    FLASK_APP=run.py flask ...: the cli commands
 """
+import argparse
+from werkzeug.serving import is_running_from_reloader
 from flaskblog import create_app
+from flaskblog.outbox import start_worker
+
+"""
+Imports:
+    argparse: command line options
+    werkzeug.serving: is_running_from_reloader, the process serving the requests
+    flaskblog: create_app, app factory
+    flaskblog.outbox: start_worker, the development server sends the mail outbox
+"""
+
+
+def main():
+    """Start the development or the production server"""
+    parser = argparse.ArgumentParser(description='Run the blog.')
+    parser.add_argument('--production', action='store_true',
+                        help='Prefork server, app loaded once before forking.')
+    parser.add_argument('--bind', help='host:port. Default: 127.0.0.1:5000 for '
+                                       'development, SERVER_BIND for production.')
+    parser.add_argument('--workers', type=int, help='Worker processes. Default: SERVER_WORKERS.')
+    args = parser.parse_args()
+    if args.production:
+        # imported here, gunicorn does not run on windows
+        from flaskblog.server import run
+        run(bind=args.bind, workers=args.workers)
+    else:
+        host, _, port = (args.bind or '127.0.0.1:5000').rpartition(':')
+        # create app from factory function
+        # pass in configs, no args use default
+        app = create_app()
+        # the reloader's child serves the requests, the parent only restarts it
+        if is_running_from_reloader():
+            start_worker(app)
+        app.run(host=host, port=int(port), debug=True)
 
-# create app from factory function
-# pass in configs, no args use default
-app = create_app()
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    main()
+else:
+    # the flask cli imports run.py for the app
+    app = create_app()
@@ -0,0 +1,135 @@
+"""
+Test fixtures
+    create_test_app(**config): app of TestingConfig and config, with the seeded site
+    app: app of TestingConfig, in-memory database with the seeded site
+    client: test client of app
+    cached_app, cached_client: the same with the page cache on
+    count_queries(path): GET path, the sql statements it ran
+    seed_site(users, posts_per_user, name): insert users and their posts
+"""
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import event
+from flaskblog import create_app, db
+from flaskblog.config import TestingConfig
+from flaskblog.models import Post, User
+from flaskblog.posts.utils import render_post
+from flaskblog.users.hashing import hash_password
+
+"""
+Imports:
+    datetime, timedelta: date_posted of the seeded posts
+    pytest: fixtures
+    sqlalchemy.event: before_cursor_execute, the statement counter
+    flaskblog:
+        create_app, db
+        config.TestingConfig: in-memory database, no background threads,
+            page cache and rate limits off
+        models: User and Post entity classes
+        posts.utils.render_post: derived columns of the seeded posts
+        users.hashing.hash_password: the seeded users can log in
+
+The seeded site: USERS users named user1, user2, ... with the password
+PASSWORD, each with POSTS_PER_USER posts. The posts are an hour apart and
+the authors take turns, so every page of the home feed shows several
+authors, which is what an N+1 query on post.author would multiply.
+"""
+
+USERS = 3
+POSTS_PER_USER = 6
+PASSWORD = 'testing'
+# the newest seeded post
+NEWEST = datetime(2024, 3, 1, 12, 0)
+
+
+def seed_site(users=USERS, posts_per_user=POSTS_PER_USER, name='user', newest=NEWEST):
+    """
+    Insert users named name1, name2, ... and their posts, the newest
+    posted at newest. Must run in an app context.
+    Returns: the users
+    """
+    hashed = hash_password(PASSWORD)
+    authors = [User(username=f'{name}{n}', email=f'{name}{n}@example.com', password=hashed)
+               for n in range(1, users + 1)]
+    db.session.add_all(authors)
+    total = users * posts_per_user
+    for n in range(total):
+        post = Post(title=f'Post {n + 1} by {name}',
+                    content=f'Content of post {n + 1}.\n\nSecond paragraph.',
+                    author=authors[n % users],
+                    date_posted=newest - timedelta(hours=total - 1 - n))
+        post.date_modified = post.date_posted
+        render_post(post)
+        db.session.add(post)
+    db.session.commit()
+    return authors
+
+
+def create_test_app(**config):
+    """App of TestingConfig with config overriding its settings, and the seeded site"""
+    app = create_app(type('TestConfig', (TestingConfig,), config))
+    with app.app_context():
+        db.create_all()
+        seed_site()
+        # the requests of the test start with a fresh session
+        db.session.remove()
+    return app
+
+
+def _drop(app):
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def app():
+    """App of TestingConfig with the seeded site"""
+    app = create_test_app()
+    yield app
+    _drop(app)
+
+
+@pytest.fixture
+def client(app):
+    """Test client of app"""
+    return app.test_client()
+
+
+@pytest.fixture
+def cached_app():
+    """App with the in-process page cache"""
+    app = create_test_app(PAGE_CACHE_TYPE='lru')
+    yield app
+    _drop(app)
+
+
+@pytest.fixture
+def cached_client(cached_app):
+    """Test client of cached_app"""
+    return cached_app.test_client()
+
+
+@pytest.fixture
+def count_queries(app, client):
+    """
+    count_queries(path): GET path and read the whole (streamed) body
+    Returns: (response, number of sql statements)
+    """
+    with app.app_context():
+        engine = db.engine
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    def get(path):
+        statements.clear()
+        response = client.get(path)
+        # a streamed page reads its posts while the body is sent
+        response.get_data()
+        return response, len(statements)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    yield get
+    event.remove(engine, 'before_cursor_execute', before_cursor_execute)
@@ -0,0 +1,37 @@
+"""
+Json api
+    Post ids outside the range of the database are client errors.
+"""
+import pytest
+
+HUGE = 99999999999999999999
+
+
+def test_post_by_id(client):
+    response = client.get('/api/posts/18')
+    assert response.status_code == 200
+    assert response.get_json()['id'] == 18
+
+
+@pytest.mark.parametrize('post_id', [0, 2 ** 63, HUGE])
+def test_post_id_out_of_range(client, post_id):
+    response = client.get(f'/api/posts/{post_id}')
+    assert response.status_code == 404
+    assert response.get_json()['error'] == 'Not Found'
+
+
+def test_batch(client):
+    response = client.get('/api/posts/batch?ids=18,1,404')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert [post['id'] for post in data['posts']] == [18, 1]
+    assert data['missing'] == [404]
+
+
+@pytest.mark.parametrize('ids', [f'1,{HUGE}', '0', '-1', str(2 ** 63)])
+def test_batch_ids_out_of_range(client, ids):
+    response = client.get(f'/api/posts/batch?ids={ids}')
+    assert response.status_code == 400
+    response = client.post('/api/posts/batch',
+                           json={'ids': [int(post_id) for post_id in ids.split(',')]})
+    assert response.status_code == 400
@@ -0,0 +1,63 @@
+"""
+Counter rows upserted by concurrent transactions
+    The UPDATE of a transaction misses the row another one inserts right
+    after it, the INSERT then fails on the key and the count is added to
+    the other transaction's row.
+"""
+from datetime import datetime
+from sqlalchemy.sql.dml import Update
+from flaskblog import db
+from flaskblog.archive.utils import ALL_AUTHORS, add_month_counts
+from flaskblog.models import ChangeCounter, PostMonthCount
+from flaskblog.posts.hotfeed import COUNTER, bump_version
+
+
+class RacingConnection:
+    """
+    Connection of a transaction whose first UPDATE finds no row, a
+    concurrent transaction inserts the row right after that UPDATE
+    """
+
+    def __init__(self, connection, concurrent):
+        self._connection = connection
+        self._concurrent = concurrent
+
+    def execute(self, statement, *args, **kwargs):
+        result = self._connection.execute(statement, *args, **kwargs)
+        if self._concurrent is not None and isinstance(statement, Update):
+            self._concurrent(self._connection)
+            self._concurrent = None
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+def test_add_month_counts_row_inserted_concurrently(app):
+    with app.app_context():
+        connection = db.session.connection()
+        rows = [{'date_posted': datetime(2030, 1, 5), 'user_id': 1}]
+
+        def concurrent(conn):
+            conn.execute(PostMonthCount.__table__.insert().values(
+                year=2030, month=1, user_id=ALL_AUTHORS, count=5))
+
+        add_month_counts(RacingConnection(connection, concurrent), rows)
+        db.session.commit()
+        counts = dict(db.session.query(PostMonthCount.user_id, PostMonthCount.count)
+                      .filter_by(year=2030, month=1))
+    assert counts == {ALL_AUTHORS: 6, 1: 1}
+
+
+def test_bump_version_row_inserted_concurrently(app):
+    with app.app_context():
+        db.session.query(ChangeCounter).delete()
+        connection = db.session.connection()
+
+        def concurrent(conn):
+            conn.execute(ChangeCounter.__table__.insert().values(name=COUNTER, value=7))
+
+        version = bump_version(RacingConnection(connection, concurrent))
+        db.session.commit()
+        assert version == 8
+        assert db.session.query(ChangeCounter.value).filter_by(name=COUNTER).scalar() == 8
@@ -0,0 +1,88 @@
+"""
+Keyset cursors
+    Decoding of the ?cursor= tokens, and paging the listings with them.
+"""
+import base64
+import re
+from datetime import datetime
+import pytest
+from flaskblog.posts.utils import CURSOR_NEXT, decode_cursor, encode_cursor
+from conftest import POSTS_PER_USER, USERS
+
+# what the listings link to
+OLDER_RE = re.compile(r'href="[^"]*\?cursor=([^"&]+)">Older posts')
+NEWER_RE = re.compile(r'href="[^"]*\?cursor=([^"&]+)">Newer posts')
+TITLE_RE = re.compile(r'<a class="article-title" href="/post/(\d+)">')
+
+
+def _token(raw):
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+class _Post:
+    id = 7
+    date_posted = datetime(2024, 3, 1, 12, 30)
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(CURSOR_NEXT, _Post)) == \
+        (CURSOR_NEXT, datetime(2024, 3, 1, 12, 30), 7)
+
+
+@pytest.mark.parametrize('cursor', [
+    '', 'garbage', '%%%',
+    _token('x|2024-03-01T12:30:00|7'),
+    _token('n|yesterday|7'),
+    _token('n|2024-03-01T12:30:00|seven'),
+    _token('n|2024-03-01T12:30:00'),
+    _token('n|2024-03-01T12:30:00|0'),
+    _token('n|2024-03-01T12:30:00|-5'),
+    # beyond a 64 bit INTEGER parameter
+    _token(f'n|2024-03-01T12:30:00|{2 ** 63}'),
+    _token(f'p|2024-03-01T12:30:00|{10 ** 30}'),
+])
+def test_malformed_cursor(cursor):
+    assert decode_cursor(cursor) is None
+
+
+@pytest.mark.parametrize('path', ['/', '/user/user1', '/api/posts', '/archive/2024/3'])
+def test_malformed_cursor_gives_first_page(client, path):
+    first = client.get(path).get_data()
+    response = client.get(f'{path}?cursor={_token(f"n|2024-03-01T12:30:00|{10 ** 30}")}')
+    assert response.status_code == 200
+    assert response.get_data() == first
+
+
+def walk(client, path):
+    """Post ids of every page of path, following Older posts, and the pages' cursors"""
+    pages, cursors = [], []
+    cursor = None
+    while True:
+        html = client.get(f'{path}?cursor={cursor}' if cursor else path).get_data(as_text=True)
+        pages.append([int(post_id) for post_id in TITLE_RE.findall(html)])
+        cursors.append(NEWER_RE.search(html))
+        older = OLDER_RE.search(html)
+        if older is None:
+            return pages, cursors
+        cursor = older.group(1)
+
+
+def test_home_feed_pages(client):
+    pages, cursors = walk(client, '/')
+    posts = [post_id for page in pages for post_id in page]
+    # the seeded posts were inserted oldest first
+    assert posts == list(range(USERS * POSTS_PER_USER, 0, -1))
+    assert [len(page) for page in pages] == [5, 5, 5, 3]
+    # no newer posts than the first page
+    assert cursors[0] is None
+    # back from the last page
+    html = client.get(f'/?cursor={cursors[-1].group(1)}').get_data(as_text=True)
+    assert [int(post_id) for post_id in TITLE_RE.findall(html)] == pages[-2]
+
+
+def test_user_pages(client):
+    pages, _ = walk(client, '/user/user1')
+    # user1 wrote every third post, starting with the first
+    assert [post_id for page in pages for post_id in page] == \
+        list(range(USERS * (POSTS_PER_USER - 1) + 1, 0, -USERS))
+    assert [len(page) for page in pages] == [5, 1]
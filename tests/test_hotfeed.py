@@ -0,0 +1,95 @@
+"""
+Hot feed
+    The home feed paged from the posts kept in memory is the same as the
+    one read from the database, also across the end of the buffer and
+    after posts are added, edited and deleted.
+"""
+import re
+from datetime import timedelta
+import pytest
+from sqlalchemy import event
+from flaskblog import db
+from flaskblog.models import Post, User
+from flaskblog.signals import post_created, post_deleted, post_updated
+from conftest import NEWEST, create_test_app
+from test_cursors import walk
+
+# a statement reading the post table, not post_month_count or post_fts
+POST_SELECT_RE = re.compile(r'FROM post\b(?!_)')
+
+
+@pytest.fixture
+def hot_app():
+    """Hot feed of 8 posts, fewer than the seeded ones"""
+    app = create_test_app(HOT_FEED_SIZE=8, HOT_FEED_CHECK_SECONDS=0)
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def _pages(client):
+    pages, _ = walk(client, '/')
+    return pages, client.get('/latest').get_data()
+
+
+def _change(app, change):
+    """Run change(session) in app and send the signals of the routes"""
+    with app.app_context():
+        signal, post = change(db.session)
+        db.session.commit()
+        signal.send(app, post=post)
+
+
+def _add(session):
+    author = User.query.filter_by(username='user2').first()
+    post = Post(title='Hot post', content='Newest of all.', author=author,
+                date_posted=NEWEST + timedelta(hours=1))
+    session.add(post)
+    return post_created, post
+
+
+def _edit(session):
+    post = Post.query.get(17)
+    post.title = 'Edited title'
+    return post_updated, post
+
+
+def _delete(session):
+    post = Post.query.get(16)
+    session.delete(post)
+    return post_deleted, post
+
+
+def test_hot_feed_pages_match_database(app, client, hot_app):
+    hot_client = hot_app.test_client()
+    assert 'hot_feed' in hot_app.extensions and 'hot_feed' not in app.extensions
+    assert _pages(hot_client) == _pages(client)
+    for change in (_add, _edit, _delete):
+        # the same change in both databases
+        _change(app, change)
+        _change(hot_app, change)
+        pages, latest = _pages(hot_client)
+        assert (pages, latest) == _pages(client)
+    assert b'Hot post' in latest and b'Edited title' in latest
+    assert 16 not in [post_id for page in pages for post_id in page]
+
+
+def test_first_page_reads_no_posts(hot_app):
+    """The first page and the sidebar come from the hot feed"""
+    client = hot_app.test_client()
+    client.get('/').get_data()
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with hot_app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        client.get('/').get_data()
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    assert statements
+    assert not [statement for statement in statements if POST_SELECT_RE.search(statement)]
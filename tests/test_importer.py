@@ -0,0 +1,135 @@
+"""
+Posts importer
+    Imported posts show up on the cached pages, posts saved while an
+    import runs don't stop it.
+"""
+import json
+from flaskblog import db
+from flaskblog.models import Post, User
+from flaskblog.posts import importer
+from flaskblog.posts.importer import import_posts_command
+from flaskblog.search.utils import search_index
+
+
+def get(client, path):
+    response = client.get(path)
+    response.get_data()
+    return response
+
+
+def test_import_invalidates_cached_pages(cached_app, cached_client, tmp_path):
+    # the posts of user2, and the sidebar of every page
+    paths = ['/', '/user/user2', '/latest', '/user/user1']
+    for path in paths:
+        get(cached_client, path)
+        assert get(cached_client, path).headers['X-Cache'] == 'HIT'
+    source = tmp_path / 'posts.jsonl'
+    source.write_text(json.dumps({'title': 'Imported post', 'content': 'Imported.',
+                                  'user_id': 2, 'date_posted': '2030-01-01T00:00:00'}) + '\n')
+    result = cached_app.test_cli_runner().invoke(import_posts_command, [str(source)])
+    assert result.exit_code == 0, result.output
+    for path in paths:
+        response = get(cached_client, path)
+        assert response.headers['X-Cache'] == 'MISS'
+        assert b'Imported post' in response.data
+
+
+def write_jsonl(path, rows):
+    path.write_text(''.join(json.dumps(row) + '\n' for row in rows))
+    return str(path)
+
+
+def imported_row(n):
+    return {'title': f'Imported {n}', 'content': f'Imported words{n}.', 'user_id': 2}
+
+
+def test_post_saved_while_importing(app, tmp_path, monkeypatch):
+    """A post of the site between two batches takes the next id, the import goes on"""
+    source = write_jsonl(tmp_path / 'posts.jsonl', [imported_row(n) for n in range(1, 4)])
+    validate_row = importer.validate_row
+
+    def validate_then_post(row, user_ids):
+        if row['title'] == 'Imported 2':
+            # a post of the site, committed after the first batch
+            author = User.query.filter_by(username='user1').first()
+            db.session.add(Post(title='Live post', content='Live.', author=author))
+            db.session.commit()
+        return validate_row(row, user_ids)
+
+    monkeypatch.setattr(importer, 'validate_row', validate_then_post)
+    result = app.test_cli_runner().invoke(import_posts_command, [source, '--batch-size', '1'])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        titles = [title for title, in db.session.query(Post.title).order_by(Post.id)[-4:]]
+        assert titles == ['Imported 1', 'Live post', 'Imported 2', 'Imported 3']
+        # indexed under the ids the posts got
+        for n in range(1, 4):
+            total, hits = search_index().search(f'words{n}')
+            assert total == 1
+            assert Post.query.get(hits[0][0]).title == f'Imported {n}'
+
+
+def test_malformed_jsonl_line_skipped(app, tmp_path, caplog):
+    source = tmp_path / 'posts.jsonl'
+    source.write_text(json.dumps(imported_row(1)) + '\n{"title": "Broken\n'
+                      + json.dumps(imported_row(3)) + '\n')
+    result = app.test_cli_runner().invoke(import_posts_command, [str(source)])
+    assert result.exit_code == 0, result.output
+    assert '2 posts imported, 1 skipped' in result.output
+    assert 'row 2 skipped: malformed json' in caplog.text
+
+
+def test_malformed_json_item_stops_at_once(app, tmp_path, monkeypatch):
+    """The items after a malformed one are not read into memory"""
+    monkeypatch.setattr(importer, 'CHUNK_SIZE', 64)
+    good = json.dumps(imported_row(1))
+    source = tmp_path / 'posts.json'
+    # a missing comma between two keys of the second item
+    source.write_text('{"posts": [' + good + ', {"title": "x" "content": "y"}, '
+                      + ', '.join([good] * 1000) + ']}')
+    reads = []
+    real_open = open
+
+    def counting_open(*args, **kwargs):
+        json_file = real_open(*args, **kwargs)
+        read = json_file.read
+
+        def counted_read(size=-1):
+            chunk = read(size)
+            reads.append(len(chunk))
+            return chunk
+        json_file.read = counted_read
+        return json_file
+
+    monkeypatch.setattr(importer, 'open', counting_open, raising=False)
+    result = app.test_cli_runner().invoke(import_posts_command, [str(source)])
+    assert result.exit_code == 1
+    offset = len('{"posts": [' + good + ', {"title": "x" ')
+    assert f'malformed json at character {offset}' in result.output
+    assert sum(reads) < 4 * 64
+
+
+def test_checkpoint_committed_with_the_batch(app, tmp_path, monkeypatch):
+    """A run stopped right after a batch's commit is resumed without duplicates"""
+    source = write_jsonl(tmp_path / 'posts.jsonl', [imported_row(n) for n in range(1, 6)])
+    invalidate = importer.page_cache.invalidate
+    batches = []
+
+    def invalidate_then_crash(*tags):
+        invalidate(*tags)
+        batches.append(tags)
+        if len(batches) == 2:
+            raise RuntimeError('killed')
+
+    monkeypatch.setattr(importer.page_cache, 'invalidate', invalidate_then_crash)
+    runner = app.test_cli_runner()
+    result = runner.invoke(import_posts_command, [source, '--batch-size', '2', '--checkpoint'])
+    assert isinstance(result.exception, RuntimeError)
+    monkeypatch.setattr(importer.page_cache, 'invalidate', invalidate)
+    result = runner.invoke(import_posts_command, [source, '--batch-size', '2', '--checkpoint'])
+    assert result.exit_code == 0, result.output
+    assert 'done: 1 posts imported' in result.output
+    with app.app_context():
+        titles = [title for title, in db.session.query(Post.title).filter(
+            Post.title.like('Imported %')).order_by(Post.id)]
+        assert titles == [f'Imported {n}' for n in range(1, 6)]
@@ -0,0 +1,182 @@
+"""
+Mail outbox
+    Delivery over SMTP to a stand-in server on localhost, retries and
+    giving up, the claim of messages whose sender died, and the sender
+    started with the process.
+"""
+import socketserver
+import threading
+import time
+from datetime import datetime, timedelta
+import pytest
+from flask_mail import Message
+from flaskblog import db
+from flaskblog.models import OutboxMessage
+from flaskblog import outbox
+from flaskblog.outbox import SEND_LEASE, _claim, deliver_batch, enqueue, start_worker
+from conftest import create_test_app
+
+# recipients the stand-in server refuses
+REFUSED = 'refused@example.com'
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """The commands smtplib sends for a plain (no tls, no login) session"""
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost stand-in')
+        recipients = []
+        while True:
+            line = self.rfile.readline().decode('utf-8').rstrip('\r\n')
+            command = line[:4].upper()
+            if not line or command == 'QUIT':
+                self.reply('221 bye')
+                return
+            if command in ('EHLO', 'HELO'):
+                self.reply('250 localhost')
+            elif command == 'RCPT':
+                address = line.split(':', 1)[1].strip(' <>')
+                if address == REFUSED:
+                    self.reply('550 no such user')
+                else:
+                    recipients.append(address)
+                    self.reply('250 ok')
+            elif command == 'DATA':
+                self.reply('354 end with .')
+                data = []
+                for data_line in iter(self.rfile.readline, b''):
+                    if data_line in (b'.\r\n', b'.\n'):
+                        break
+                    data.append(data_line)
+                self.server.messages.append((recipients, b''.join(data).decode('utf-8')))
+                recipients = []
+                self.reply('250 queued')
+            elif command == 'RSET':
+                recipients = []
+                self.reply('250 ok')
+            else:
+                # MAIL, NOOP
+                self.reply('250 ok')
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    """Stand-in SMTP server, keeps the messages it was sent"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('localhost', 0), SMTPHandler)
+        self.connections = 0
+        self.messages = []
+
+
+@pytest.fixture
+def smtp_server():
+    server = SMTPServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def mail_app(smtp_server):
+    """App sending to smtp_server"""
+    app = create_test_app(MAIL_SERVER='localhost', MAIL_PORT=smtp_server.server_address[1],
+                          MAIL_USE_TLS=False, MAIL_USE_SSL=False, MAIL_USERNAME=None,
+                          MAIL_PASSWORD=None, MAIL_SUPPRESS_SEND=False,
+                          MAIL_OUTBOX_MAX_ATTEMPTS=3, MAIL_OUTBOX_BACKOFF=30)
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def _enqueue(recipient, subject='Password reset request'):
+    return enqueue(Message(subject, sender='noreply@demo.com', recipients=[recipient],
+                           body='To reset your password, click this link.'))
+
+
+def _rows():
+    db.session.expire_all()
+    return {row.recipients: row for row in OutboxMessage.query}
+
+
+def test_batch_sent_over_one_connection(mail_app, smtp_server):
+    for n in range(3):
+        _enqueue(f'user{n}@example.com')
+    assert deliver_batch() == 3
+    assert smtp_server.connections == 1
+    assert sorted(recipients[0] for recipients, _ in smtp_server.messages) == \
+        ['user0@example.com', 'user1@example.com', 'user2@example.com']
+    assert 'Subject: Password reset request' in smtp_server.messages[0][1]
+    for row in _rows().values():
+        assert (row.status, row.attempts) == ('sent', 1)
+        assert row.sent_at is not None
+    # nothing due anymore
+    assert deliver_batch() == 0
+
+
+def test_refused_message_retried_then_failed(mail_app, smtp_server):
+    _enqueue(REFUSED)
+    _enqueue('user1@example.com')
+    assert deliver_batch() == 2
+    rows = _rows()
+    assert rows['user1@example.com'].status == 'sent'
+    refused = rows[REFUSED]
+    assert (refused.status, refused.attempts) == ('pending', 1)
+    assert '550' in refused.last_error
+    # the first retry waits MAIL_OUTBOX_BACKOFF
+    assert refused.next_attempt_at > datetime.utcnow() + timedelta(seconds=20)
+    for attempts in (2, 3):
+        refused.next_attempt_at = datetime.utcnow()
+        db.session.commit()
+        assert deliver_batch() == 1
+        refused = _rows()[REFUSED]
+        assert refused.attempts == attempts
+    assert refused.status == 'failed'
+    assert len(smtp_server.messages) == 1
+
+
+def test_expired_lease_counts_as_attempt(mail_app, smtp_server):
+    """A sender that dies after the claim, again and again, does not retry forever"""
+    _enqueue('user1@example.com')
+    for attempts in (1, 2, 3):
+        # claimed, then the worker is gone until the lease ends
+        assert len(_claim(10)) == 1
+        row = _rows()['user1@example.com']
+        assert (row.status, row.attempts) == ('sending', attempts)
+        assert row.next_attempt_at > datetime.utcnow() + timedelta(seconds=SEND_LEASE - 10)
+        row.next_attempt_at = datetime.utcnow()
+        db.session.commit()
+    assert _claim(10) == []
+    row = _rows()['user1@example.com']
+    assert row.status == 'failed'
+    assert deliver_batch() == 0
+    assert smtp_server.connections == 0
+
+
+def test_worker_started_with_the_process_sends_the_backlog(mail_app, smtp_server, monkeypatch):
+    """Messages an earlier process left pending go out without a new enqueue"""
+    db.session.add(OutboxMessage(subject='Left over', sender='noreply@demo.com',
+                                 recipients='user1@example.com', body='Queued before a restart.'))
+    db.session.commit()
+    assert start_worker(mail_app) is None
+    monkeypatch.setitem(mail_app.config, 'MAIL_OUTBOX_WORKER', True)
+    monkeypatch.setattr(outbox, '_worker', None)
+    worker = start_worker(mail_app)
+    try:
+        deadline = time.monotonic() + 5
+        while not smtp_server.messages and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        worker.stop()
+        worker.join(5)
+    assert not worker.is_alive()
+    assert [recipients for recipients, _ in smtp_server.messages] == [['user1@example.com']]
+    assert _rows()['user1@example.com'].status == 'sent'
@@ -0,0 +1,119 @@
+"""
+Page cache
+    Hits and misses of the cached pages, invalidation by the tags.
+"""
+import pytest
+from flaskblog import db, page_cache
+from flaskblog.models import User
+from flaskblog.signals import user_updated
+from flaskblog.main import routes as main_routes
+from conftest import PASSWORD
+
+
+PAGES = ['/', '/?page=2', '/latest', '/post/18', '/user/user1', '/archive/2024/3']
+
+
+def get(client, path):
+    """GET path and read the whole (streamed) body, which stores it"""
+    response = client.get(path)
+    response.get_data()
+    return response
+
+
+@pytest.mark.parametrize('path', PAGES)
+def test_hit_and_304(cached_app, cached_client, path):
+    """The second view is a hit, a client holding the ETag gets a 304 either way"""
+    first = get(cached_client, path)
+    assert first.headers['X-Cache'] == 'MISS'
+    etag = first.headers['ETag']
+    second = get(cached_client, path)
+    assert second.headers['X-Cache'] == 'HIT'
+    assert second.data == first.data
+    assert second.headers['ETag'] == etag
+    # from the cache
+    response = cached_client.get(path, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    # rendered, the validators are known before the posts are read
+    with cached_app.app_context():
+        page_cache.clear()
+    response = cached_client.get(path, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+
+def test_new_post_invalidates(cached_app, cached_client):
+    """A new post shows on the home page and in the sidebar of the post pages"""
+    pages = ['/', '/latest', '/post/1', '/user/user1']
+    etags = {path: get(cached_client, path).headers['ETag'] for path in pages}
+    author = cached_app.test_client()
+    author.post('/login', data={'email': 'user1@example.com', 'password': PASSWORD})
+    response = author.post('/post/new', data={'title': 'Fresh post', 'content': 'Fresh words'})
+    assert response.status_code == 302
+    for path in pages:
+        response = cached_client.get(path, headers={'If-None-Match': etags[path]})
+        assert response.status_code == 200
+        assert response.headers['X-Cache'] == 'MISS'
+        assert b'Fresh post' in response.data
+    # rendered again and stored
+    assert get(cached_client, '/post/1').headers['X-Cache'] == 'HIT'
+
+
+@pytest.mark.parametrize('tag', ['sidebar', 'post:18', 'user:3'])
+def test_streamed_page_invalidated_while_rendering(cached_app, cached_client, monkeypatch, tag):
+    """A change committed after the posts were read leaves no stale page in the cache"""
+    keyset_paginate = main_routes.keyset_paginate
+
+    def read_then_change(*args, **kwargs):
+        posts = keyset_paginate(*args, **kwargs)
+        # what the signals of a post or user saved right now do
+        page_cache.invalidate(tag)
+        return posts
+
+    monkeypatch.setattr(main_routes, 'keyset_paginate', read_then_change)
+    assert get(cached_client, '/').headers['X-Cache'] == 'MISS'
+    monkeypatch.setattr(main_routes, 'keyset_paginate', keyset_paginate)
+    assert get(cached_client, '/').headers['X-Cache'] == 'MISS'
+    assert get(cached_client, '/').headers['X-Cache'] == 'HIT'
+
+
+@pytest.mark.parametrize('tag', ['sidebar', 'post:18', 'user:3'])
+def test_page_invalidated_while_rendering(cached_app, cached_client, monkeypatch, tag):
+    """The same for a page rendered whole"""
+    keyset_paginate = main_routes.keyset_paginate
+
+    def read_then_change(*args, **kwargs):
+        posts = keyset_paginate(*args, **kwargs)
+        page_cache.invalidate(tag)
+        return posts
+
+    monkeypatch.setattr(main_routes, 'keyset_paginate', read_then_change)
+    assert get(cached_client, '/latest').headers['X-Cache'] == 'MISS'
+    monkeypatch.setattr(main_routes, 'keyset_paginate', keyset_paginate)
+    assert get(cached_client, '/latest').headers['X-Cache'] == 'MISS'
+    assert get(cached_client, '/latest').headers['X-Cache'] == 'HIT'
+
+
+def _rename(app, username, new_name):
+    """What the account route does when a user changes their name"""
+    with app.app_context():
+        user = User.query.filter_by(username=username).first()
+        user.username = new_name
+        user.version += 1
+        db.session.commit()
+        user_updated.send(app, user=user)
+
+
+@pytest.mark.parametrize('path', ['/post/18', '/latest', '/archive/2024/3'])
+def test_no_304_by_date_after_author_change(cached_app, cached_client, path):
+    """The posts are unchanged, their author's name is not"""
+    response = get(cached_client, path)
+    assert 'Last-Modified' not in response.headers
+    _rename(cached_app, 'user3', 'renamed3')
+    response = cached_client.get(path, headers={
+        'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT',
+        'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 200
+    assert b'renamed3' in response.data
+    response = cached_client.get(path, headers={
+        'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+    assert response.status_code == 200
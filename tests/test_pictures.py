@@ -0,0 +1,53 @@
+"""
+Profile pictures
+    Pruning of the pictures no user has, and which of them are served as immutable.
+"""
+import os
+import time
+from flaskblog import db
+from flaskblog.models import User
+from flaskblog.users.utils import AVATAR_VARIANTS, prune_pictures
+
+
+def _write_picture(pictures_dir, picture_fn, age):
+    """Empty variant files of picture_fn, last used age seconds ago"""
+    stem, ext = os.path.splitext(picture_fn)
+    used = time.time() - age
+    for suffix, _ in AVATAR_VARIANTS:
+        for variant_ext in (ext, '.webp'):
+            path = os.path.join(pictures_dir, f'{stem}{suffix}{variant_ext}')
+            open(path, 'wb').close()
+            os.utime(path, (used, used))
+
+
+def test_prune_pictures(app, tmp_path):
+    pictures_dir = str(tmp_path)
+    _write_picture(pictures_dir, 'default.png', 3600)
+    _write_picture(pictures_dir, '0000000000000001.png', 3600)
+    _write_picture(pictures_dir, '0000000000000002.jpg', 3600)
+    _write_picture(pictures_dir, '0000000000000003.png', 10)
+    with app.app_context():
+        User.query.filter_by(username='user1').update({'image_file': '0000000000000001.png'})
+        db.session.commit()
+        removed = prune_pictures(pictures_dir, 600)
+    # in use, recently used (ie. by an upload not yet committed) and the default stay
+    assert removed == ['0000000000000002.jpg']
+    assert sorted(os.listdir(pictures_dir)) == sorted(
+        f'{stem}{suffix}{ext}'
+        for stem, original in (('default', '.png'), ('0000000000000001', '.png'),
+                               ('0000000000000003', '.png'))
+        for suffix, _ in AVATAR_VARIANTS for ext in (original, '.webp'))
+
+
+def test_default_picture_not_immutable(client):
+    response = client.get('/static/profile_pics/default.png')
+    assert response.status_code == 200
+    assert 'immutable' not in response.headers.get('Cache-Control', '')
+    response = client.get('/static/profile_pics/default_65.webp')
+    assert 'immutable' not in response.headers.get('Cache-Control', '')
+
+
+def test_avatar_immutable(client):
+    response = client.get('/static/profile_pics/24081870d18747ca_65.webp')
+    assert response.status_code == 200
+    assert 'immutable' in response.headers['Cache-Control']
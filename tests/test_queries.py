@@ -0,0 +1,38 @@
+"""
+Query counts of the listing pages
+    Each page runs a fixed number of statements, however many posts and
+    authors it lists. One more statement per post (post.author loaded
+    lazily) fails these tests.
+"""
+from datetime import timedelta
+import pytest
+from flaskblog import db
+from conftest import NEWEST, seed_site
+
+# statements per page: the posts with their authors, the sidebar's newest
+# posts and archive counts, the version counter (validators and archive
+# snapshot); a user's page reads the user, ?page= the COUNT of the pagination
+MAX_QUERIES = {
+    '/': 5,
+    '/?page=2': 6,
+    '/user/user1': 6,
+    '/user/user1?page=2': 7,
+}
+
+
+@pytest.mark.parametrize('path', sorted(MAX_QUERIES))
+def test_listing_query_count(count_queries, path):
+    response, queries = count_queries(path)
+    assert response.status_code == 200
+    assert queries <= MAX_QUERIES[path], f'{path} ran {queries} statements'
+
+
+def test_query_count_independent_of_authors(app, count_queries):
+    """A first page of five new authors runs as many statements as before"""
+    _, before = count_queries('/')
+    with app.app_context():
+        seed_site(users=5, posts_per_user=1, name='author', newest=NEWEST + timedelta(days=1))
+        db.session.remove()
+    response, after = count_queries('/')
+    assert b'Post 5 by author' in response.data
+    assert after == before
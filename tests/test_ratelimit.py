@@ -0,0 +1,74 @@
+"""
+Rate limits
+    Lockout of an account after failed logins, and the token buckets of
+    the limited routes.
+"""
+import pytest
+from flaskblog import db
+from conftest import PASSWORD, create_test_app
+
+
+@pytest.fixture
+def limited_app():
+    """The limits of Config, kept per process"""
+    app = create_test_app(RATE_LIMIT_STORE='memory', LOGIN_LOCKOUT_FAILURES=3)
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def login(client, email, password, address='10.0.0.1'):
+    return client.post('/login', data={'email': email, 'password': password},
+                       environ_base={'REMOTE_ADDR': address})
+
+
+def test_login_lockout(limited_app):
+    client = limited_app.test_client()
+    for _ in range(3):
+        response = login(client, 'user1@example.com', 'wrong')
+        assert response.status_code == 200
+        assert b'Login failed' in response.data
+    # locked: not even the right password is checked
+    response = login(client, 'user1@example.com', PASSWORD)
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) > 0
+    # the email is the key, in any case
+    assert login(client, 'USER1@example.com', PASSWORD).status_code == 429
+    # other accounts are not locked
+    response = login(client, 'user2@example.com', PASSWORD)
+    assert response.status_code == 302
+
+
+def test_login_success_clears_failures(limited_app):
+    client = limited_app.test_client()
+    for _ in range(2):
+        login(client, 'user1@example.com', 'wrong')
+    assert login(client, 'user1@example.com', PASSWORD).status_code == 302
+    client.get('/logout')
+    for _ in range(2):
+        assert login(client, 'user1@example.com', 'wrong').status_code == 200
+    assert login(client, 'user1@example.com', PASSWORD).status_code == 302
+
+
+def test_register_ip_bucket(limited_app):
+    """5 registrations an hour per address"""
+    client = limited_app.test_client()
+    for n in range(5):
+        response = client.post('/register', data={
+            'username': f'new{n}', 'email': f'new{n}@example.com',
+            'password': 'secret', 'confirm_password': 'secret'},
+            environ_base={'REMOTE_ADDR': '10.0.3.1'})
+        assert response.status_code == 302
+    response = client.post('/register', data={
+        'username': 'new5', 'email': 'new5@example.com',
+        'password': 'secret', 'confirm_password': 'secret'},
+        environ_base={'REMOTE_ADDR': '10.0.3.1'})
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '720'
+    # another address may
+    response = client.post('/register', data={
+        'username': 'new6', 'email': 'new6@example.com',
+        'password': 'secret', 'confirm_password': 'secret'},
+        environ_base={'REMOTE_ADDR': '10.0.3.2'})
+    assert response.status_code == 302
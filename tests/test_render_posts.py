@@ -0,0 +1,56 @@
+"""
+render-posts
+    The pages of the rendered posts are served from the new columns.
+"""
+from flaskblog import db
+from flaskblog.models import Post
+from flaskblog.posts.utils import render_posts_command
+
+
+def get(client, path):
+    response = client.get(path)
+    response.get_data()
+    return response
+
+
+def _change_content(app, post_id, content, clear_html):
+    """A script's change of the content, the derived columns left as they were"""
+    with app.app_context():
+        values = {'content': content}
+        if clear_html:
+            values['content_html'] = None
+        db.session.execute(Post.__table__.update().where(Post.id == post_id).values(values))
+        db.session.commit()
+
+
+def test_render_new_posts_invalidates_their_pages(cached_app, cached_client):
+    get(cached_client, '/post/18')
+    _change_content(cached_app, 18, 'Rendered by the command.', clear_html=True)
+    result = cached_app.test_cli_runner().invoke(render_posts_command, [])
+    assert result.exit_code == 0, result.output
+    assert '1 posts rendered' in result.output
+    response = get(cached_client, '/post/18')
+    assert response.headers['X-Cache'] == 'MISS'
+    assert b'Rendered by the command.' in response.data
+
+
+def test_render_all_clears_the_cache(cached_app, cached_client):
+    for path in ('/', '/post/18'):
+        get(cached_client, path)
+    _change_content(cached_app, 18, 'Rendered again.', clear_html=False)
+    result = cached_app.test_cli_runner().invoke(render_posts_command, ['--all'])
+    assert result.exit_code == 0, result.output
+    for path in ('/', '/post/18'):
+        response = get(cached_client, path)
+        assert response.headers['X-Cache'] == 'MISS'
+        assert b'Rendered again.' in response.data
+
+
+def test_render_keeps_date_modified(app):
+    """Rendering is no edit, the feeds and the validators see no change"""
+    with app.app_context():
+        dates = dict(db.session.query(Post.id, Post.date_modified))
+    result = app.test_cli_runner().invoke(render_posts_command, ['--all'])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        assert dict(db.session.query(Post.id, Post.date_modified)) == dates
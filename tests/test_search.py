@@ -0,0 +1,64 @@
+"""
+Search index
+    The fts5 index is written in the transaction that saves the post,
+    pages past the results are a 404.
+"""
+import pytest
+from flaskblog import db
+from flaskblog.models import Post, User
+from flaskblog.search.utils import FTS5Index, search_index
+from flaskblog.signals import post_created, post_updated
+
+
+def _found(q):
+    total, _ = search_index().search(q)
+    return total
+
+
+def test_index_follows_the_post_transaction(app):
+    with app.app_context():
+        assert isinstance(search_index(), FTS5Index)
+        author = User.query.filter_by(username='user1').first()
+        post = Post(title='Zeppelin', content='Airships over the lake.', author=author)
+        db.session.add(post)
+        db.session.flush()
+        assert _found('zeppelin') == 1
+        # rolled back with the post
+        db.session.rollback()
+        assert _found('zeppelin') == 0
+
+        post = Post(title='Zeppelin', content='Airships over the lake.', author=author)
+        db.session.add(post)
+        db.session.commit()
+        assert _found('airships') == 1
+
+        post.title = 'Balloon'
+        db.session.commit()
+        assert (_found('zeppelin'), _found('balloon')) == (0, 1)
+
+        db.session.delete(post)
+        db.session.commit()
+        assert _found('balloon') == 0
+
+
+def test_signals_commit_nothing_of_the_caller(app):
+    """The signal handlers after a post's commit leave the session's other changes alone"""
+    with app.app_context():
+        author = User.query.filter_by(username='user1').first()
+        post = Post(title='Zeppelin', content='Airships.', author=author)
+        db.session.add(post)
+        db.session.commit()
+        post_created.send(app, post=post)
+        # a change the caller has not committed (yet)
+        author.username = 'pending'
+        post_updated.send(app, post=post)
+        db.session.rollback()
+        assert User.query.filter_by(username='pending').first() is None
+        assert _found('airships') == 1
+
+
+@pytest.mark.parametrize('page', [5, 99999999999999999999, 2 ** 63 - 1])
+def test_page_past_the_results(client, page):
+    """The 18 seeded posts match on 4 pages"""
+    assert client.get('/search?q=post&page=4').status_code == 200
+    assert client.get(f'/search?q=post&page={page}').status_code == 404
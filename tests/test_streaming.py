@@ -0,0 +1,52 @@
+"""
+Streamed pages
+    A streamed page is the same document as the page rendered whole,
+    plain and compressed.
+"""
+import gzip
+import pytest
+from flaskblog import db
+from conftest import create_test_app
+
+PATHS = ['/', '/?page=2', '/user/user1', '/feed.atom', '/user/user2/feed.atom']
+
+
+@pytest.fixture
+def whole_app():
+    """The same site, pages rendered whole"""
+    app = create_test_app(STREAM_TEMPLATES=False, STREAM_BUFFER_SIZE=64)
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def streamed_app():
+    """Small pieces, so a page is sent in many"""
+    app = create_test_app(STREAM_TEMPLATES=True, STREAM_BUFFER_SIZE=64)
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.mark.parametrize('path', PATHS)
+def test_streamed_body_equals_whole_body(streamed_app, whole_app, path):
+    streamed = streamed_app.test_client().get(path)
+    pieces = list(streamed.response)
+    whole = whole_app.test_client().get(path)
+    assert streamed.status_code == whole.status_code == 200
+    assert len(pieces) > 2
+    assert b''.join(pieces) == whole.get_data()
+    assert b'<!-- flush -->' not in whole.get_data()
+    assert streamed.headers['ETag'] == whole.headers['ETag']
+
+
+@pytest.mark.parametrize('path', PATHS)
+def test_streamed_gzip_equals_whole_body(streamed_app, whole_app, path):
+    headers = {'Accept-Encoding': 'gzip'}
+    streamed = streamed_app.test_client().get(path, headers=headers)
+    whole = whole_app.test_client().get(path, headers=headers)
+    assert streamed.headers['Content-Encoding'] == whole.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(streamed.get_data()) == gzip.decompress(whole.get_data())
@@ -0,0 +1,104 @@
+"""
+Password reset tokens
+    A token works once, tampered, expired and foreign tokens are rejected,
+    tokens of a rotated secret key still work, a rehash on login ends them.
+"""
+import pytest
+from flaskblog import db
+from flaskblog.models import User
+from flaskblog.users.hashing import _hash
+from flaskblog.users.tokens import reset_token, verify_reset_token
+from conftest import PASSWORD, create_test_app
+
+
+def token_of(app, username='user1'):
+    with app.test_request_context():
+        return reset_token(User.query.filter_by(username=username).first())
+
+
+def reset(client, token, password='changed'):
+    return client.post(f'/reset_password/{token}',
+                       data={'password': password, 'confirm_password': password})
+
+
+def assert_rejected(response):
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/reset_password')
+
+
+def test_token_works_once(app, client):
+    token = token_of(app)
+    assert client.get(f'/reset_password/{token}').status_code == 200
+    response = reset(client, token)
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/login')
+    # the password changed, the same token is used up
+    assert_rejected(client.get(f'/reset_password/{token}'))
+    assert_rejected(reset(client, token, 'again'))
+    # the new password works, the old one doesn't
+    response = client.post('/login', data={'email': 'user1@example.com', 'password': PASSWORD})
+    assert b'Login failed' in response.data
+    response = client.post('/login', data={'email': 'user1@example.com', 'password': 'changed'})
+    assert response.status_code == 302
+
+
+def test_token_of_another_user_still_works(app, client):
+    used, other = token_of(app, 'user1'), token_of(app, 'user2')
+    reset(client, used)
+    assert client.get(f'/reset_password/{other}').status_code == 200
+
+
+@pytest.mark.parametrize('token', ['nonsense', 'a.b.c', 'x' * 400])
+def test_malformed_tokens(client, token):
+    assert_rejected(client.get(f'/reset_password/{token}'))
+
+
+def test_tampered_token(app, client):
+    token = token_of(app)
+    payload, timestamp, signature = token.split('.')
+    flipped = signature[:-1] + ('A' if signature[-1] != 'A' else 'B')
+    assert_rejected(client.get(f'/reset_password/{payload}.{timestamp}.{flipped}'))
+
+
+def test_expired_token(app):
+    token = token_of(app)
+    app.config['RESET_TOKEN_MAX_AGE'] = -1
+    with app.test_request_context():
+        assert verify_reset_token(token) is None
+
+
+def test_rotated_secret_key():
+    app = create_test_app(SECRET_KEY='old-key')
+    try:
+        token = token_of(app)
+        # rotated: new tokens use the new key, the old key's tokens still work
+        app.config['SECRET_KEY'] = 'new-key'
+        app.config['SECRET_KEY_FALLBACKS'] = ['old-key']
+        with app.test_request_context():
+            assert verify_reset_token(token).username == 'user1'
+        # the old key dropped
+        app.config['SECRET_KEY_FALLBACKS'] = []
+        with app.test_request_context():
+            assert verify_reset_token(token) is None
+    finally:
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+
+def test_rehash_on_login(app, client):
+    """A login upgrading an outdated hash is a password change: new version, tokens end"""
+    with app.app_context():
+        user = User.query.filter_by(username='user1').first()
+        user.password = _hash('bcrypt', 5, PASSWORD)
+        db.session.commit()
+        version = user.version
+    token = token_of(app)
+    response = client.post('/login', data={'email': 'user1@example.com', 'password': PASSWORD})
+    assert response.status_code == 302
+    with app.app_context():
+        user = User.query.filter_by(username='user1').first()
+        assert user.password.startswith('$2b$04$')
+        assert user.version == version + 1
+    client.get('/logout')
+    assert_rejected(client.get(f'/reset_password/{token}'))